@@ -10,23 +10,9 @@ import time
 from typing import List, Dict, Any, Optional
 from .sql_utils import execute_query
 
-
-def get_audience(days_since_last_active: int, min_closet_items: int, min_lifetime_trades: int):
-    """
-    Fetches a list of users based on activity and engagement criteria.
-
-    Args:
-        days_since_last_active: The maximum number of days since a user was last active.
-        min_closet_items: The minimum number of items a user must have in their closet (open for trade).
-        min_lifetime_trades: The minimum number of completed trades a user must have.
-
-    Returns:
-        A list of dictionaries, where each dictionary represents a unique user
-        and contains 'user_id', 'email', 'first_name', and 'shoe_size'.
-    """
-    last_active_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days_since_last_active)
-    
-    sql_query = """
+# Engaged users with a preferred mens size, filtered by %(last_active)s, %(min_trades)s
+# and %(min_closet)s. Shared by get_audience and get_audience_with_product_variants.
+AUDIENCE_QUERY = """
         WITH user_closet_counts AS (
             SELECT
                 user_id,
@@ -61,19 +47,274 @@ def get_audience(days_since_last_active: int, min_closet_items: int, min_lifetim
             AND u.deleted_at = 0
             AND u.email IS NOT NULL
             AND u.first_name IS NOT NULL
-            AND usp.shoe_size IS NOT NULL;
+            AND usp.shoe_size IS NOT NULL
     """
+
+
+# Audience-to-variant size matching, shared by get_audience_with_product_variants and
+# get_trending_shoes_rows. Defines sized_audience and variant_stats (one variant per product
+# and numeric size_key); needs %(product_ids)s and %(days_since)s on top of AUDIENCE_QUERY's
+# params. Sizes that are not plain numbers never match.
+VARIANT_SIZE_MATCH_CTES = f"""
+    audience AS (
+        {AUDIENCE_QUERY}
+    ),
+    sized_audience AS (
+        SELECT
+            user_email,
+            user_first_name,
+            shoe_size,
+            CASE WHEN shoe_size ~ '^[0-9]+([.][0-9]+)?$' THEN shoe_size::numeric END AS size_key
+        FROM audience
+    ),
+    variants AS (
+        -- One variant per product and numeric size
+        SELECT DISTINCT ON (pv.product_id, size_key)
+            pv.id AS variant_id,
+            pv.product_id,
+            (pv.index_cache->>'mens_size')::numeric AS size_key
+        FROM product_variants pv
+        WHERE pv.product_id = ANY(%(product_ids)s::uuid[])
+            AND pv.index_cache->>'mens_size' ~ '^[0-9]+([.][0-9]+)?$'
+        ORDER BY pv.product_id, size_key, pv.id
+    ),
+    variant_stats AS (
+        SELECT
+            v.variant_id,
+            v.product_id,
+            v.size_key,
+            (SELECT COUNT(oi.id)
+             FROM offer_items oi
+             JOIN offers o ON oi.offer_id = o.id
+             WHERE oi.product_variant_id = v.variant_id
+                AND oi.offer_item_owner = 'RECEIVER'
+                AND o.created_at >= NOW() - make_interval(days => %(days_since)s)) AS recent_offers_to_get,
+            (SELECT COUNT(ii.id)
+             FROM inventory_items ii
+             WHERE ii.product_variant_id = v.variant_id
+                AND ii.status = 'OPEN_FOR_TRADE') AS total_closet_owners,
+            (SELECT COUNT(wi.id)
+             FROM wishlist_items wi
+             WHERE wi.product_variant_id = v.variant_id
+                AND wi.deleted_at = 0) AS total_wishlist_adds
+        FROM variants v
+    )
+"""
+
+
+def get_audience(days_since_last_active: int, min_closet_items: int, min_lifetime_trades: int,
+                 limit: Optional[int] = None):
+    """
+    Fetches a list of users based on activity and engagement criteria.
+
+    Args:
+        days_since_last_active: The maximum number of days since a user was last active.
+        min_closet_items: The minimum number of items a user must have in their closet (open for trade).
+        min_lifetime_trades: The minimum number of completed trades a user must have.
+        limit: The maximum number of users to return. None returns the whole audience.
+
+    Returns:
+        A list of dictionaries, where each dictionary represents a unique user
+        and contains 'user_id', 'user_email', 'user_first_name', and 'shoe_size'.
+        None if the query fails.
+    """
+    last_active_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days_since_last_active)
+    
+    # LIMIT NULL is the same as no limit in Postgres
+    sql_query = AUDIENCE_QUERY + "    LIMIT %(limit)s\n"
     
     params = {
         "last_active": last_active_date.isoformat(),
         "min_trades": min_lifetime_trades,
-        "min_closet": min_closet_items
+        "min_closet": min_closet_items,
+        "limit": limit
     }
 
     results = execute_query(sql_query, params)
     
     return results
 
+def get_audience_with_product_variants(product_ids: List[str], days_since: int, days_since_last_active: int,
+                                       min_closet_items: int, min_lifetime_trades: int) -> List[Dict[str, Any]]:
+    """
+    Fetches the audience already matched to each product's variant in each user's shoe size.
+
+    The size match runs in the database: the audience query is joined to the products'
+    variants on the numeric size, so only matched rows are sent back instead of the
+    whole audience plus every variant. Sizes that are not plain numbers never match.
+    All products are matched in one query, so the audience is only read once per batch.
+
+    Args:
+        product_ids: The UUIDs of the products whose variants to match.
+        days_since: The lookback period in days for recent variant stats.
+        days_since_last_active: The maximum number of days since a user was last active.
+        min_closet_items: The minimum number of items a user must have in their closet (open for trade).
+        min_lifetime_trades: The minimum number of completed trades a user must have.
+
+    Returns:
+        A list of dictionaries, one per matched user and product, with 'product_id',
+        'user_email', 'user_first_name', 'shoe_size', 'variant_id', 'recent_offers_to_get',
+        'total_closet_owners' and 'total_wishlist_adds'. None if the query fails.
+    """
+    if not product_ids:
+        return []
+
+    last_active_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days_since_last_active)
+
+    sql_query = f"""
+    WITH {VARIANT_SIZE_MATCH_CTES}
+    SELECT
+        vs.product_id::text AS product_id,
+        a.user_email,
+        a.user_first_name,
+        a.shoe_size,
+        vs.variant_id,
+        vs.recent_offers_to_get,
+        vs.total_closet_owners,
+        vs.total_wishlist_adds
+    FROM sized_audience a
+    JOIN variant_stats vs ON vs.size_key = a.size_key;
+    """
+
+    params = {
+        "product_ids": product_ids,
+        "days_since": days_since,
+        "last_active": last_active_date.isoformat(),
+        "min_trades": min_lifetime_trades,
+        "min_closet": min_closet_items
+    }
+
+    return execute_query(sql_query, params)
+
+def get_trending_shoes_rows(product_ids: List[str], days_since: int, days_since_last_active: int,
+                            min_closet_items: int, min_lifetime_trades: int) -> List[Dict[str, Any]]:
+    """
+    Fetches the finished rows for a "Trending Shoes" CSV in a single query.
+
+    The audience is joined in the database to each featured product's variant in the
+    user's numeric shoe size (one LEFT JOIN per product), and users matching none of
+    the products are dropped, so the caller only has to write the rows out.
+
+    Args:
+        product_ids: The product UUIDs to feature, in column order (feat_shoe1, feat_shoe2, ...).
+        days_since: The lookback period in days for recent variant stats.
+        days_since_last_active: The maximum number of days since a user was last active.
+        min_closet_items: The minimum number of items a user must have in their closet (open for trade).
+        min_lifetime_trades: The minimum number of completed trades a user must have.
+
+    Returns:
+        A list of dictionaries, one per matched user, with 'email', 'firstname', 'usersize' and
+        'feat_shoe{i}_variantid', 'feat_shoe{i}_offers_in_size', 'feat_shoe{i}_inventory_in_size',
+        'feat_shoe{i}_wishlist_in_size' for each product (None where the product has no
+        variant in the user's size). None if the query fails.
+    """
+    if not product_ids:
+        return []
+
+    last_active_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days_since_last_active)
+
+    feature_columns = ",".join(f"""
+        s{i}.variant_id AS feat_shoe{i}_variantid,
+        s{i}.recent_offers_to_get AS feat_shoe{i}_offers_in_size,
+        s{i}.total_closet_owners AS feat_shoe{i}_inventory_in_size,
+        s{i}.total_wishlist_adds AS feat_shoe{i}_wishlist_in_size"""
+        for i in range(1, len(product_ids) + 1))
+    feature_joins = "".join(f"""
+    LEFT JOIN variant_stats s{i}
+        ON s{i}.product_id = %(product_id_{i})s::uuid AND s{i}.size_key = a.size_key"""
+        for i in range(1, len(product_ids) + 1))
+    matched_any = " OR ".join(f"s{i}.variant_id IS NOT NULL" for i in range(1, len(product_ids) + 1))
+
+    sql_query = f"""
+    WITH {VARIANT_SIZE_MATCH_CTES}
+    SELECT
+        a.user_email AS email,
+        a.user_first_name AS firstname,
+        a.shoe_size AS usersize,{feature_columns}
+    FROM sized_audience a{feature_joins}
+    WHERE {matched_any};
+    """
+
+    params = {
+        "product_ids": product_ids,
+        "days_since": days_since,
+        "last_active": last_active_date.isoformat(),
+        "min_trades": min_lifetime_trades,
+        "min_closet": min_closet_items,
+        **{f"product_id_{i}": product_id for i, product_id in enumerate(product_ids, 1)}
+    }
+
+    return execute_query(sql_query, params)
+
+def get_whos_hunting_data_by_size(target_sizes: List[str], lookback_days: int) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """
+    Finds the top 3 hunters (most offers created in the lookback window) for each shoe size.
+
+    All sizes are ranked in one query (ANY over the size list) rather than one query per size.
+
+    Args:
+        target_sizes: The mens sizes to find hunters for, as stored in index_cache (e.g. '10.5').
+        lookback_days: The number of days to look back for hunter offer activity.
+
+    Returns:
+        A dictionary mapping each size to its hunters in rank order, each with 'hunter_user_id',
+        'hunter_username', 'hunter_avatar_path', 'hunter_trade_count', 'offers_for_product',
+        'target_product_name' and 'target_product_image_path'. Sizes without hunters are
+        omitted. None if the query fails.
+    """
+    if not target_sizes:
+        return {}
+
+    sql_query = """
+    WITH size_based_hunters AS (
+        SELECT
+            u.id as hunter_user_id,
+            u.username as hunter_username,
+            f.path as hunter_avatar_path,
+            u.completed_trades_count as hunter_trade_count,
+            pv.index_cache->>'mens_size' as size,
+            COUNT(o.id) as offers_for_product,
+            p.name as target_product_name,
+            (SELECT f2.path FROM files f2 WHERE f2.product_id = p.id ORDER BY f2."order" ASC NULLS LAST LIMIT 1) as target_product_image_path,
+            ROW_NUMBER() OVER (
+                PARTITION BY pv.index_cache->>'mens_size'
+                ORDER BY COUNT(o.id) DESC, u.completed_trades_count DESC
+            ) as hunter_rank
+        FROM users u
+        LEFT JOIN files f ON u.avatar_id = f.id
+        JOIN offers o ON u.id = o.creator_user_id
+        JOIN offer_items oi ON o.id = oi.offer_id
+        JOIN product_variants pv ON oi.product_variant_id = pv.id
+        JOIN products p ON pv.product_id = p.id
+        WHERE o.created_at >= NOW() - make_interval(days => %(lookback_days)s)
+        AND pv.index_cache->>'mens_size' = ANY(%(target_sizes)s::text[])
+        AND u.deleted_at = 0
+        GROUP BY u.id, u.username, f.path, u.completed_trades_count, pv.index_cache->>'mens_size', p.name, p.id
+    )
+    SELECT
+        size,
+        hunter_user_id,
+        hunter_username,
+        hunter_avatar_path,
+        hunter_trade_count,
+        offers_for_product,
+        target_product_name,
+        target_product_image_path
+    FROM size_based_hunters
+    WHERE hunter_rank <= 3
+    ORDER BY size, hunter_rank;
+    """
+
+    params = {'target_sizes': target_sizes, 'lookback_days': lookback_days}
+    results = execute_query(sql_query, params)
+    if results is None:
+        return None
+
+    hunters_by_size: Dict[str, List[Dict[str, Any]]] = {}
+    for row in results:
+        hunters_by_size.setdefault(row.pop('size'), []).append(dict(row))
+    return hunters_by_size
+
 def get_products_by_ids(product_ids: List[str], days_since: int) -> List[Dict[str, Any]]:
     """
     Fetches detailed data for a list of products, including recent interaction stats.
@@ -321,4 +562,56 @@ def get_top_target_shoe_for_users(user_ids: List[str]) -> List[Dict[str, Any]]:
     WHERE rn = 1;
     """
     params = {'user_ids': user_ids}
-    return execute_query(query, params) 
\ No newline at end of file
+    return execute_query(query, params)
+
+
+def get_top_prospects_rows(user_ids: List[str]) -> List[Dict[str, Any]]:
+    """
+    Fetches basic user data and each user's top target shoe in a single query.
+
+    Combines get_user_data_by_ids and get_top_target_shoe_for_users: users missing
+    basic data are left out, and users with no desired items come back with NULL
+    top_target_shoe_* columns so the caller can tell the two cases apart.
+    """
+    if not user_ids:
+        return []
+
+    query = """
+    WITH user_info AS (
+        SELECT DISTINCT ON (u.id)
+            u.id AS user_id,
+            u.email,
+            u.first_name,
+            av.value AS user_size
+        FROM users u
+        LEFT JOIN user_preferences up ON u.id = up.user_id
+        LEFT JOIN attribute_preferences ap ON up.id = ap.user_preference_id
+        LEFT JOIN attributes a ON ap.attribute_id = a.id AND a.name = 'mens_size'
+        LEFT JOIN attribute_values av ON ap.attribute_value_id = av.id
+        WHERE u.id = ANY(%(user_ids)s::uuid[]) AND ap.preferred = TRUE
+        -- Prefer the mens_size preference, then the lowest value, so the pick is deterministic
+        ORDER BY u.id, (a.id IS NULL), av.value
+    ),
+    ranked_desired_items AS (
+        SELECT
+            di.user_id,
+            di.product_variant_id,
+            p.name as product_name,
+            ROW_NUMBER() OVER(PARTITION BY di.user_id ORDER BY di.offers_count DESC, di.created_at DESC) as rn
+        FROM desired_items di
+        JOIN product_variants pv ON di.product_variant_id = pv.id
+        JOIN products p ON pv.product_id = p.id
+        WHERE di.user_id IN (SELECT user_id FROM user_info) AND di.deleted_at = 0
+    )
+    SELECT
+        ui.user_id,
+        ui.email,
+        ui.first_name,
+        ui.user_size,
+        rdi.product_variant_id as top_target_shoe_variantid,
+        rdi.product_name as top_target_shoe_name
+    FROM user_info ui
+    LEFT JOIN ranked_desired_items rdi ON rdi.user_id = ui.user_id AND rdi.rn = 1;
+    """
+    params = {'user_ids': user_ids}
+    return execute_query(query, params)
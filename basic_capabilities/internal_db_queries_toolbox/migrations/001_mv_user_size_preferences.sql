@@ -0,0 +1,29 @@
+-- Create mv_user_size_preferences materialized view
+-- Migration: 001_mv_user_size_preferences.sql
+-- Purpose: Precompute each user's preferred mens_size instead of re-running the
+--          4-way user_preferences/attribute_preferences/attributes/attribute_values
+--          join inside every push audience query
+--
+-- MIGRATION NOTES:
+-- - Runs against the main application database (not the push-cadence database)
+-- - Safe to run multiple times (IF NOT EXISTS)
+-- - The unique index is required for REFRESH MATERIALIZED VIEW CONCURRENTLY
+-- - Preference data is close to static; refresh nightly, e.g. with pg_cron:
+--     SELECT cron.schedule('refresh-mv-user-size-preferences', '0 7 * * *',
+--       'REFRESH MATERIALIZED VIEW CONCURRENTLY mv_user_size_preferences');
+--
+-- Used by: push_csv_queries.get_users_with_trending_products, get_new_users_in_window
+-- Created: 2026-10-16
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_user_size_preferences AS
+SELECT DISTINCT
+  up.user_id,
+  av.value AS shoe_size
+FROM user_preferences up
+JOIN attribute_preferences ap ON up.id = ap.user_preference_id
+JOIN attributes a ON ap.attribute_id = a.id
+JOIN attribute_values av ON ap.attribute_value_id = av.id
+WHERE a.name = 'mens_size' AND ap.preferred = TRUE;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_user_size_preferences_user_id
+  ON mv_user_size_preferences (user_id, shoe_size);
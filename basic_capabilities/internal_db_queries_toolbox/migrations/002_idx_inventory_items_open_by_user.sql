@@ -0,0 +1,21 @@
+-- Create partial covering index for OPEN_FOR_TRADE inventory lookups
+-- Migration: 002_idx_inventory_items_open_by_user.sql
+-- Purpose: Serve the per-user "open for trade" inventory lookups as index-only scans.
+--          Only OPEN_FOR_TRADE rows are indexed, so the index stays small and
+--          the status filter costs nothing at query time
+--
+-- MIGRATION NOTES:
+-- - Runs against the main application database (not the push-cadence database)
+-- - CONCURRENTLY avoids locking writes to inventory_items, but cannot run inside a
+--   transaction block; run this file on its own (e.g. psql -f), not wrapped in BEGIN
+-- - Safe to run multiple times (IF NOT EXISTS); if a concurrent build fails it leaves
+--   an INVALID index behind - drop it and re-run
+-- - Verify with EXPLAIN (ANALYZE, BUFFERS) on get_users_with_trending_products: the
+--   LATERAL subquery should show "Index Only Scan using ii_open_by_user"
+--
+-- Used by: push_csv_queries.get_users_with_trending_products
+-- Created: 2026-10-16
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ii_open_by_user
+  ON inventory_items (user_id, product_variant_id)
+  WHERE status = 'OPEN_FOR_TRADE';
@@ -0,0 +1,65 @@
+-- Create mv_user_first_actions materialized view
+-- Migration: 003_mv_user_first_actions.sql
+-- Purpose: Precompute each new user's join date and whether they added to their
+--          closet, added to their wishlist and created an offer within 72 hours, so
+--          cohort analysis reads one row per user instead of joining users against
+--          inventory_items, wishlist_items and offers on every call
+--
+-- MIGRATION NOTES:
+-- - Runs against the main application database (not the push-cadence database)
+-- - Safe to run multiple times (IF NOT EXISTS)
+-- - The unique index is required for REFRESH MATERIALIZED VIEW CONCURRENTLY
+-- - A user's 72-hour completion status never changes once the window has passed;
+--   refresh nightly, e.g. with pg_cron:
+--     SELECT cron.schedule('refresh-mv-user-first-actions', '30 7 * * *',
+--       'REFRESH MATERIALIZED VIEW CONCURRENTLY mv_user_first_actions');
+-- - refreshed_at is stamped on every row so readers can report staleness
+-- - cohort_month/cohort_week live here rather than as generated columns on users:
+--   DATE_TRUNC on a timestamptz is not IMMUTABLE, and adding a STORED column would
+--   rewrite users under an ACCESS EXCLUSIVE lock
+--
+-- Used by: projects/analytics-foundation/cohort_analysis_queries.py
+-- Created: 2026-10-16
+
+-- Each completion flag is an EXISTS probe bounded to the 72-hour window, so it stops
+-- at the first qualifying row (a single seek on the 004 (user_id, created_at) indexes)
+-- instead of reading every event row to find the MIN
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_user_first_actions AS
+-- Filter users once up front (MATERIALIZED keeps it a fenced, one-time scan) so the
+-- probes below only run against live users who joined since launch; the 72-hour
+-- deadline is computed here once per user rather than in each probe
+WITH users_live AS MATERIALIZED (
+  SELECT id, created_at, created_at + INTERVAL '72 hours' AS deadline_72h
+  FROM users
+  WHERE created_at >= '2025-03-05'::date
+    AND deleted_at = 0
+)
+SELECT
+  u.id AS user_id,
+  u.created_at AS join_date,
+  -- Cohort buckets are fixed once a user exists, so truncate at refresh time
+  DATE_TRUNC('month', u.created_at) AS cohort_month,
+  DATE_TRUNC('week', u.created_at) AS cohort_week,
+  EXISTS (
+    SELECT 1 FROM inventory_items ii
+    WHERE ii.user_id = u.id AND ii.deleted_at = 0
+      AND ii.created_at <= u.deadline_72h
+  ) AS closet_72h,
+  EXISTS (
+    SELECT 1 FROM wishlist_items wi
+    WHERE wi.user_id = u.id AND wi.deleted_at = 0
+      AND wi.created_at <= u.deadline_72h
+  ) AS wishlist_72h,
+  EXISTS (
+    SELECT 1 FROM offers o
+    WHERE o.creator_user_id = u.id AND o.deleted_at = 0
+      AND o.created_at <= u.deadline_72h
+  ) AS offer_72h,
+  NOW() AS refreshed_at
+FROM users_live u;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_user_first_actions_user_id
+  ON mv_user_first_actions (user_id);
+
+CREATE INDEX IF NOT EXISTS idx_mv_user_first_actions_join_date
+  ON mv_user_first_actions (join_date);
@@ -0,0 +1,32 @@
+-- Create partial covering indexes for cohort analysis scans
+-- Migration: 004_idx_cohort_live_rows.sql
+-- Purpose: Let the per-user first-action lookups and the new-user scan behind
+--          mv_user_first_actions run as index-only scans over live
+--          (deleted_at = 0) rows instead of sequential scans
+--
+-- MIGRATION NOTES:
+-- - Runs against the main application database (not the push-cadence database)
+-- - CONCURRENTLY avoids locking writes, but cannot run inside a transaction block;
+--   run this file on its own (e.g. psql -f), not wrapped in BEGIN
+-- - Safe to run multiple times (IF NOT EXISTS); if a concurrent build fails it leaves
+--   an INVALID index behind - drop it and re-run
+--
+-- Used by: 003_mv_user_first_actions.sql (refresh),
+--          projects/analytics-foundation/cohort_analysis_queries.py
+-- Created: 2026-10-16
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ii_user_live
+  ON inventory_items (user_id, created_at)
+  WHERE deleted_at = 0;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_wi_user_live
+  ON wishlist_items (user_id, created_at)
+  WHERE deleted_at = 0;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_offers_creator_live
+  ON offers (creator_user_id, created_at)
+  WHERE deleted_at = 0;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_live_created
+  ON users (created_at) INCLUDE (id)
+  WHERE deleted_at = 0;
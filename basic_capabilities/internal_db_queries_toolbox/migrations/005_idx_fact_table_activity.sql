@@ -0,0 +1,35 @@
+-- Create indexes for the new-user fact table export
+-- Migration: 005_idx_fact_table_activity.sql
+-- Purpose: Let the per-table MIN(...) GROUP BY user_id aggregates and the new-user
+--          id scan in generate_new_user_fact_table.py run as index-only scans.
+--          inventory_items and wishlist_items are already covered by the
+--          (user_id, created_at) WHERE deleted_at = 0 indexes from migration 004
+--
+-- MIGRATION NOTES:
+-- - Runs against the main application database (not the push-cadence database)
+-- - CONCURRENTLY avoids locking writes, but cannot run inside a transaction block;
+--   run this file on its own (e.g. psql -f), not wrapped in BEGIN
+-- - Safe to run multiple times (IF NOT EXISTS); if a concurrent build fails it leaves
+--   an INVALID index behind - drop it and re-run
+-- - First-offer-posted counts deleted offers too, so it cannot use the partial
+--   ix_offers_creator_live index from 004 and gets a full one here
+--
+-- Used by: projects/analytics-foundation/generate_new_user_fact_table.py
+-- Created: 2026-10-16
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_offers_creator_created
+  ON offers (creator_user_id, created_at);
+
+-- First offer confirmed is looked up from both sides of the trade
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_offers_creator_confirmed
+  ON offers (creator_user_id, confirmed_trade_date)
+  WHERE offer_status = 'COMPLETED' AND confirmed_trade_date IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_offers_receiver_confirmed
+  ON offers (receiver_user_id, confirmed_trade_date)
+  WHERE offer_status = 'COMPLETED' AND confirmed_trade_date IS NOT NULL;
+
+-- Matches get_new_user_ids' filter and (created_at, id) ordering
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_live_named_created
+  ON users (created_at, id)
+  WHERE deleted_at = 0 AND username IS NOT NULL;
@@ -5,15 +5,38 @@ This module contains reusable query functions for generating push notification a
 Functions are designed to be modular, efficient, and leverage existing query-building-blocks patterns.
 """
 
+import csv
+import io
+import logging
 import os
 import sys
-from typing import List, Dict, Any, Optional
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Dict, Any, FrozenSet, Optional, Set, Tuple
 from datetime import datetime, timedelta
 
 # Add the project root to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from basic_capabilities.internal_db_queries_toolbox.sql_utils import execute_query
+from basic_capabilities.internal_db_queries_toolbox.sql_utils import execute_query, execute_prepared, export_query_to_csv
+
+logger = logging.getLogger(__name__)
+
+_ORDINAL_SUFFIXES = {1: 'st', 2: 'nd', 3: 'rd'}
+
+# Audience queries hash-join users/inventory/wishlist and spill to disk at the default
+# work_mem; these transaction-local overrides keep the hashes in memory
+AUDIENCE_QUERY_SETTINGS = {'work_mem': '256MB', 'jit': 'off'}
+
+# Keeps a stuck query from stalling a whole new-user waterfall run
+WATERFALL_QUERY_SETTINGS = {'statement_timeout': 60000}
+
+# Upper bound for ad-hoc debug pulls of raw inventory rows
+DEBUG_RAW_INVENTORY_MAX_LIMIT = 1000
+
+# Showcase stats only shift minute-to-minute, so reuse them within a 5-minute bucket
+SHOWCASE_STATS_TTL_SECONDS = 300
 
 
 def get_daily_activity_data(lookback_hours: int = 24) -> List[Dict[str, Any]]:
@@ -102,7 +125,7 @@ def get_daily_activity_data(lookback_hours: int = 24) -> List[Dict[str, Any]]:
     """
     
     params = {'lookback_hours': lookback_hours}
-    return execute_query(query, params)
+    return execute_query(query, params, settings=AUDIENCE_QUERY_SETTINGS)
 
 
 def get_user_profile_data_by_ids(user_ids: List[str]) -> List[Dict[str, Any]]:
@@ -243,9 +266,8 @@ def get_bulk_variant_inventory_counts(variant_ids: List[str]) -> Dict[str, int]:
     results = execute_query(query, params)
     
     # Create lookup dictionary, defaulting to 0 for variants with no inventory
-    counts = {variant_id: 0 for variant_id in variant_ids}
-    for row in results:
-        counts[row['product_variant_id']] = row['inventory_count']
+    counts = dict.fromkeys(variant_ids, 0)
+    counts.update((row['product_variant_id'], row['inventory_count']) for row in results)
     
     return counts
 
@@ -282,9 +304,8 @@ def get_bulk_variant_wishlist_counts(variant_ids: List[str]) -> Dict[str, int]:
     results = execute_query(query, params)
     
     # Create lookup dictionary, defaulting to 0 for variants with no wishlist items
-    counts = {variant_id: 0 for variant_id in variant_ids}
-    for row in results:
-        counts[row['product_variant_id']] = row['wishlist_count']
+    counts = dict.fromkeys(variant_ids, 0)
+    counts.update((row['product_variant_id'], row['wishlist_count']) for row in results)
     
     return counts
 
@@ -391,11 +412,8 @@ def get_bulk_variant_sizes(variant_ids: List[str]) -> Dict[str, str]:
     results = execute_query(query, params)
     
     # Create lookup dictionary, defaulting to 'Unknown' for variants with no size data
-    sizes = {variant_id: 'Unknown' for variant_id in variant_ids}
-    for row in results:
-        size = row.get('size')
-        if size:
-            sizes[row['variant_id']] = size
+    sizes = dict.fromkeys(variant_ids, 'Unknown')
+    sizes.update((row['variant_id'], row['size']) for row in results if row['size'])
     
     return sizes
 
@@ -430,12 +448,9 @@ def get_bulk_variant_offers_7d(variant_ids: List[str]) -> Dict[str, int]:
     params = {'variant_ids': variant_ids}
     results = execute_query(query, params)
     
-    # Initialize all variants with 0 counts
-    counts = {variant_id: 0 for variant_id in variant_ids}
-    
-    # Update with actual counts
-    for row in results:
-        counts[row['variant_id']] = row['variant_offers_7d']
+    # Initialize all variants with 0 counts, then overlay actual counts
+    counts = dict.fromkeys(variant_ids, 0)
+    counts.update((row['variant_id'], row['variant_offers_7d']) for row in results)
     
     return counts
 
@@ -473,12 +488,9 @@ def get_bulk_variant_open_offers_targeting(variant_ids: List[str]) -> Dict[str,
     params = {'variant_ids': variant_ids}
     results = execute_query(query, params)
     
-    # Initialize all variants with 0 counts
-    counts = {variant_id: 0 for variant_id in variant_ids}
-    
-    # Update with actual counts
-    for row in results:
-        counts[row['variant_id']] = row['variant_open_offers']
+    # Initialize all variants with 0 counts, then overlay actual counts
+    counts = dict.fromkeys(variant_ids, 0)
+    counts.update((row['variant_id'], row['variant_open_offers']) for row in results)
     
     return counts
 
@@ -490,6 +502,10 @@ def get_product_showcase_stats(product_id: str) -> Dict[str, Any]:
     Adapted from building block #9 "Product Details with Recent Statistics" 
     with custom lookback periods: 7 days for offers, 30 days for trades.
     
+    Results are cached per product for up to SHOWCASE_STATS_TTL_SECONDS, since the
+    counts only drift minute-to-minute. Call _showcase_stats_cache.cache_clear()
+    to force a fresh read.
+    
     Args:
         product_id: UUID of the product to analyze
         
@@ -497,25 +513,53 @@ def get_product_showcase_stats(product_id: str) -> Dict[str, Any]:
         Dictionary with product_offers_7d and product_trades_30d
     """
     
+    time_bucket = int(time.time() // SHOWCASE_STATS_TTL_SECONDS)
+    try:
+        # Hand back a copy so callers can't mutate the cached row
+        return dict(_showcase_stats_cache(product_id, time_bucket))
+    except LookupError:
+        return {'product_offers_7d': 0, 'product_trades_30d': 0}
+
+
+@lru_cache(maxsize=1024)
+def _showcase_stats_cache(product_id: str, time_bucket: int) -> Dict[str, Any]:
+    """
+    Cached query behind get_product_showcase_stats, keyed by (product_id, time_bucket).
+    
+    Raises LookupError when the query fails or finds no product, so that
+    empty results are never cached.
+    """
+    
+    # Independent subqueries avoid the row multiplication of a 4-way LEFT JOIN
     query = """
     SELECT 
         p.id as product_id,
         p.name as product_name,
-        COUNT(DISTINCT CASE WHEN o.created_at >= NOW() - INTERVAL '7 days' THEN oi.offer_id END) as product_offers_7d,
-        COUNT(DISTINCT CASE WHEN t.validation_passed_date >= NOW() - INTERVAL '30 days' 
-                               AND t.validation_passed_date IS NOT NULL THEN t.id END) as product_trades_30d
+        (
+            SELECT COUNT(DISTINCT oi.offer_id)
+            FROM product_variants pv
+            JOIN offer_items oi ON pv.id = oi.product_variant_id
+            JOIN offers o ON oi.offer_id = o.id
+            WHERE pv.product_id = p.id
+            AND o.created_at >= NOW() - INTERVAL '7 days'
+        ) as product_offers_7d,
+        (
+            SELECT COUNT(DISTINCT t.id)
+            FROM product_variants pv
+            JOIN offer_items oi ON pv.id = oi.product_variant_id
+            JOIN trades t ON oi.offer_id = t.offer_id
+            WHERE pv.product_id = p.id
+            AND t.validation_passed_date >= NOW() - INTERVAL '30 days'
+        ) as product_trades_30d
     FROM products p
-    LEFT JOIN product_variants pv ON p.id = pv.product_id
-    LEFT JOIN offer_items oi ON pv.id = oi.product_variant_id
-    LEFT JOIN offers o ON oi.offer_id = o.id
-    LEFT JOIN trades t ON o.id = t.offer_id
     WHERE p.id = %(product_id)s
-    GROUP BY p.id, p.name
     """
     
     params = {'product_id': product_id}
     result = execute_query(query, params)
-    return result[0] if result else {'product_offers_7d': 0, 'product_trades_30d': 0}
+    if not result:
+        raise LookupError(f"No showcase stats available for product {product_id}")
+    return result[0]
 
 
 def get_showcase_audience_haves(product_id: str, activity_days: int = 90) -> List[Dict[str, Any]]:
@@ -567,8 +611,9 @@ def get_showcase_audience_haves(product_id: str, activity_days: int = 90) -> Lis
     """
     
     try:
-        result = execute_query(query, {})
-        print(f"👥 Found {len(result)} users who HAVE the focus product (OPEN_FOR_TRADE)")
+        result = execute_query(query, {}, settings=AUDIENCE_QUERY_SETTINGS) or []
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Found %d users who HAVE the focus product (OPEN_FOR_TRADE)", len(result))
         return result
     except Exception as e:
         print(f"Error fetching 'haves' audience: {e}")
@@ -624,8 +669,9 @@ def get_showcase_audience_wants(product_id: str, activity_days: int = 90) -> Lis
     """
     
     try:
-        result = execute_query(query, {})
-        print(f"💭 Found {len(result)} users who WANT the focus product (wishlist)")
+        result = execute_query(query, {}, settings=AUDIENCE_QUERY_SETTINGS) or []
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Found %d users who WANT the focus product (wishlist)", len(result))
         return result
     except Exception as e:
         print(f"Error fetching 'wants' audience: {e}")
@@ -659,25 +705,6 @@ def get_showcase_audience_everybody_else(product_id: str, activity_days: int = 9
         JOIN attributes a ON ap.attribute_id = a.id
         JOIN attribute_values av ON ap.attribute_value_id = av.id
         WHERE a.name = 'mens_size' AND ap.preferred = TRUE
-    ),
-    users_with_product AS (
-        -- Users who have it in closet
-        SELECT DISTINCT u.id as user_id
-        FROM users u
-        JOIN inventory_items ii ON u.id = ii.user_id
-        JOIN product_variants pv ON ii.product_variant_id = pv.id
-        WHERE ii.status = 'OPEN_FOR_TRADE'
-        AND pv.product_id = '{product_id}'
-        
-        UNION
-        
-        -- Users who want it (wishlist)
-        SELECT DISTINCT u.id as user_id
-        FROM users u
-        JOIN wishlist_items wi ON u.id = wi.user_id
-        JOIN product_variants pv ON wi.product_variant_id = pv.id
-        WHERE wi.deleted_at = 0
-        AND pv.product_id = '{product_id}'
     )
     SELECT 
         u.id as user_id,
@@ -688,7 +715,6 @@ def get_showcase_audience_everybody_else(product_id: str, activity_days: int = 9
     FROM users u
     JOIN user_activities ua ON u.id = ua.user_id
     JOIN user_size_preferences usp ON u.id = usp.user_id
-    LEFT JOIN users_with_product uwp ON u.id = uwp.user_id
     LEFT JOIN product_variants pv ON pv.product_id = '{product_id}' 
         AND pv.index_cache->>'mens_size' = usp.shoe_size
     WHERE u.deleted_at = 0
@@ -696,13 +722,31 @@ def get_showcase_audience_everybody_else(product_id: str, activity_days: int = 9
     AND u.first_name IS NOT NULL
     AND usp.shoe_size IS NOT NULL
     AND ua.last_active >= NOW() - INTERVAL '{activity_hours} hours'
-    AND uwp.user_id IS NULL  -- Exclude users who have or want the product
     AND pv.id IS NOT NULL  -- Ensure we found a variant for their size
+    -- Exclude users who have the product in their closet
+    AND NOT EXISTS (
+        SELECT 1
+        FROM inventory_items ii
+        JOIN product_variants ipv ON ii.product_variant_id = ipv.id
+        WHERE ii.user_id = u.id
+        AND ii.status = 'OPEN_FOR_TRADE'
+        AND ipv.product_id = '{product_id}'
+    )
+    -- Exclude users who want the product (wishlist)
+    AND NOT EXISTS (
+        SELECT 1
+        FROM wishlist_items wi
+        JOIN product_variants wpv ON wi.product_variant_id = wpv.id
+        WHERE wi.user_id = u.id
+        AND wi.deleted_at = 0
+        AND wpv.product_id = '{product_id}'
+    )
     """
     
     try:
-        result = execute_query(query, {})
-        print(f"🌍 Found {len(result)} users who are EVERYBODY ELSE (with variant IDs for their preferred sizes)")
+        result = execute_query(query, {}, settings=AUDIENCE_QUERY_SETTINGS) or []
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Found %d users who are EVERYBODY ELSE (with variant IDs for their preferred sizes)", len(result))
         return result
     except Exception as e:
         print(f"Error fetching 'everybody else' audience: {e}")
@@ -720,50 +764,40 @@ def debug_inventory_breakdown(variant_id: str) -> Dict[str, Any]:
         Dictionary with comprehensive inventory status breakdown
     """
     
+    # Postgres returns the final breakdown shape directly; NULL deleted_at (orphaned
+    # items from the LEFT JOIN) counts as a deleted user, matching the active-user filter.
     query = """
+    WITH status_counts AS (
+        SELECT 
+            ii.status,
+            COUNT(*) as total,
+            COUNT(*) FILTER (WHERE u.deleted_at = 0) as active_users,
+            COUNT(*) FILTER (WHERE u.deleted_at IS DISTINCT FROM 0) as deleted_users
+        FROM inventory_items ii
+        LEFT JOIN users u ON ii.user_id = u.id
+        WHERE ii.product_variant_id = %(variant_id)s
+        GROUP BY ii.status
+    )
     SELECT 
-        ii.status,
-        u.deleted_at,
-        COUNT(*) as count
-    FROM inventory_items ii
-    LEFT JOIN users u ON ii.user_id = u.id
-    WHERE ii.product_variant_id = %(variant_id)s
-    GROUP BY ii.status, u.deleted_at
-    ORDER BY ii.status, u.deleted_at NULLS FIRST
+        COALESCE(SUM(total), 0)::int as total_lifetime_adds,
+        COALESCE(jsonb_object_agg(status, total), '{}'::jsonb) as by_status,
+        COALESCE(jsonb_object_agg(status, active_users) FILTER (WHERE active_users > 0), '{}'::jsonb) as active_users_only,
+        COALESCE(jsonb_object_agg(status, deleted_users) FILTER (WHERE deleted_users > 0), '{}'::jsonb) as deleted_users_only
+    FROM status_counts
     """
     
     params = {'variant_id': variant_id}
-    results = execute_query(query, params)
+    result = execute_query(query, params)
     
-    # Organize results into a readable format
-    breakdown = {
-        'total_lifetime_adds': 0,
-        'by_status': {},
-        'active_users_only': {},
-        'deleted_users_only': {}
-    }
-    
-    for row in results:
-        status = row['status']
-        deleted_at = row['deleted_at']
-        count = row['count']
-        
-        breakdown['total_lifetime_adds'] += count
-        
-        if status not in breakdown['by_status']:
-            breakdown['by_status'][status] = 0
-        breakdown['by_status'][status] += count
-        
-        if deleted_at == 0:  # Active users
-            if status not in breakdown['active_users_only']:
-                breakdown['active_users_only'][status] = 0
-            breakdown['active_users_only'][status] += count
-        else:  # Deleted users
-            if status not in breakdown['deleted_users_only']:
-                breakdown['deleted_users_only'][status] = 0
-            breakdown['deleted_users_only'][status] += count
+    if not result:
+        return {
+            'total_lifetime_adds': 0,
+            'by_status': {},
+            'active_users_only': {},
+            'deleted_users_only': {}
+        }
     
-    return breakdown
+    return dict(result[0])
 
 
 def debug_wishlist_breakdown(variant_id: str) -> Dict[str, Any]:
@@ -779,39 +813,29 @@ def debug_wishlist_breakdown(variant_id: str) -> Dict[str, Any]:
     
     query = """
     SELECT 
-        CASE WHEN wi.deleted_at = 0 THEN 'active' ELSE 'deleted' END as wishlist_status,
-        CASE WHEN u.deleted_at = 0 THEN 'active_user' ELSE 'deleted_user' END as user_status,
-        COUNT(*) as count
+        COUNT(*)::int as total_lifetime_adds,
+        COUNT(*) FILTER (WHERE wi.deleted_at = 0 AND u.deleted_at = 0)::int as active_wishlist_active_user,
+        COUNT(*) FILTER (WHERE wi.deleted_at = 0 AND u.deleted_at IS DISTINCT FROM 0)::int as active_wishlist_deleted_user,
+        COUNT(*) FILTER (WHERE wi.deleted_at IS DISTINCT FROM 0 AND u.deleted_at = 0)::int as deleted_wishlist_active_user,
+        COUNT(*) FILTER (WHERE wi.deleted_at IS DISTINCT FROM 0 AND u.deleted_at IS DISTINCT FROM 0)::int as deleted_wishlist_deleted_user
     FROM wishlist_items wi
     LEFT JOIN users u ON wi.user_id = u.id
     WHERE wi.product_variant_id = %(variant_id)s
-    GROUP BY 
-        CASE WHEN wi.deleted_at = 0 THEN 'active' ELSE 'deleted' END,
-        CASE WHEN u.deleted_at = 0 THEN 'active_user' ELSE 'deleted_user' END
-    ORDER BY wishlist_status, user_status
     """
     
     params = {'variant_id': variant_id}
-    results = execute_query(query, params)
+    result = execute_query(query, params)
     
-    # Organize results into a readable format
-    breakdown = {
-        'total_lifetime_adds': 0,
-        'active_wishlist_active_user': 0,
-        'active_wishlist_deleted_user': 0,
-        'deleted_wishlist_active_user': 0,
-        'deleted_wishlist_deleted_user': 0
-    }
-    
-    for row in results:
-        wishlist_status = row['wishlist_status']
-        user_status = row['user_status']
-        count = row['count']
-        
-        breakdown['total_lifetime_adds'] += count
-        breakdown[f'{wishlist_status}_wishlist_{user_status}'] = count
+    if not result:
+        return {
+            'total_lifetime_adds': 0,
+            'active_wishlist_active_user': 0,
+            'active_wishlist_deleted_user': 0,
+            'deleted_wishlist_active_user': 0,
+            'deleted_wishlist_deleted_user': 0
+        }
     
-    return breakdown
+    return dict(result[0])
 
 
 def debug_raw_inventory_data(variant_id: str, limit: int = 20) -> List[Dict[str, Any]]:
@@ -820,12 +844,14 @@ def debug_raw_inventory_data(variant_id: str, limit: int = 20) -> List[Dict[str,
     
     Args:
         variant_id: UUID of the product variant to analyze
-        limit: Maximum number of records to return
+        limit: Maximum number of records to return (clamped to 1..DEBUG_RAW_INVENTORY_MAX_LIMIT)
         
     Returns:
         List of raw inventory records with user and status info
     """
     
+    limit = max(1, min(int(limit), DEBUG_RAW_INVENTORY_MAX_LIMIT))
+    
     query = """
     SELECT 
         ii.id as inventory_id,
@@ -862,39 +888,55 @@ def get_trending_products_weekly(lookback_days: int = 7, limit: int = 20) -> Lis
     # Convert days to hours
     lookback_hours = lookback_days * 24
     
-    # Use f-string to avoid parameter mixing issues
-    query = f"""
+    # Rank once over the pre-limited product counts; ordinal suffixes are formatted in Python
+    query = """
+    WITH ranked AS (
+        SELECT 
+            p.id as product_id,
+            p.name as product_name,
+            COUNT(DISTINCT oi.offer_id) as offer_count
+        FROM products p
+        JOIN product_variants pv ON p.id = pv.product_id
+        JOIN offer_items oi ON pv.id = oi.product_variant_id
+        JOIN offers o ON oi.offer_id = o.id
+        WHERE o.created_at >= NOW() - %(lookback_hours)s * INTERVAL '1 hour'
+        GROUP BY p.id, p.name
+        HAVING COUNT(DISTINCT oi.offer_id) > 0
+        ORDER BY offer_count DESC
+        LIMIT %(limit)s
+    )
     SELECT 
-        p.id as product_id,
-        p.name as product_name,
-        COUNT(DISTINCT oi.offer_id) as offer_count,
-        ROW_NUMBER() OVER (ORDER BY COUNT(DISTINCT oi.offer_id) DESC) as rank_number,
-        CASE 
-            WHEN ROW_NUMBER() OVER (ORDER BY COUNT(DISTINCT oi.offer_id) DESC) = 1 THEN '1st'
-            WHEN ROW_NUMBER() OVER (ORDER BY COUNT(DISTINCT oi.offer_id) DESC) = 2 THEN '2nd' 
-            WHEN ROW_NUMBER() OVER (ORDER BY COUNT(DISTINCT oi.offer_id) DESC) = 3 THEN '3rd'
-            ELSE CONCAT(ROW_NUMBER() OVER (ORDER BY COUNT(DISTINCT oi.offer_id) DESC)::text, 'th')
-        END as trending_rank
-    FROM products p
-    JOIN product_variants pv ON p.id = pv.product_id
-    JOIN offer_items oi ON pv.id = oi.product_variant_id
-    JOIN offers o ON oi.offer_id = o.id
-    WHERE o.created_at >= NOW() - INTERVAL '{lookback_hours} hours'
-    GROUP BY p.id, p.name
-    HAVING COUNT(DISTINCT oi.offer_id) > 0
-    ORDER BY COUNT(DISTINCT oi.offer_id) DESC
-    LIMIT {limit}
+        product_id,
+        product_name,
+        offer_count,
+        ROW_NUMBER() OVER (ORDER BY offer_count DESC) as rank_number
+    FROM ranked
+    ORDER BY rank_number
     """
     
+    params = {'lookback_hours': lookback_hours, 'limit': limit}
+    
     try:
-        result = execute_query(query, {})
-        print(f"🔥 Found {len(result)} trending products from past {lookback_days} days")
+        result = execute_query(query, params, settings=AUDIENCE_QUERY_SETTINGS)
+        for row in result:
+            row['trending_rank'] = _format_ordinal(row['rank_number'])
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Found %d trending products from past %d days", len(result), lookback_days)
         return result
     except Exception as e:
         print(f"Error fetching trending products: {e}")
         return []
 
 
+def _format_ordinal(number: int) -> str:
+    """
+    Formats a rank number as an ordinal string (1st, 2nd, 3rd, 4th, 11th, 21st...).
+    """
+    if 10 <= number % 100 <= 20:
+        return f"{number}th"
+    return f"{number}{_ORDINAL_SUFFIXES.get(number % 10, 'th')}"
+
+
 def get_users_with_trending_products(trending_product_ids: List[str], activity_days: int = 90) -> List[Dict[str, Any]]:
     """
     Finds users active in the past N days who own at least one trending product in their closet.
@@ -906,6 +948,11 @@ def get_users_with_trending_products(trending_product_ids: List[str], activity_d
         
     Returns:
         List of users with their info and highest-ranked trending product they own
+        
+    Note:
+        The per-user LATERAL lookup relies on the partial covering index
+        ii_open_by_user (migrations/002_idx_inventory_items_open_by_user.sql) for
+        index-only scans; keep the status/user_id predicates matching it.
     """
     
     if not trending_product_ids:
@@ -914,68 +961,57 @@ def get_users_with_trending_products(trending_product_ids: List[str], activity_d
     # Convert days to hours
     activity_hours = activity_days * 24
     
-    # Use f-string to avoid parameter mixing issues, similar to trending products query
-    trending_ids_str = "', '".join(trending_product_ids)
-    
-    query = f"""
-    WITH user_size_preferences AS (
-        SELECT
-            up.user_id,
-            av.value AS shoe_size
-        FROM user_preferences up
-        JOIN attribute_preferences ap ON up.id = ap.user_preference_id
-        JOIN attributes a ON ap.attribute_id = a.id
-        JOIN attribute_values av ON ap.attribute_value_id = av.id
-        WHERE a.name = 'mens_size' AND ap.preferred = TRUE
-    ),
-    user_trending_products AS (
+    # mv_user_size_preferences is refreshed nightly (see migrations/001_mv_user_size_preferences.sql)
+    query = """
+    SELECT 
+        u.id as user_id,
+        u.username,
+        u.first_name,
+        usp.shoe_size as user_size,
+        ua.last_active,
+        top_product.product_id,
+        top_product.product_name,
+        top_product.variant_id
+    FROM users u
+    -- Collapse activity to one row per user so it can't multiply the rows feeding the
+    -- joins below; MAX is an index-only lookup on user_activities (user_id, last_active)
+    CROSS JOIN LATERAL (
+        SELECT MAX(last_active) as last_active
+        FROM user_activities
+        WHERE user_id = u.id
+    ) ua
+    JOIN mv_user_size_preferences usp ON u.id = usp.user_id
+    -- One product per user (refined by trending rank in the application layer)
+    JOIN LATERAL (
         SELECT 
-            u.id as user_id,
-            u.username,
-            u.first_name,
-            usp.shoe_size as user_size,
-            ua.last_active,
             pv.product_id,
             p.name as product_name,
-            pv.id as variant_id,
-            -- We'll join with trending rank data in the main query
-            ROW_NUMBER() OVER (
-                PARTITION BY u.id 
-                ORDER BY 
-                    -- This will be replaced with actual trending rank in the application layer
-                    p.name  -- Temporary ordering, will be overridden by application logic
-            ) as product_rank_for_user
-        FROM users u
-        JOIN user_activities ua ON u.id = ua.user_id
-        JOIN user_size_preferences usp ON u.id = usp.user_id
-        JOIN inventory_items ii ON u.id = ii.user_id
+            pv.id as variant_id
+        FROM inventory_items ii
         JOIN product_variants pv ON ii.product_variant_id = pv.id
         JOIN products p ON pv.product_id = p.id
-        WHERE u.deleted_at = 0
-        AND u.email IS NOT NULL
-        AND u.first_name IS NOT NULL
-        AND u.username IS NOT NULL
-        AND usp.shoe_size IS NOT NULL
-        AND ua.last_active >= NOW() - INTERVAL '{activity_hours} hours'
+        WHERE ii.user_id = u.id
         AND ii.status = 'OPEN_FOR_TRADE'
-        AND pv.product_id::text IN ('{trending_ids_str}')
-    )
-    SELECT 
-        user_id,
-        username,
-        first_name,
-        user_size,
-        last_active,
-        product_id,
-        product_name,
-        variant_id
-    FROM user_trending_products
-    WHERE product_rank_for_user = 1  -- One product per user (will be refined by application logic)
+        AND pv.product_id = ANY(%(trending_product_ids)s::uuid[])
+        ORDER BY p.name
+        LIMIT 1
+    ) top_product ON TRUE
+    WHERE u.deleted_at = 0
+    AND u.email IS NOT NULL
+    AND u.first_name IS NOT NULL
+    AND u.username IS NOT NULL
+    AND usp.shoe_size IS NOT NULL
+    AND ua.last_active >= NOW() - %(activity_hours)s * INTERVAL '1 hour'
     """
     
+    params = {'trending_product_ids': trending_product_ids, 'activity_hours': activity_hours}
+    
     try:
-        result = execute_query(query, {})
-        print(f"👥 Found {len(result)} users with trending products from past {activity_days} days")
+        # The small product-id list tempts the planner into lossy bitmap scans; the
+        # per-user LATERAL lookup is faster as plain index scans
+        result = execute_query(query, params, settings={'enable_bitmapscan': 'off'}) or []
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Found %d users with trending products from past %d days", len(result), activity_days)
         return result
     except Exception as e:
         print(f"Error fetching users with trending products: {e}")
@@ -1005,19 +1041,12 @@ def get_new_users_in_window(min_hours: int = 12, max_days: int = 14) -> List[Dic
         - user_size: User's preferred shoe size
         - created_at: Account creation timestamp
         - last_active: Most recent activity timestamp
+        All values are returned as text (NULLs as empty strings), since rows are
+        read back from Postgres' CSV output.
     """
     
+    # mv_user_size_preferences is refreshed nightly (see migrations/001_mv_user_size_preferences.sql)
     query = f"""
-    WITH user_size_preferences AS (
-        SELECT
-            up.user_id,
-            av.value AS shoe_size
-        FROM user_preferences up
-        JOIN attribute_preferences ap ON up.id = ap.user_preference_id
-        JOIN attributes a ON ap.attribute_id = a.id
-        JOIN attribute_values av ON ap.attribute_value_id = av.id
-        WHERE a.name = 'mens_size' AND ap.preferred = TRUE
-    )
     SELECT 
         u.id as user_id,
         u.username,
@@ -1026,7 +1055,7 @@ def get_new_users_in_window(min_hours: int = 12, max_days: int = 14) -> List[Dic
         u.created_at,
         ua.last_active
     FROM users u
-    LEFT JOIN user_size_preferences usp ON u.id = usp.user_id
+    LEFT JOIN mv_user_size_preferences usp ON u.id = usp.user_id
     LEFT JOIN user_activities ua ON u.id = ua.user_id
     WHERE u.created_at BETWEEN NOW() - INTERVAL '{max_days} days' AND NOW() - INTERVAL '{min_hours} hours'
     AND u.deleted_at = 0
@@ -1036,8 +1065,15 @@ def get_new_users_in_window(min_hours: int = 12, max_days: int = 14) -> List[Dic
     """
     
     try:
-        result = execute_query(query, {})
-        print(f"👤 Found {len(result)} new users in {min_hours}h-{max_days}d window")
+        # The waterfall only copies these columns into CSVs, so let Postgres format the
+        # rows via COPY instead of building a cursor dict per row
+        buffer = io.StringIO()
+        if not export_query_to_csv(query, None, buffer, settings=WATERFALL_QUERY_SETTINGS):
+            return []
+        buffer.seek(0)
+        result = list(csv.DictReader(buffer))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Found %d new users in %dh-%dd window", len(result), min_hours, max_days)
         return result
     except Exception as e:
         print(f"Error fetching new users: {e}")
@@ -1064,23 +1100,24 @@ def check_users_closet_completion(user_ids: List[str]) -> Dict[str, bool]:
     query = """
     SELECT DISTINCT user_id
     FROM inventory_items
-    WHERE user_id = ANY(%(user_ids)s::uuid[])
+    WHERE user_id = ANY($1)
     """
     
     try:
-        result = execute_query(query, {'user_ids': user_ids})
-        users_with_closet = {row['user_id'] for row in result}
+        result = execute_prepared('check_users_closet_completion', query, ('uuid[]',), (user_ids,), cursor_factory=None)
+        users_with_closet = {row[0] for row in result}
         
         # Create completion map for all users
         completion_map = {user_id: user_id in users_with_closet for user_id in user_ids}
         
-        completed_count = sum(completion_map.values())
-        print(f"👕 Closet completion: {completed_count}/{len(user_ids)} users have added items")
+        if logger.isEnabledFor(logging.INFO):
+            completed_count = sum(completion_map.values())
+            logger.info("Closet completion: %d/%d users have added items", completed_count, len(user_ids))
         
         return completion_map
     except Exception as e:
         print(f"Error checking closet completion: {e}")
-        return {user_id: False for user_id in user_ids}
+        return dict.fromkeys(user_ids, False)
 
 
 def check_users_offer_completion(user_ids: List[str]) -> Dict[str, bool]:
@@ -1103,23 +1140,24 @@ def check_users_offer_completion(user_ids: List[str]) -> Dict[str, bool]:
     query = """
     SELECT DISTINCT creator_user_id as user_id
     FROM offers
-    WHERE creator_user_id = ANY(%(user_ids)s::uuid[])
+    WHERE creator_user_id = ANY($1)
     """
     
     try:
-        result = execute_query(query, {'user_ids': user_ids})
-        users_with_offers = {row['user_id'] for row in result}
+        result = execute_prepared('check_users_offer_completion', query, ('uuid[]',), (user_ids,), cursor_factory=None)
+        users_with_offers = {row[0] for row in result}
         
         # Create completion map for all users
         completion_map = {user_id: user_id in users_with_offers for user_id in user_ids}
         
-        completed_count = sum(completion_map.values())
-        print(f"🤝 Offer completion: {completed_count}/{len(user_ids)} users have created offers")
+        if logger.isEnabledFor(logging.INFO):
+            completed_count = sum(completion_map.values())
+            logger.info("Offer completion: %d/%d users have created offers", completed_count, len(user_ids))
         
         return completion_map
     except Exception as e:
         print(f"Error checking offer completion: {e}")
-        return {user_id: False for user_id in user_ids}
+        return dict.fromkeys(user_ids, False)
 
 
 def check_users_bio_completion(user_ids: List[str]) -> Dict[str, bool]:
@@ -1142,25 +1180,26 @@ def check_users_bio_completion(user_ids: List[str]) -> Dict[str, bool]:
     query = """
     SELECT id as user_id
     FROM users
-    WHERE id = ANY(%(user_ids)s::uuid[])
+    WHERE id = ANY($1)
     AND bio IS NOT NULL 
     AND TRIM(bio) != ''
     """
     
     try:
-        result = execute_query(query, {'user_ids': user_ids})
-        users_with_bio = {row['user_id'] for row in result}
+        result = execute_prepared('check_users_bio_completion', query, ('uuid[]',), (user_ids,), cursor_factory=None)
+        users_with_bio = {row[0] for row in result}
         
         # Create completion map for all users
         completion_map = {user_id: user_id in users_with_bio for user_id in user_ids}
         
-        completed_count = sum(completion_map.values())
-        print(f"📝 Bio completion: {completed_count}/{len(user_ids)} users have updated their bio")
+        if logger.isEnabledFor(logging.INFO):
+            completed_count = sum(completion_map.values())
+            logger.info("Bio completion: %d/%d users have updated their bio", completed_count, len(user_ids))
         
         return completion_map
     except Exception as e:
         print(f"Error checking bio completion: {e}")
-        return {user_id: False for user_id in user_ids}
+        return dict.fromkeys(user_ids, False)
 
 
 def check_users_wishlist_completion(user_ids: List[str]) -> Dict[str, bool]:
@@ -1183,24 +1222,25 @@ def check_users_wishlist_completion(user_ids: List[str]) -> Dict[str, bool]:
     query = """
     SELECT DISTINCT user_id
     FROM wishlist_items
-    WHERE user_id = ANY(%(user_ids)s::uuid[])
+    WHERE user_id = ANY($1)
     AND deleted_at = 0
     """
     
     try:
-        result = execute_query(query, {'user_ids': user_ids})
-        users_with_wishlist = {row['user_id'] for row in result}
+        result = execute_prepared('check_users_wishlist_completion', query, ('uuid[]',), (user_ids,), cursor_factory=None)
+        users_with_wishlist = {row[0] for row in result}
         
         # Create completion map for all users
         completion_map = {user_id: user_id in users_with_wishlist for user_id in user_ids}
         
-        completed_count = sum(completion_map.values())
-        print(f"❤️ Wishlist completion: {completed_count}/{len(user_ids)} users have wishlist items")
+        if logger.isEnabledFor(logging.INFO):
+            completed_count = sum(completion_map.values())
+            logger.info("Wishlist completion: %d/%d users have wishlist items", completed_count, len(user_ids))
         
         return completion_map
     except Exception as e:
         print(f"Error checking wishlist completion: {e}")
-        return {user_id: False for user_id in user_ids}
+        return dict.fromkeys(user_ids, False)
 
 
 def check_users_profile_completion(user_ids: List[str]) -> Dict[str, bool]:
@@ -1227,26 +1267,78 @@ def check_users_profile_completion(user_ids: List[str]) -> Dict[str, bool]:
     query = """
     SELECT id as user_id
     FROM users
-    WHERE id = ANY(%(user_ids)s::uuid[])
+    WHERE id = ANY($1)
     AND bio IS NOT NULL 
     AND bio != ''
     AND avatar_id IS NOT NULL
     """
     
     try:
-        result = execute_query(query, {'user_ids': user_ids})
-        users_with_complete_profile = {row['user_id'] for row in result}
+        result = execute_prepared('check_users_profile_completion', query, ('uuid[]',), (user_ids,), cursor_factory=None)
+        users_with_complete_profile = {row[0] for row in result}
         
         # Create completion map for all users
         completion_map = {user_id: user_id in users_with_complete_profile for user_id in user_ids}
         
-        completed_count = sum(completion_map.values())
-        print(f"👤 Profile completion: {completed_count}/{len(user_ids)} users have complete profiles")
+        if logger.isEnabledFor(logging.INFO):
+            completed_count = sum(completion_map.values())
+            logger.info("Profile completion: %d/%d users have complete profiles", completed_count, len(user_ids))
         
         return completion_map
     except Exception as e:
         print(f"Error checking profile completion: {e}")
-        return {user_id: False for user_id in user_ids}
+        return dict.fromkeys(user_ids, False)
+
+
+def check_users_completion_bundle(user_ids: List[str]) -> Dict[str, FrozenSet[str]]:
+    """
+    Checks every onboarding completion step for a list of users in a single query.
+    
+    Fuses the closet, offer, bio, wishlist and profile checks into one round trip.
+    Prefer this over the individual check_users_*_completion functions when more
+    than one step is needed for the same users.
+    
+    Args:
+        user_ids: List of user UUIDs to check
+        
+    Returns:
+        Dictionary mapping each step ('has_closet', 'has_offer', 'has_bio',
+        'has_wishlist', 'has_profile') to the frozenset of user_ids that have
+        completed it; test membership with `user_id in completion['has_bio']`
+    """
+    
+    steps = ('has_closet', 'has_offer', 'has_bio', 'has_wishlist', 'has_profile')
+    
+    if not user_ids:
+        return dict.fromkeys(steps, frozenset())
+    
+    query = """
+    SELECT 
+        u.id as user_id,
+        EXISTS (SELECT 1 FROM inventory_items ii WHERE ii.user_id = u.id) as has_closet,
+        EXISTS (SELECT 1 FROM offers o WHERE o.creator_user_id = u.id) as has_offer,
+        COALESCE(u.bio IS NOT NULL AND TRIM(u.bio) != '', FALSE) as has_bio,
+        EXISTS (SELECT 1 FROM wishlist_items wi WHERE wi.user_id = u.id AND wi.deleted_at = 0) as has_wishlist,
+        COALESCE(u.bio IS NOT NULL AND u.bio != '' AND u.avatar_id IS NOT NULL, FALSE) as has_profile
+    FROM users u
+    WHERE u.id = ANY($1)
+    """
+    
+    try:
+        result = execute_prepared('check_users_completion_bundle', query, ('uuid[]',), (user_ids,),
+                                  settings=WATERFALL_QUERY_SETTINGS)
+        # Only completed steps are stored; users missing from the result have completed nothing
+        completion_sets = {
+            step: frozenset(row['user_id'] for row in result if row[step])
+            for step in steps
+        }
+        
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Completion bundle: checked %d onboarding steps for %d users in one query", len(steps), len(user_ids))
+        return completion_sets
+    except Exception as e:
+        print(f"Error checking completion bundle: {e}")
+        return dict.fromkeys(steps, frozenset())
 
 
 def compare_and_remove(remaining_users: List[Dict[str, Any]], extracted_users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -1279,11 +1371,61 @@ def compare_and_remove(remaining_users: List[Dict[str, Any]], extracted_users: L
         if user.get('user_id') not in extracted_ids
     ]
     
-    print(f"🔄 Compare/Remove: {len(remaining_users)} → {len(new_remaining)} remaining after removing {len(extracted_users)} extracted users")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Compare/Remove: %d -> %d remaining after removing %d extracted users",
+                    len(remaining_users), len(new_remaining), len(extracted_users))
     
     return new_remaining
 
 
+@dataclass
+class WaterfallState:
+    """
+    Tracks remaining and extracted users across waterfall extraction steps.
+    
+    Remaining users are keyed by user_id (in original order), so each step only
+    touches the users it extracts instead of rescanning the whole remaining list
+    the way compare_and_remove does. Rows that cannot be keyed (no user_id, or a
+    user_id already seen) are left out and counted in skipped_missing_id and
+    skipped_duplicates, so callers can still account for every input row.
+    """
+    
+    remaining: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    extracted_all: Set[str] = field(default_factory=set)
+    skipped_missing_id: int = 0
+    skipped_duplicates: int = 0
+    
+    @property
+    def skipped_count(self) -> int:
+        """Number of input rows left out of the waterfall."""
+        return self.skipped_missing_id + self.skipped_duplicates
+    
+    @classmethod
+    def from_users(cls, users: List[Dict[str, Any]]) -> 'WaterfallState':
+        """Builds the initial state with every keyable user still remaining."""
+        state = cls()
+        for user in users:
+            user_id = user.get('user_id')
+            if not user_id:
+                state.skipped_missing_id += 1
+            elif user_id in state.remaining:
+                state.skipped_duplicates += 1
+            else:
+                state.remaining[user_id] = user
+        
+        if state.skipped_count:
+            logger.warning("Waterfall: skipped %d users without a user_id and %d duplicate user_ids",
+                           state.skipped_missing_id, state.skipped_duplicates)
+        return state
+    
+    def extract(self, users: List[Dict[str, Any]]) -> None:
+        """Removes the given users from the remaining pool and records them as extracted."""
+        for user in users:
+            user_id = user['user_id']
+            self.remaining.pop(user_id, None)
+            self.extracted_all.add(user_id)
+
+
 def check_level_appearance_history(user_ids: List[str], level: int) -> Dict[str, int]:
     """
     Checks historical level appearance count for users to prevent duplicate nudge spam.
@@ -1313,23 +1455,64 @@ def check_level_appearance_history(user_ids: List[str], level: int) -> Dict[str,
     """
     
     try:
-        result = execute_query(query, {'user_ids': user_ids, 'level': level})
-        appearance_counts = {row['user_id']: row['appearance_count'] for row in result}
+        result = execute_query(query, {'user_ids': user_ids, 'level': level}, cursor_factory=None)
+        appearance_counts = {user_id: appearance_count for user_id, appearance_count in result}
         
         # Fill in zero counts for users not in results
         complete_counts = {user_id: appearance_counts.get(user_id, 0) for user_id in user_ids}
         
-        excluded_count = sum(1 for count in complete_counts.values() if count >= 2)
-        print(f"📊 Level {level} history: {excluded_count}/{len(user_ids)} users excluded (≥2 prior appearances)")
+        if logger.isEnabledFor(logging.INFO):
+            excluded_count = sum(1 for count in complete_counts.values() if count >= 2)
+            logger.info("Level %d history: %d/%d users excluded (>=2 prior appearances)", level, excluded_count, len(user_ids))
         
         return complete_counts
     except Exception as e:
         print(f"⚠️ Error checking level appearance history (table may not exist yet): {e}")
         # Return zero counts for all users if table doesn't exist yet
-        return {user_id: 0 for user_id in user_ids}
+        return dict.fromkeys(user_ids, 0)
+
+
+def check_level_appearance_history_all_levels(user_ids: List[str]) -> Dict[Tuple[str, int], int]:
+    """
+    Checks historical appearance counts for users at every new_user_level in one query.
+    
+    Batched alternative to calling check_level_appearance_history once per level:
+    a single GROUP BY over the same 90-day slice of push records.
+    
+    Args:
+        user_ids: List of user UUIDs to check
+        
+    Returns:
+        Dictionary mapping (user_id, level) to count of prior appearances; pairs
+        with no appearances are omitted
+    """
+    
+    if not user_ids:
+        return {}
+    
+    # NOTE: Same placeholder push tracking table as check_level_appearance_history
+    query = """
+    SELECT user_id, new_user_level, COUNT(*) as appearance_count
+    FROM push_logs
+    WHERE user_id = ANY(%(user_ids)s::uuid[])
+    AND created_at >= NOW() - INTERVAL '90 days'  -- Look back 90 days
+    GROUP BY user_id, new_user_level
+    """
+    
+    try:
+        result = execute_query(query, {'user_ids': user_ids}, cursor_factory=None)
+        appearance_counts = {(user_id, level): appearance_count for user_id, level, appearance_count in result}
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Level history: loaded %d user/level appearance counts for %d users", len(appearance_counts), len(user_ids))
+        return appearance_counts
+    except Exception as e:
+        print(f"⚠️ Error checking level appearance history (table may not exist yet): {e}")
+        # Treat every user as having zero prior appearances if table doesn't exist yet
+        return {}
 
 
-def filter_users_by_level_appearance(user_ids: List[str], level: int, max_appearances: int = 2) -> List[str]:
+def filter_users_by_level_appearance(user_ids: List[str], level: int, max_appearances: int = 2,
+                                     all_level_counts: Optional[Dict[Tuple[str, int], int]] = None) -> List[str]:
     """
     Filters users to exclude those who have appeared at this level ≥ max_appearances times.
     
@@ -1337,12 +1520,17 @@ def filter_users_by_level_appearance(user_ids: List[str], level: int, max_appear
         user_ids: List of user UUIDs to filter
         level: The new_user_level to check (1-5)
         max_appearances: Maximum allowed appearances (default: 2)
+        all_level_counts: Optional precomputed map from check_level_appearance_history_all_levels;
+            when given, no query is issued (use it when filtering several levels)
         
     Returns:
         List of user UUIDs that have < max_appearances at this level
     """
     
-    appearance_counts = check_level_appearance_history(user_ids, level)
+    if all_level_counts is not None:
+        appearance_counts = {user_id: all_level_counts.get((user_id, level), 0) for user_id in user_ids}
+    else:
+        appearance_counts = check_level_appearance_history(user_ids, level)
     
     filtered_users = [
         user_id for user_id in user_ids 
@@ -1350,7 +1538,7 @@ def filter_users_by_level_appearance(user_ids: List[str], level: int, max_appear
     ]
     
     excluded_count = len(user_ids) - len(filtered_users)
-    if excluded_count > 0:
-        print(f"🚫 Excluded {excluded_count} users from Level {level} (≥{max_appearances} prior appearances)")
+    if excluded_count > 0 and logger.isEnabledFor(logging.INFO):
+        logger.info("Excluded %d users from Level %d (>=%d prior appearances)", excluded_count, level, max_appearances)
     
     return filtered_users
\ No newline at end of file
@@ -3,28 +3,117 @@ PostgreSQL Database Utilities.
 
 This script provides helper functions to connect to the PostgreSQL database
 and execute SQL queries using the credentials loaded from the config.
+Queries run on connections borrowed from a shared, lazily created pool.
 """
+import atexit
+import uuid
+import weakref
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import register_adapter
+from psycopg2.extras import RealDictCursor, UUID_adapter
+from psycopg2.pool import ThreadedConnectionPool
 from basic_capabilities.internal_db_queries_toolbox import config
 
+# Let callers pass uuid.UUID values (rendered as typed '...'::uuid literals). Only the
+# input adapter is registered: uuid columns keep coming back as str, which every
+# caller uses as dict keys.
+register_adapter(uuid.UUID, UUID_adapter)
+
+# Connections are reused across execute_query calls instead of paying
+# TCP/TLS/auth setup per query; the pool is created on first use.
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 8
+
+# Applied to every connection: TCP keepalives stop idle pooled sessions from being
+# dropped on flaky networks, and JIT compilation costs more than it saves on these
+# short queries. Timeouts are left to callers (settings={'statement_timeout': ...}),
+# since long COPY exports share the same pool.
+CONNECTION_KWARGS = {
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 3,
+    'options': '-c jit=off',
+}
+
+_pool = None
+
+# Names of the statements already PREPAREd on each pooled connection
+_prepared_statements = weakref.WeakKeyDictionary()
+
 def get_db_connection():
     """
     Establishes a connection to the PostgreSQL database.
 
-    Uses the DATABASE_URL from the config.
+    Uses the DATABASE_URL from the config, with CONNECTION_KWARGS applied.
 
     Returns:
         A psycopg2 connection object, or None if the connection fails.
     """
     try:
-        conn = psycopg2.connect(config.DATABASE_URL)
+        conn = psycopg2.connect(config.DATABASE_URL, **CONNECTION_KWARGS)
         return conn
     except psycopg2.OperationalError as e:
         print(f"Error: Could not connect to the database. {e}")
         return None
 
-def execute_query(query, params=None):
+def _get_pool():
+    """Returns the shared connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = ThreadedConnectionPool(POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS, config.DATABASE_URL,
+                                       **CONNECTION_KWARGS)
+    return _pool
+
+def close_pool():
+    """
+    Closes every connection held by the shared pool.
+
+    Registered with atexit, so scripts don't need to call it explicitly.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+atexit.register(close_pool)
+
+@contextmanager
+def pooled_connection():
+    """
+    Borrows a connection from the shared pool for the duration of a with-block.
+
+    The connection's transaction is rolled back before it is returned, which also
+    resets any SET LOCAL settings. Connections the server has dropped are discarded.
+
+    Yields:
+        A psycopg2 connection object, or None if no connection could be made.
+    """
+    conn = None
+    try:
+        pool = _get_pool()
+        conn = pool.getconn()
+        if conn.closed:
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+    except psycopg2.Error as e:
+        print(f"Error: Could not connect to the database. {e}")
+        conn = None
+
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            try:
+                if not conn.closed:
+                    conn.rollback()
+            except psycopg2.Error:
+                pass
+            pool.putconn(conn, close=bool(conn.closed))
+
+def execute_query(query, params=None, settings=None, cursor_factory=RealDictCursor):
     """
     Executes a SQL query and fetches all results.
 
@@ -33,26 +122,99 @@ def execute_query(query, params=None):
     Args:
         query (str): The SQL query to execute.
         params (tuple, optional): The parameters to substitute in the query. Defaults to None.
+        settings (dict, optional): Planner/runtime settings (e.g. {'work_mem': '256MB'}) applied
+            with SET LOCAL semantics, so they only last for this query's transaction.
+        cursor_factory (optional): Cursor class for the rows. Pass None to get plain tuples,
+            which are much lighter than dicts for large one- or two-column results.
 
     Returns:
-        A list of dicts representing the rows returned by the query, or None if an error occurs.
+        A list of dicts (or tuples) representing the rows returned by the query, or None if an error occurs.
     """
-    conn = None
     try:
-        conn = get_db_connection()
-        if conn is None:
-            return None
-            
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query, params)
-            results = cur.fetchall()
-            return results
+        with pooled_connection() as conn:
+            if conn is None:
+                return None
+
+            with conn.cursor(cursor_factory=cursor_factory) as cur:
+                for name, value in (settings or {}).items():
+                    cur.execute("SELECT set_config(%s, %s, true)", (name, str(value)))
+                cur.execute(query, params)
+                results = cur.fetchall()
+                return results
     except Exception as e:
         print(f"Error executing query: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
+
+def execute_prepared(name, query, param_types, params, settings=None, cursor_factory=RealDictCursor):
+    """
+    Executes a query through a server-side prepared statement and fetches all results.
+
+    The statement is PREPAREd the first time it is used on a pooled connection and
+    then run with EXECUTE, so repeat calls skip parsing and planning.
+
+    Args:
+        name (str): Statement name, unique per query text (e.g. 'check_users_closet').
+        query (str): The SQL query, using $1, $2, ... placeholders.
+        param_types (tuple): Postgres types of the placeholders (e.g. ('uuid[]',)).
+        params (tuple): The values for the placeholders, in order.
+        settings (dict, optional): Runtime settings applied with SET LOCAL semantics, as in execute_query.
+        cursor_factory (optional): Cursor class for the rows; None returns plain tuples.
+
+    Returns:
+        A list of dicts (or tuples) representing the rows returned by the query, or None if an error occurs.
+    """
+    try:
+        with pooled_connection() as conn:
+            if conn is None:
+                return None
+
+            prepared = _prepared_statements.setdefault(conn, set())
+            with conn.cursor(cursor_factory=cursor_factory) as cur:
+                for setting, value in (settings or {}).items():
+                    cur.execute("SELECT set_config(%s, %s, true)", (setting, str(value)))
+                if name not in prepared:
+                    cur.execute(f"PREPARE {name}({', '.join(param_types)}) AS {query}")
+                    prepared.add(name)
+                placeholders = ', '.join(f"%s::{param_type}" for param_type in param_types)
+                cur.execute(f"EXECUTE {name}({placeholders})", params)
+                return cur.fetchall()
+    except Exception as e:
+        print(f"Error executing prepared statement {name}: {e}")
+        return None
+
+def export_query_to_csv(query, params, file_obj, header=True, settings=None):
+    """
+    Streams the results of a SELECT query as CSV (with header) into a file object.
+
+    Uses COPY (query) TO STDOUT so Postgres formats the CSV itself, avoiding
+    row dict construction and Python-side CSV encoding for wide result sets.
+
+    Args:
+        query (str): The SELECT query to export (without a trailing semicolon).
+        params (dict or tuple, optional): The parameters to substitute in the query.
+        file_obj: A writable file object (text or binary) receiving the CSV data.
+        header (bool): Whether to write the header row. Pass False when appending
+            further batches to a file that already has one.
+        settings (dict, optional): Runtime settings applied with SET LOCAL semantics, as in execute_query.
+
+    Returns:
+        True if the export succeeded, False otherwise.
+    """
+    try:
+        with pooled_connection() as conn:
+            if conn is None:
+                return False
+
+            with conn.cursor() as cur:
+                for name, value in (settings or {}).items():
+                    cur.execute("SELECT set_config(%s, %s, true)", (name, str(value)))
+                bound_query = cur.mogrify(query, params).decode('utf-8').strip().rstrip(';')
+                cur.copy_expert(f"COPY ({bound_query}) TO STDOUT WITH (FORMAT csv, HEADER {str(header).lower()})",
+                                file_obj)
+                return True
+    except Exception as e:
+        print(f"Error exporting query to CSV: {e}")
+        return False
 
 # Example Usage:
 if __name__ == '__main__':
@@ -32,6 +32,13 @@ repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__)))
 if repo_root not in sys.path:
     sys.path.insert(0, repo_root)
 
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = 12  # One worker per PostHog query (4 periods x 3 metrics)
+
 # Import with exception handling
 try:
     from basic_capabilities.internal_db_queries_toolbox.posthog_utils import get_active_users_count, get_event_count, get_unique_event_creators
@@ -60,42 +67,38 @@ def main():
         ("30 days", 30 * 24)
     ]
     
-    active_users_results = {}
-    offer_created_results = {}
-    unique_offer_creators_results = {}
+    # Each period needs three independent PostHog queries; run all of them concurrently
+    metric_labels = {
+        'active_users': "active users",
+        'offer_created': "Offer Created events",
+        'unique_offer_creators': "unique offer creators"
+    }
+    jobs = []
+    for period_name, hours in time_periods:
+        jobs.append((period_name, 'active_users', get_active_users_count, (hours,)))
+        jobs.append((period_name, 'offer_created', get_event_count, ("Offer Created", hours)))
+        jobs.append((period_name, 'unique_offer_creators', get_unique_event_creators, ("Offer Created", hours)))
+    
+    results = {metric: {} for metric in metric_labels}
     
     try:
-        for period_name, hours in time_periods:
-            print(f"📈 Querying data for last {period_name}...")
-            
-            # Query active users
-            try:
-                active_count = get_active_users_count(hours)
-                active_users_results[period_name] = active_count
-                print(f"  ✅ Active users: {active_count:,}")
-            except Exception as e:
-                print(f"  ❌ Error querying active users: {str(e)}")
-                active_users_results[period_name] = "Error"
-            
-            # Query offer created events
-            try:
-                offer_count = get_event_count("Offer Created", hours)
-                offer_created_results[period_name] = offer_count
-                print(f"  ✅ Offer Created events: {offer_count:,}")
-            except Exception as e:
-                print(f"  ❌ Error querying Offer Created events: {str(e)}")
-                offer_created_results[period_name] = "Error"
-            
-            # Query unique offer creators
-            try:
-                unique_creators_count = get_unique_event_creators("Offer Created", hours)
-                unique_offer_creators_results[period_name] = unique_creators_count
-                print(f"  ✅ Unique offer creators: {unique_creators_count:,}")
-            except Exception as e:
-                print(f"  ❌ Error querying unique offer creators: {str(e)}")
-                unique_offer_creators_results[period_name] = "Error"
-            
-            print()  # Empty line for readability
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(fn, *args): (period_name, metric) for period_name, metric, fn, args in jobs}
+            for future in as_completed(futures):
+                period_name, metric = futures[future]
+                try:
+                    count = future.result()
+                    results[metric][period_name] = count
+                    if logger.isEnabledFor(logging.INFO):
+                        logger.info("Last %s - %s: %s", period_name, metric_labels[metric], f"{count:,}")
+                except Exception as e:
+                    print(f"  ❌ Error querying {metric_labels[metric]} for last {period_name}: {str(e)}")
+                    results[metric][period_name] = "Error"
+        
+        # Futures complete in any order; rebuild each result dict in period order
+        active_users_results = {period_name: results['active_users'][period_name] for period_name, _ in time_periods}
+        offer_created_results = {period_name: results['offer_created'][period_name] for period_name, _ in time_periods}
+        unique_offer_creators_results = {period_name: results['unique_offer_creators'][period_name] for period_name, _ in time_periods}
         
         # Summary output
         print("="*80)
@@ -8,6 +8,11 @@ for key onboarding actions within 72 hours of account creation.
 Features:
 - Monthly and weekly cohort grouping
 - 72-hour completion window calculations
+- Per-user first actions read from the mv_user_first_actions materialized view
+  (basic_capabilities/internal_db_queries_toolbox/migrations/003_mv_user_first_actions.sql)
+- Partial covering indexes on live (deleted_at = 0) users, inventory_items,
+  wishlist_items and offers rows keep the view refresh and test query on
+  index-only scans (migrations/004_idx_cohort_live_rows.sql)
 - Optimized queries with performance monitoring
 - Comprehensive error handling and data validation
 
@@ -20,13 +25,18 @@ Actions Tracked:
 Author: @squad-agent-database-master (Analytics Foundation Project - Phase 6.5)
 """
 
+import atexit
 import json
 import logging
 import os
 import sys
 import time
 import psycopg2
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 from typing import List, Dict, Any, Optional, Literal
 
 # Add the project root to the Python path
@@ -42,163 +52,276 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# mv_user_first_actions only changes on its nightly refresh, so repeat calls within
+# an hour reuse the previous result
+COHORT_CACHE_TTL_SECONDS = 3600
+
+# First day of new-user cohort tracking; mv_user_first_actions uses the same cutoff
+COHORT_START_DATE = date(2025, 3, 5)
+
+# Queries slower than this are logged; with SLOW_QUERY_EXPLAIN=1 their plan is captured too
+SLOW_QUERY_THRESHOLD_MS = 5000
+
+# Monthly + weekly cohort completion rates from mv_user_first_actions in one scan
+# (GROUPING SETS), bound with %(months_back)s / %(weeks_back)s lookbacks. Shared by
+# the row-returning and server-side JSON paths
+COHORT_ANALYSIS_QUERY = """
+        WITH cohort_actions AS (
+            -- Per-user first actions come from mv_user_first_actions (refreshed nightly)
+            SELECT 
+                -- Cohort buckets are stored in the view, not truncated per call
+                cohort_month,
+                cohort_week,
+                
+                -- 72-hour completion flags (precomputed with EXISTS in the view)
+                closet_72h::int as completed_closet_add,
+                wishlist_72h::int as completed_wishlist_add,
+                offer_72h::int as completed_create_offer,
+                
+                refreshed_at
+            FROM mv_user_first_actions
+            -- Skip users older than both lookbacks (uses the join_date index)
+            WHERE join_date >= LEAST(
+                DATE_TRUNC('month', NOW() - make_interval(months => %(months_back)s)),
+                DATE_TRUNC('week', NOW() - make_interval(weeks => %(weeks_back)s))
+            )
+        )
+        SELECT 
+            CASE WHEN GROUPING(cohort_month) = 0 THEN 'monthly' ELSE 'weekly' END as period_type,
+            cohort_month,
+            cohort_week,
+            CASE WHEN GROUPING(cohort_month) = 0 THEN TO_CHAR(cohort_month, 'YYYY-MM')
+                 ELSE TO_CHAR(cohort_week, 'YYYY-"W"WW') END as cohort_period,
+            COUNT(*) as total_users,
+            
+            -- Individual action completion rates
+            SUM(completed_closet_add) as closet_add_count,
+            ROUND(SUM(completed_closet_add) * 100.0 / COUNT(*), 2) as closet_add_percentage,
+            
+            SUM(completed_wishlist_add) as wishlist_add_count, 
+            ROUND(SUM(completed_wishlist_add) * 100.0 / COUNT(*), 2) as wishlist_add_percentage,
+            
+            SUM(completed_create_offer) as create_offer_count,
+            ROUND(SUM(completed_create_offer) * 100.0 / COUNT(*), 2) as create_offer_percentage,
+            
+            -- All actions completion (users who completed all 3)
+            SUM(CASE WHEN completed_closet_add = 1 AND completed_wishlist_add = 1 AND completed_create_offer = 1 
+                     THEN 1 ELSE 0 END) as all_actions_count,
+            ROUND(SUM(CASE WHEN completed_closet_add = 1 AND completed_wishlist_add = 1 AND completed_create_offer = 1 
+                          THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) as all_actions_percentage,
+            
+            -- When the underlying materialized view was last refreshed
+            MAX(refreshed_at) as last_refresh
+        FROM cohort_actions
+        GROUP BY GROUPING SETS ((cohort_month), (cohort_week))
+        -- Trim each granularity to its own lookback
+        HAVING CASE WHEN GROUPING(cohort_month) = 0
+                    THEN cohort_month >= DATE_TRUNC('month', NOW() - make_interval(months => %(months_back)s))
+                    ELSE cohort_week >= DATE_TRUNC('week', NOW() - make_interval(weeks => %(weeks_back)s)) END
+        ORDER BY period_type, cohort_month ASC, cohort_week ASC
+        """
+
 class CohortAnalysisQueries:
     """Database query manager for cohort analysis calculations"""
     
+    # Process-wide connection pool shared by every instance, created on first use
+    _pool = None
+    POOL_MIN_CONNECTIONS = 1
+    POOL_MAX_CONNECTIONS = 8
+    
     def __init__(self):
         self.db_url = DATABASE_URL
         if not self.db_url:
             raise ValueError("DATABASE_URL environment variable is required")
     
-    def get_db_connection(self):
-        """Create database connection with timeout settings"""
-        try:
-            connection = psycopg2.connect(
-                self.db_url,
+    @classmethod
+    def _get_pool(cls, db_url: str) -> ThreadedConnectionPool:
+        """Return the shared connection pool, creating it on first use"""
+        if cls._pool is None:
+            cls._pool = ThreadedConnectionPool(
+                cls.POOL_MIN_CONNECTIONS,
+                cls.POOL_MAX_CONNECTIONS,
+                db_url,
                 connect_timeout=10,
                 application_name="cohort_analysis_queries"
             )
+            atexit.register(cls.close_pool)
+        return cls._pool
+    
+    @classmethod
+    def close_pool(cls):
+        """Close every pooled connection"""
+        if cls._pool is not None:
+            cls._pool.closeall()
+            cls._pool = None
+    
+    def get_db_connection(self):
+        """Borrow a database connection from the shared pool (return it with release_db_connection)"""
+        try:
+            connection = self._get_pool(self.db_url).getconn()
+            if connection.closed:
+                # Server dropped this connection while it sat in the pool; replace it
+                self._pool.putconn(connection, close=True)
+                connection = self._pool.getconn()
             connection.autocommit = False
             return connection
         except psycopg2.Error as e:
             logger.error(f"Database connection failed: {e}")
             raise
     
-    def execute_query_with_monitoring(self, query: str, params: tuple = None) -> List[Dict]:
+    def release_db_connection(self, connection):
+        """Return a borrowed connection to the pool, ending any open transaction"""
+        if not connection.closed:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                pass
+        self._pool.putconn(connection, close=bool(connection.closed))
+    
+    @contextmanager
+    def _connection(self, connection=None):
+        """
+        Yield a connection for one unit of work
+        
+        Reuses the caller's connection when one is passed (and leaves it open);
+        otherwise borrows one from the shared pool and returns it afterwards.
+        """
+        if connection is not None:
+            yield connection
+            return
+        
+        connection = self.get_db_connection()
+        try:
+            yield connection
+        finally:
+            self.release_db_connection(connection)
+    
+    def execute_query_with_monitoring(self, query: str, params: tuple = None,
+                                      connection=None) -> List[Dict]:
         """Execute query with performance monitoring and error handling"""
         start_time = time.time()
-        connection = None
-        cursor = None
         
-        try:
-            connection = self.get_db_connection()
-            cursor = connection.cursor()
-            
-            # Execute query
-            cursor.execute(query, params)
-            
-            # Fetch results
-            columns = [desc[0] for desc in cursor.description]
-            results = []
-            for row in cursor.fetchall():
-                results.append(dict(zip(columns, row)))
+        with self._connection(connection) as conn:
+            try:
+                # RealDictCursor builds each row's dict in the driver instead of zip() per row here
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute(query, params)
+                    results = cursor.fetchall()
+            except psycopg2.Error as e:
+                logger.error(f"Query execution failed: {e}")
+                logger.error(f"Query: {query[:200]}...")
+                conn.rollback()
+                raise
             
             execution_time = (time.time() - start_time) * 1000  # Convert to milliseconds
             logger.info(f"Query executed in {execution_time:.2f}ms, returned {len(results)} rows")
             
             # Performance warning for slow queries
-            if execution_time > 5000:  # 5 seconds
+            if execution_time > SLOW_QUERY_THRESHOLD_MS:
                 logger.warning(f"Slow query detected: {execution_time:.2f}ms")
+                if os.getenv("SLOW_QUERY_EXPLAIN") == "1":
+                    self.log_query_plan(query, params, connection=conn)
             
             return results
-            
+    
+    def log_query_plan(self, query: str, params: tuple = None, connection=None):
+        """
+        Re-run a query under EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) and log its plan
+        
+        Runs the query a second time, so it is only called for slow queries when
+        SLOW_QUERY_EXPLAIN=1 is set. Failures are logged and otherwise ignored.
+        """
+        try:
+            with self._connection(connection) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+                    plan = cursor.fetchone()[0]
+            logger.warning(f"Slow query plan: {json.dumps(plan)}")
         except psycopg2.Error as e:
-            logger.error(f"Query execution failed: {e}")
-            logger.error(f"Query: {query[:200]}...")
-            if connection:
+            logger.error(f"Could not capture slow query plan: {e}")
+            if connection is not None:
                 connection.rollback()
-            raise
-        finally:
-            if cursor:
-                cursor.close()
-            if connection:
-                connection.close()
     
-    def get_monthly_cohort_analysis(self, months_back: int = 12) -> List[Dict]:
+    def get_cohort_analysis_all(self, months_back: int = 12, weeks_back: int = 24) -> Dict[str, List[Dict]]:
         """
-        Calculate monthly cohort completion rates for 72-hour action windows
+        Calculate monthly and weekly cohort completion rates in a single query
+        
+        Reads mv_user_first_actions once and buckets every user by both month and
+        week with GROUPING SETS, so dashboards showing both charts pay for one scan.
+        Only users who joined within the longer of the two lookbacks are read.
         
         Args:
-            months_back: Number of months to analyze (default: 12)
+            months_back: Number of months of monthly cohorts to return (default: 12)
+            weeks_back: Number of weeks of weekly cohorts to return (default: 24)
             
         Returns:
-            List of cohort data with completion rates
+            Dict with 'monthly' and 'weekly' lists of cohort data with completion
+            rates; last_refresh is when mv_user_first_actions was last refreshed
         """
         
-        query = """
-        WITH monthly_cohorts AS (
-            -- Group users by month joined (starting March 2025)
-            SELECT 
-                DATE_TRUNC('month', created_at) as cohort_month,
-                id as user_id,
-                created_at as join_date,
-                username
-            FROM users 
-            WHERE created_at >= '2025-03-05'::date
-                AND deleted_at = 0
-        ),
-        cohort_actions AS (
-            -- Calculate completion status for each user within 72 hours
-            SELECT 
-                mc.cohort_month,
-                mc.user_id,
-                mc.join_date,
-                mc.username,
-                
-                -- Closet Add (first inventory item addition)
-                CASE WHEN MIN(ii.created_at) <= mc.join_date + INTERVAL '72 hours' 
-                     THEN 1 ELSE 0 END as completed_closet_add,
-                     
-                -- Wishlist Add (first wishlist item addition)  
-                CASE WHEN MIN(wi.created_at) <= mc.join_date + INTERVAL '72 hours'
-                     THEN 1 ELSE 0 END as completed_wishlist_add,
-                     
-                -- Create Offer (first offer creation)
-                CASE WHEN MIN(o.created_at) <= mc.join_date + INTERVAL '72 hours'
-                     THEN 1 ELSE 0 END as completed_create_offer
-                     
-            FROM monthly_cohorts mc
-            LEFT JOIN inventory_items ii ON mc.user_id = ii.user_id AND ii.deleted_at = 0
-            LEFT JOIN wishlist_items wi ON mc.user_id = wi.user_id AND wi.deleted_at = 0  
-            LEFT JOIN offers o ON mc.user_id = o.creator_user_id AND o.deleted_at = 0
-            GROUP BY mc.cohort_month, mc.user_id, mc.join_date, mc.username
-        ),
-        cohort_summary AS (
-            -- Calculate completion rates per cohort
-            SELECT 
-                cohort_month,
-                COUNT(*) as total_users,
-                
-                -- Individual action completion rates
-                SUM(completed_closet_add) as closet_add_count,
-                ROUND(SUM(completed_closet_add) * 100.0 / COUNT(*), 2) as closet_add_percentage,
-                
-                SUM(completed_wishlist_add) as wishlist_add_count, 
-                ROUND(SUM(completed_wishlist_add) * 100.0 / COUNT(*), 2) as wishlist_add_percentage,
-                
-                SUM(completed_create_offer) as create_offer_count,
-                ROUND(SUM(completed_create_offer) * 100.0 / COUNT(*), 2) as create_offer_percentage,
-                
-                -- All actions completion (users who completed all 3)
-                SUM(CASE WHEN completed_closet_add = 1 AND completed_wishlist_add = 1 AND completed_create_offer = 1 
-                         THEN 1 ELSE 0 END) as all_actions_count,
-                ROUND(SUM(CASE WHEN completed_closet_add = 1 AND completed_wishlist_add = 1 AND completed_create_offer = 1 
-                              THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) as all_actions_percentage
-                              
-            FROM cohort_actions
-            GROUP BY cohort_month
+        query = COHORT_ANALYSIS_QUERY
+        
+        logger.info(f"Executing monthly + weekly cohort analysis for {months_back} months / {weeks_back} weeks")
+        results = self.execute_query_with_monitoring(
+            query, {'months_back': months_back, 'weeks_back': weeks_back}
         )
+        
+        # Split the grouping sets back into the per-granularity row shapes
+        cohorts = {'monthly': [], 'weekly': []}
+        for row in results:
+            period_type = row.pop('period_type')
+            row.pop('cohort_week' if period_type == 'monthly' else 'cohort_month')
+            cohorts[period_type].append(row)
+        
+        logger.info(f"Cohort analysis completed: {len(cohorts['monthly'])} monthly and "
+                    f"{len(cohorts['weekly'])} weekly cohorts analyzed")
+        return cohorts
+    
+    def get_cohort_analysis_json(self, months_back: int = 12, weeks_back: int = 24) -> Dict[str, str]:
+        """
+        Calculate monthly and weekly cohort completion rates serialized by Postgres
+        
+        Runs the same query as get_cohort_analysis_all but has the database build
+        each granularity's JSON array with jsonb_agg, so no per-row dicts are built
+        in Python. Meant for the --json API output path.
+        
+        Args:
+            months_back: Number of months of monthly cohorts to return (default: 12)
+            weeks_back: Number of weeks of weekly cohorts to return (default: 24)
+            
+        Returns:
+            Dict with 'monthly' and 'weekly' JSON array strings
+        """
+        
+        query = f"""
         SELECT 
-            cohort_month,
-            TO_CHAR(cohort_month, 'YYYY-MM') as cohort_period,
-            total_users,
-            closet_add_count,
-            closet_add_percentage,
-            wishlist_add_count,
-            wishlist_add_percentage, 
-            create_offer_count,
-            create_offer_percentage,
-            all_actions_count,
-            all_actions_percentage
-        FROM cohort_summary
-        ORDER BY cohort_month ASC;
+            COALESCE(jsonb_agg(to_jsonb(c) - 'period_type' - 'cohort_week' ORDER BY c.cohort_month)
+                     FILTER (WHERE c.period_type = 'monthly'), '[]')::text as monthly,
+            COALESCE(jsonb_agg(to_jsonb(c) - 'period_type' - 'cohort_month' ORDER BY c.cohort_week)
+                     FILTER (WHERE c.period_type = 'weekly'), '[]')::text as weekly
+        FROM ({COHORT_ANALYSIS_QUERY}) c
         """
         
-        logger.info(f"Executing monthly cohort analysis for {months_back} months")
-        results = self.execute_query_with_monitoring(query, (months_back,))
-        logger.info(f"Monthly cohort analysis completed: {len(results)} cohorts analyzed")
+        logger.info(f"Executing cohort analysis JSON export for {months_back} months / {weeks_back} weeks")
+        results = self.execute_query_with_monitoring(
+            query, {'months_back': months_back, 'weeks_back': weeks_back}
+        )
+        return results[0]
+    
+    def get_monthly_cohort_analysis(self, months_back: int = 12) -> List[Dict]:
+        """
+        Calculate monthly cohort completion rates for 72-hour action windows
+        
+        Args:
+            months_back: Number of months to analyze (default: 12)
+            
+        Returns:
+            List of cohort data with completion rates; last_refresh is when
+            mv_user_first_actions was last refreshed
+        """
         
-        return results
+        logger.info(f"Executing monthly cohort analysis for {months_back} months")
+        return self.get_cohort_analysis_all(months_back=months_back)['monthly']
     
     def get_weekly_cohort_analysis(self, weeks_back: int = 24) -> List[Dict]:
         """
@@ -208,159 +331,96 @@ class CohortAnalysisQueries:
             weeks_back: Number of weeks to analyze (default: 24 weeks = ~6 months)
             
         Returns:
-            List of cohort data with completion rates
-        """
-        
-        query = """
-        WITH weekly_cohorts AS (
-            -- Group users by week joined (starting March 2025)
-            SELECT 
-                DATE_TRUNC('week', created_at) as cohort_week,
-                id as user_id,
-                created_at as join_date,
-                username
-            FROM users 
-            WHERE created_at >= '2025-03-05'::date
-                AND deleted_at = 0
-        ),
-        cohort_actions AS (
-            -- Calculate completion status for each user within 72 hours
-            SELECT 
-                wc.cohort_week,
-                wc.user_id,
-                wc.join_date,
-                wc.username,
-                
-                -- Closet Add (first inventory item addition)
-                CASE WHEN MIN(ii.created_at) <= wc.join_date + INTERVAL '72 hours' 
-                     THEN 1 ELSE 0 END as completed_closet_add,
-                     
-                -- Wishlist Add (first wishlist item addition)  
-                CASE WHEN MIN(wi.created_at) <= wc.join_date + INTERVAL '72 hours'
-                     THEN 1 ELSE 0 END as completed_wishlist_add,
-                     
-                -- Create Offer (first offer creation)
-                CASE WHEN MIN(o.created_at) <= wc.join_date + INTERVAL '72 hours'
-                     THEN 1 ELSE 0 END as completed_create_offer
-                     
-            FROM weekly_cohorts wc
-            LEFT JOIN inventory_items ii ON wc.user_id = ii.user_id AND ii.deleted_at = 0
-            LEFT JOIN wishlist_items wi ON wc.user_id = wi.user_id AND wi.deleted_at = 0  
-            LEFT JOIN offers o ON wc.user_id = o.creator_user_id AND o.deleted_at = 0
-            GROUP BY wc.cohort_week, wc.user_id, wc.join_date, wc.username
-        ),
-        cohort_summary AS (
-            -- Calculate completion rates per cohort
-            SELECT 
-                cohort_week,
-                COUNT(*) as total_users,
-                
-                -- Individual action completion rates
-                SUM(completed_closet_add) as closet_add_count,
-                ROUND(SUM(completed_closet_add) * 100.0 / COUNT(*), 2) as closet_add_percentage,
-                
-                SUM(completed_wishlist_add) as wishlist_add_count, 
-                ROUND(SUM(completed_wishlist_add) * 100.0 / COUNT(*), 2) as wishlist_add_percentage,
-                
-                SUM(completed_create_offer) as create_offer_count,
-                ROUND(SUM(completed_create_offer) * 100.0 / COUNT(*), 2) as create_offer_percentage,
-                
-                -- All actions completion (users who completed all 3)
-                SUM(CASE WHEN completed_closet_add = 1 AND completed_wishlist_add = 1 AND completed_create_offer = 1 
-                         THEN 1 ELSE 0 END) as all_actions_count,
-                ROUND(SUM(CASE WHEN completed_closet_add = 1 AND completed_wishlist_add = 1 AND completed_create_offer = 1 
-                              THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) as all_actions_percentage
-                              
-            FROM cohort_actions
-            GROUP BY cohort_week
-        )
-        SELECT 
-            cohort_week,
-            TO_CHAR(cohort_week, 'YYYY-"W"WW') as cohort_period,
-            total_users,
-            closet_add_count,
-            closet_add_percentage,
-            wishlist_add_count,
-            wishlist_add_percentage, 
-            create_offer_count,
-            create_offer_percentage,
-            all_actions_count,
-            all_actions_percentage
-        FROM cohort_summary
-        ORDER BY cohort_week ASC;
+            List of cohort data with completion rates; last_refresh is when
+            mv_user_first_actions was last refreshed
         """
         
         logger.info(f"Executing weekly cohort analysis for {weeks_back} weeks")
-        results = self.execute_query_with_monitoring(query, (weeks_back,))
-        logger.info(f"Weekly cohort analysis completed: {len(results)} cohorts analyzed")
-        
-        return results
+        return self.get_cohort_analysis_all(weeks_back=weeks_back)['weekly']
     
-    def test_cohort_calculations(self, sample_user_ids: List[str] = None) -> Dict:
+    def test_cohort_calculations(self, sample_user_ids: List[str] = None,
+                                 since: date = COHORT_START_DATE) -> Dict:
         """
         Test cohort calculations with sample data for validation
         
         Args:
             sample_user_ids: Optional list of user IDs to test with
+            since: Only sample users who joined on or after this date
             
         Returns:
             Dict with test results and validation data
         """
         
         test_query = """
+        WITH sample_users AS MATERIALIZED (
+            -- Pick the sample first so the per-user lookups below only run for these rows
+            SELECT id, created_at, created_at + INTERVAL '72 hours' as deadline_72h
+            FROM users
+            WHERE created_at >= %(since)s
+                AND deleted_at = 0
+                AND created_at <= CURRENT_DATE - INTERVAL '72 hours'  -- Only include users past 72h window
+            ORDER BY created_at DESC
+            LIMIT 10
+        ),
+        sample_rows AS (
+            SELECT 
+                u.id as user_id,
+                u.created_at as join_date,
+                DATE_TRUNC('month', u.created_at) as cohort_month,
+                DATE_TRUNC('week', u.created_at) as cohort_week,
+                
+                -- First action dates
+                fc.first_at as first_closet_add,
+                fw.first_at as first_wishlist_add,
+                fo.first_at as first_offer_created,
+                
+                -- 72-hour completion checks derived from the same first-action probes
+                COALESCE(fc.first_at <= u.deadline_72h, false) as completed_closet_72h,
+                COALESCE(fw.first_at <= u.deadline_72h, false) as completed_wishlist_72h,
+                COALESCE(fo.first_at <= u.deadline_72h, false) as completed_offer_72h,
+                
+                ROW_NUMBER() OVER (ORDER BY u.created_at DESC) as rn
+            FROM sample_users u
+            -- One MIN per event table per user: a single descent of the
+            -- (user_id, created_at) WHERE deleted_at = 0 indexes from migration 004
+            CROSS JOIN LATERAL (
+                SELECT MIN(ii.created_at) as first_at FROM inventory_items ii
+                WHERE ii.user_id = u.id AND ii.deleted_at = 0
+            ) fc
+            CROSS JOIN LATERAL (
+                SELECT MIN(wi.created_at) as first_at FROM wishlist_items wi
+                WHERE wi.user_id = u.id AND wi.deleted_at = 0
+            ) fw
+            CROSS JOIN LATERAL (
+                SELECT MIN(o.created_at) as first_at FROM offers o
+                WHERE o.creator_user_id = u.id AND o.deleted_at = 0
+            ) fo
+        )
         SELECT 
-            u.id as user_id,
-            u.username,
-            u.created_at as join_date,
-            DATE_TRUNC('month', u.created_at) as cohort_month,
-            DATE_TRUNC('week', u.created_at) as cohort_week,
+            COUNT(*) as test_sample_size,
             
-            -- First action dates
-            MIN(ii.created_at) as first_closet_add,
-            MIN(wi.created_at) as first_wishlist_add,
-            MIN(o.created_at) as first_offer_created,
+            -- Completion rates as percentages of the sample (NULL-safe on an empty sample)
+            COALESCE(ROUND(COUNT(*) FILTER (WHERE completed_closet_72h) * 100.0
+                           / NULLIF(COUNT(*), 0), 2), 0)::float as closet_completion_rate,
+            COALESCE(ROUND(COUNT(*) FILTER (WHERE completed_wishlist_72h) * 100.0
+                           / NULLIF(COUNT(*), 0), 2), 0)::float as wishlist_completion_rate,
+            COALESCE(ROUND(COUNT(*) FILTER (WHERE completed_offer_72h) * 100.0
+                           / NULLIF(COUNT(*), 0), 2), 0)::float as offer_completion_rate,
+            COALESCE(ROUND(COUNT(*) FILTER (WHERE completed_closet_72h AND completed_wishlist_72h
+                                              AND completed_offer_72h) * 100.0
+                           / NULLIF(COUNT(*), 0), 2), 0)::float as all_actions_completion_rate,
             
-            -- 72-hour completion checks
-            CASE WHEN MIN(ii.created_at) <= u.created_at + INTERVAL '72 hours' 
-                 THEN true ELSE false END as completed_closet_72h,
-            CASE WHEN MIN(wi.created_at) <= u.created_at + INTERVAL '72 hours'
-                 THEN true ELSE false END as completed_wishlist_72h,
-            CASE WHEN MIN(o.created_at) <= u.created_at + INTERVAL '72 hours'
-                 THEN true ELSE false END as completed_offer_72h
-                 
-        FROM users u
-        LEFT JOIN inventory_items ii ON u.id = ii.user_id AND ii.deleted_at = 0
-        LEFT JOIN wishlist_items wi ON u.id = wi.user_id AND wi.deleted_at = 0
-        LEFT JOIN offers o ON u.id = o.creator_user_id AND o.deleted_at = 0
-        WHERE u.created_at >= '2025-03-05'::date
-            AND u.deleted_at = 0
-            AND u.created_at <= CURRENT_DATE - INTERVAL '72 hours'  -- Only include users past 72h window
-        GROUP BY u.id, u.username, u.created_at
-        ORDER BY u.created_at DESC
-        LIMIT 10;
+            -- First 5 records for inspection
+            jsonb_agg(to_jsonb(t) - 'rn' ORDER BY t.join_date DESC) FILTER (WHERE t.rn <= 5) as sample_data
+        FROM sample_rows t;
         """
         
         logger.info("Running cohort calculation test with sample data")
-        results = self.execute_query_with_monitoring(test_query)
+        results = self.execute_query_with_monitoring(test_query, {'since': since})
         
-        # Calculate summary stats
-        if results:
-            total_tested = len(results)
-            closet_completed = sum(1 for r in results if r['completed_closet_72h'])
-            wishlist_completed = sum(1 for r in results if r['completed_wishlist_72h']) 
-            offer_completed = sum(1 for r in results if r['completed_offer_72h'])
-            all_completed = sum(1 for r in results 
-                              if r['completed_closet_72h'] and r['completed_wishlist_72h'] and r['completed_offer_72h'])
-            
-            summary = {
-                'test_sample_size': total_tested,
-                'closet_completion_rate': round(closet_completed / total_tested * 100, 2) if total_tested > 0 else 0,
-                'wishlist_completion_rate': round(wishlist_completed / total_tested * 100, 2) if total_tested > 0 else 0,
-                'offer_completion_rate': round(offer_completed / total_tested * 100, 2) if total_tested > 0 else 0,
-                'all_actions_completion_rate': round(all_completed / total_tested * 100, 2) if total_tested > 0 else 0,
-                'sample_data': results[:5]  # First 5 records for inspection
-            }
-        else:
+        # The aggregate always returns one row; an empty sample means no test data
+        summary = results[0] if results else {'test_sample_size': 0}
+        if not summary['test_sample_size']:
             summary = {
                 'test_sample_size': 0,
                 'error': 'No test data available'
@@ -370,6 +430,32 @@ class CohortAnalysisQueries:
         return summary
 
 # Convenience functions for API integration
+def get_cohort_analysis_all(months_back: int = 12, weeks_back: int = 24) -> Dict[str, List[Dict]]:
+    """
+    Get monthly and weekly cohort analysis data from a single query
+    
+    Results are cached per lookback for up to COHORT_CACHE_TTL_SECONDS. Call
+    _cohort_analysis_cache.cache_clear() to force a fresh read.
+    
+    Args:
+        months_back: Number of monthly cohorts to look back over
+        weeks_back: Number of weekly cohorts to look back over
+        
+    Returns:
+        Dict with 'monthly' and 'weekly' lists of cohort data formatted for API response
+    """
+    
+    time_bucket = int(time.time() // COHORT_CACHE_TTL_SECONDS)
+    cohorts = _cohort_analysis_cache(time_bucket, months_back, weeks_back)
+    # Hand back new lists so callers can't reorder or truncate the cached ones
+    return {period_type: list(rows) for period_type, rows in cohorts.items()}
+
+@lru_cache(maxsize=8)
+def _cohort_analysis_cache(time_bucket: int, months_back: int, weeks_back: int) -> Dict[str, List[Dict]]:
+    """Cached query behind get_cohort_analysis_all, keyed by time bucket and lookback (errors are not cached)"""
+    analyzer = CohortAnalysisQueries()
+    return analyzer.get_cohort_analysis_all(months_back, weeks_back)
+
 def get_cohort_analysis(period_type: Literal['monthly', 'weekly'], 
                        lookback_periods: int = None) -> List[Dict]:
     """
@@ -383,16 +469,15 @@ def get_cohort_analysis(period_type: Literal['monthly', 'weekly'],
         List of cohort data formatted for API response
     """
     
-    analyzer = CohortAnalysisQueries()
+    if period_type not in ('monthly', 'weekly'):
+        raise ValueError(f"Invalid period_type: {period_type}. Must be 'monthly' or 'weekly'")
     
+    # Both granularities share one cached query; only the requested one takes the lookback
+    if lookback_periods is None:
+        return get_cohort_analysis_all()[period_type]
     if period_type == 'monthly':
-        periods = lookback_periods or 12
-        return analyzer.get_monthly_cohort_analysis(periods)
-    elif period_type == 'weekly':
-        periods = lookback_periods or 24  # ~6 months of weeks
-        return analyzer.get_weekly_cohort_analysis(periods)
-    else:
-        raise ValueError(f"Invalid period_type: {period_type}. Must be 'monthly' or 'weekly'")
+        return get_cohort_analysis_all(months_back=lookback_periods)['monthly']
+    return get_cohort_analysis_all(weeks_back=lookback_periods)['weekly']
 
 def test_cohort_analysis() -> Dict:
     """Test cohort analysis calculations"""
@@ -417,13 +502,22 @@ if __name__ == "__main__":
         test_results = test_cohort_analysis()
         print(json.dumps(test_results, indent=2, default=str))
     
+    # Both granularities come back from one query, so fetch them together
+    lookbacks = {'months_back': args.periods, 'weeks_back': args.periods} if args.periods else {}
+    cohorts = {}
+    if args.monthly or args.weekly:
+        if args.json:
+            # Postgres serializes the rows itself; the strings are written out as-is
+            cohorts = CohortAnalysisQueries().get_cohort_analysis_json(**lookbacks)
+        else:
+            cohorts = get_cohort_analysis_all(**lookbacks)
+    
     if args.monthly:
-        periods = args.periods or 12
-        monthly_results = get_cohort_analysis('monthly', periods)
+        monthly_results = cohorts['monthly']
         
         if args.json:
             # Output clean JSON for API consumption
-            print(json.dumps(monthly_results, indent=2, default=str))
+            sys.stdout.write(monthly_results + "\n")
         else:
             # Output human-readable format for command line
             print("Running monthly cohort analysis...")
@@ -436,12 +530,11 @@ if __name__ == "__main__":
                       f"All: {cohort['all_actions_percentage']}%")
     
     if args.weekly:
-        periods = args.periods or 24
-        weekly_results = get_cohort_analysis('weekly', periods)
+        weekly_results = cohorts['weekly']
         
         if args.json:
             # Output clean JSON for API consumption
-            print(json.dumps(weekly_results, indent=2, default=str))
+            sys.stdout.write(weekly_results + "\n")
         else:
             # Output human-readable format for command line
             print("Running weekly cohort analysis...")
@@ -1,7 +1,7 @@
 import os
 import sys
 import psycopg2
-import pandas as pd
+from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 
 # Add project root to the Python path
@@ -29,35 +29,60 @@ def get_db_connection():
 def get_active_user_counts():
     """
     Retrieves counts of active users and offer creators over several trailing time windows.
+
+    Returns:
+        A list of dicts with 'timeframe', 'active_users' and 'offer_creators', one per
+        window from shortest to longest, or None if the query fails.
     """
     query = """
-    SELECT
-        -- Active Users
-        COUNT(DISTINCT u.id) FILTER (WHERE ua.last_active >= NOW() - INTERVAL '1 day') AS active_last_24h,
-        COUNT(DISTINCT u.id) FILTER (WHERE ua.last_active >= NOW() - INTERVAL '3 days') AS active_last_72h,
-        COUNT(DISTINCT u.id) FILTER (WHERE ua.last_active >= NOW() - INTERVAL '7 days') AS active_last_7d,
-        COUNT(DISTINCT u.id) FILTER (WHERE ua.last_active >= NOW() - INTERVAL '30 days') AS active_last_30d,
-        COUNT(DISTINCT u.id) FILTER (WHERE ua.last_active >= NOW() - INTERVAL '90 days') AS active_last_90d,
+    WITH offers_by_user AS (
+        -- One row per recent offer creator, so the join below can't multiply users
+        SELECT creator_user_id, MAX(created_at) AS last_offer
+        FROM offers
+        WHERE created_at >= NOW() - INTERVAL '90 days'
+        GROUP BY creator_user_id
+    ),
+    window_counts AS (
+        SELECT
+            -- Active Users
+            COUNT(*) FILTER (WHERE ua.last_active >= NOW() - INTERVAL '1 day') AS active_last_24h,
+            COUNT(*) FILTER (WHERE ua.last_active >= NOW() - INTERVAL '3 days') AS active_last_72h,
+            COUNT(*) FILTER (WHERE ua.last_active >= NOW() - INTERVAL '7 days') AS active_last_7d,
+            COUNT(*) FILTER (WHERE ua.last_active >= NOW() - INTERVAL '30 days') AS active_last_30d,
+            COUNT(*) FILTER (WHERE ua.last_active >= NOW() - INTERVAL '90 days') AS active_last_90d,
 
-        -- Active Users who created an offer
-        COUNT(DISTINCT CASE WHEN o.created_at >= NOW() - INTERVAL '1 day' THEN u.id END) AS offer_creators_last_24h,
-        COUNT(DISTINCT CASE WHEN o.created_at >= NOW() - INTERVAL '3 days' THEN u.id END) AS offer_creators_last_72h,
-        COUNT(DISTINCT CASE WHEN o.created_at >= NOW() - INTERVAL '7 days' THEN u.id END) AS offer_creators_last_7d,
-        COUNT(DISTINCT CASE WHEN o.created_at >= NOW() - INTERVAL '30 days' THEN u.id END) AS offer_creators_last_30d,
-        COUNT(DISTINCT CASE WHEN o.created_at >= NOW() - INTERVAL '90 days' THEN u.id END) AS offer_creators_last_90d
+            -- Active Users who created an offer
+            COUNT(*) FILTER (WHERE obu.last_offer >= NOW() - INTERVAL '1 day') AS offer_creators_last_24h,
+            COUNT(*) FILTER (WHERE obu.last_offer >= NOW() - INTERVAL '3 days') AS offer_creators_last_72h,
+            COUNT(*) FILTER (WHERE obu.last_offer >= NOW() - INTERVAL '7 days') AS offer_creators_last_7d,
+            COUNT(*) FILTER (WHERE obu.last_offer >= NOW() - INTERVAL '30 days') AS offer_creators_last_30d,
+            COUNT(*) FILTER (WHERE obu.last_offer >= NOW() - INTERVAL '90 days') AS offer_creators_last_90d
 
-    FROM users u
-    JOIN user_activities ua ON u.id = ua.user_id
-    LEFT JOIN offers o ON u.id = o.creator_user_id AND o.created_at >= NOW() - INTERVAL '90 days' -- Optimization
-    WHERE u.deleted_at = 0
-      AND ua.last_active >= NOW() - INTERVAL '90 days'; -- Optimization
+        FROM users u
+        JOIN user_activities ua ON u.id = ua.user_id
+        LEFT JOIN offers_by_user obu ON u.id = obu.creator_user_id
+        WHERE u.deleted_at = 0
+          AND ua.last_active >= NOW() - INTERVAL '90 days' -- Optimization
+    )
+    -- Unpivot the single row of counts into one report row per timeframe
+    SELECT r.timeframe, r.active_users, r.offer_creators
+    FROM window_counts wc
+    CROSS JOIN LATERAL (VALUES
+        (1, 'Last 24 Hours', wc.active_last_24h, wc.offer_creators_last_24h),
+        (2, 'Last 72 Hours', wc.active_last_72h, wc.offer_creators_last_72h),
+        (3, 'Last 7 Days', wc.active_last_7d, wc.offer_creators_last_7d),
+        (4, 'Last 30 Days', wc.active_last_30d, wc.offer_creators_last_30d),
+        (5, 'Last 90 Days', wc.active_last_90d, wc.offer_creators_last_90d)
+    ) AS r(sort_order, timeframe, active_users, offer_creators)
+    ORDER BY r.sort_order
     """
     
     conn = get_db_connection()
     if conn:
         try:
-            df = pd.read_sql_query(query, conn)
-            return df
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query)
+                return cur.fetchall()
         except Exception as e:
             print(f"An error occurred: {e}")
             return None
@@ -67,42 +92,12 @@ def get_active_user_counts():
 
 if __name__ == "__main__":
     load_dotenv()
-    active_users_df = get_active_user_counts()
+    report_rows = get_active_user_counts()
     
-    if active_users_df is not None and not active_users_df.empty:
-        # Transpose the DataFrame for better readability
-        report = active_users_df.T.reset_index()
-        report.columns = ['Metric', 'Count']
-        
-        # Separate the metrics for a clear, combined report
-        active_users = report[report['Metric'].str.startswith('active')].copy()
-        offer_creators = report[report['Metric'].str.startswith('offer_creators')].copy()
-
-        # Clean up the metric names to act as a join key
-        active_users['Timeframe'] = active_users['Metric'].str.replace('active_last_', '')
-        offer_creators['Timeframe'] = offer_creators['Metric'].str.replace('offer_creators_last_', '')
-        
-        # Merge the two dataframes
-        final_report = pd.merge(active_users, offer_creators, on='Timeframe')
-        final_report = final_report[['Timeframe', 'Count_x', 'Count_y']]
-        final_report.columns = ['Timeframe', 'Active Users', 'Offer Creators']
-
-        # Prettier names for the timeframe and proper sorting
-        timeframe_map = {
-            '24h': 'Last 24 Hours',
-            '72h': 'Last 72 Hours',
-            '7d': 'Last 7 Days',
-            '30d': 'Last 30 Days',
-            '90d': 'Last 90 Days'
-        }
-        
-        timeframe_order = ['24h', '72h', '7d', '30d', '90d']
-        
-        final_report['Timeframe'] = pd.Categorical(final_report['Timeframe'], categories=timeframe_order, ordered=True)
-        final_report = final_report.sort_values('Timeframe')
-        final_report['Timeframe'] = final_report['Timeframe'].map(timeframe_map)
-
+    if report_rows:
         print("Active User & Offer Creator Report:")
-        print(final_report.to_string(index=False))
+        print(f"{'Timeframe':>13}  {'Active Users':>12}  {'Offer Creators':>14}")
+        for row in report_rows:
+            print(f"{row['timeframe']:>13}  {row['active_users']:>12}  {row['offer_creators']:>14}")
     else:
         print("Could not generate the active user report.")
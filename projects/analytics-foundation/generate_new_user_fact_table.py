@@ -6,11 +6,12 @@ Creates a comprehensive fact table for new users (created >= 2025-03-05) with
 key onboarding milestone dates for analytics dashboard visualization.
 
 Implements enhanced safety protocols:
-- Batch processing (500 users per batch)
+- Single scan for the in-scope users, activity lookups batched 10,000 ids per query
 - Connection pooling with timeouts
 - Progress monitoring with automatic pause
 - Query performance analysis
 - Data validation and rollback procedures
+- Per-batch checkpoints, so a failed run resumes where it stopped
 
 Columns:
 - userID: User identifier
@@ -22,27 +23,33 @@ Columns:
 - 1stOfferConfirmed: Date of first offer confirmation (NULL if never)
 
 Usage:
-    python3 generate_new_user_fact_table.py [--test_mode] [--batch_size 500] [--output_dir generated_data]
+    python3 generate_new_user_fact_table.py [--test_mode] [--batch_size 10000] [--output_dir generated_data] [--gzip] [--parquet] [--resume]
 
 Author: @squad-agent-database-master (Analytics Foundation Project - Phase 3)
 """
 
 import argparse
 import csv
+import gzip
+import hashlib
+import importlib.util
+import io
 import json
 import os
+import shutil
 import sys
 import time
-import psycopg2
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import Any, Dict, Iterable, List, Optional
 import logging
 
 # Add the project root to the Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 
-from basic_capabilities.internal_db_queries_toolbox.config import DATABASE_URL
-from basic_capabilities.internal_db_queries_toolbox.sql_utils import execute_query
+from basic_capabilities.internal_db_queries_toolbox.sql_utils import (
+    POOL_MAX_CONNECTIONS, execute_query, export_query_to_csv, pooled_connection
+)
 
 # Configure logging
 logging.basicConfig(
@@ -55,43 +62,45 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Enhanced connection pool configuration
-CONNECTION_POOL_CONFIG = {
-    'max_connections': 5,
-    'connection_timeout': 30,
-    'query_timeout': 30
-}
+# Fact table batches exported in parallel, each on its own pooled connection
+FACT_TABLE_WORKERS = min(4, POOL_MAX_CONNECTIONS)
+
+# Per-run checkpoint directories under <output_dir>/tmp, and the user id list saved in each
+FACT_TABLE_PARTS_PREFIX = 'fact_table_parts_'
+FACT_TABLE_PARTS_IDS_FILE = 'user_ids.json'
 
 # Performance monitoring thresholds
 PERFORMANCE_THRESHOLDS = {
     'max_query_time': 10.0,  # seconds
+    'max_estimated_cost': 1_000_000,  # planner cost units (EXPLAIN Total Cost)
     'progress_report_interval': 10,  # batches
-    'batch_size': 500
+    'batch_size': 10000  # user ids per activity query
 }
 
 
-def get_database_connection():
+def check_database_connection():
     """
-    Get database connection with timeout configuration.
+    Verify the database is reachable using a connection from the shared pool.
     
-    Returns:
-        psycopg2 connection object
+    The connection goes back to the pool afterwards, so the queries that follow
+    reuse it instead of paying for another TCP/TLS/auth handshake.
+    
+    Raises:
+        ConnectionError: If no connection could be made
     """
-    try:
-        conn = psycopg2.connect(
-            DATABASE_URL,
-            connect_timeout=CONNECTION_POOL_CONFIG['connection_timeout']
-        )
-        conn.autocommit = False
-        return conn
-    except Exception as e:
-        logger.error(f"Failed to connect to database: {e}")
-        raise
+    with pooled_connection() as conn:
+        if conn is None:
+            raise ConnectionError("Failed to connect to database")
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
 
 
 def analyze_query_performance(query: str, params: Dict = None) -> Dict[str, Any]:
     """
-    Analyze query performance using EXPLAIN ANALYZE.
+    Estimate query cost using EXPLAIN (FORMAT JSON).
+    
+    Only plans the query; unlike EXPLAIN ANALYZE it does not execute it, so the
+    pre-flight check doesn't scan the data the run is about to read anyway.
     
     Args:
         query: SQL query to analyze
@@ -100,21 +109,23 @@ def analyze_query_performance(query: str, params: Dict = None) -> Dict[str, Any]
     Returns:
         Dictionary with performance metrics
     """
-    explain_query = f"EXPLAIN ANALYZE {query}"
+    explain_query = f"EXPLAIN (FORMAT JSON) {query}"
     
     try:
         start_time = time.time()
         result = execute_query(explain_query, params or {})
         execution_time = time.time() - start_time
         
-        # Parse execution plan for key metrics
-        plan_text = '\n'.join([row.get('QUERY PLAN', '') for row in result])
+        # Top-level plan node of the single statement being explained
+        plan = result[0]['QUERY PLAN'][0]['Plan']
+        estimated_cost = plan['Total Cost']
         
         return {
             'execution_time': execution_time,
-            'plan': plan_text,
-            'estimated_cost': 'analyzed',
-            'performance_acceptable': execution_time < PERFORMANCE_THRESHOLDS['max_query_time']
+            'plan': json.dumps(plan),
+            'estimated_cost': estimated_cost,
+            'estimated_rows': plan['Plan Rows'],
+            'performance_acceptable': estimated_cost < PERFORMANCE_THRESHOLDS['max_estimated_cost']
         }
     except Exception as e:
         logger.error(f"Query analysis failed: {e}")
@@ -125,184 +136,171 @@ def analyze_query_performance(query: str, params: Dict = None) -> Dict[str, Any]
         }
 
 
-def get_new_users_batch(offset: int, batch_size: int) -> List[Dict[str, Any]]:
+def get_new_user_ids(limit: Optional[int] = None) -> List[str]:
     """
-    Get a batch of new users created >= 2025-03-05.
+    Get the id of every new user created >= 2025-03-05 in one scan.
     Uses Dynamic User Segmentation pattern (Building Block #8).
     
+    Only ids are held in Python; FACT_TABLE_QUERY reads the other user columns
+    itself when the rows are exported.
+    
     Args:
-        offset: Starting position for batch
-        batch_size: Number of users to retrieve
+        limit: Optional cap on the number of users (earliest first)
         
     Returns:
-        List of user records
+        Flat list of user ids ordered by (created_at, id), so batches sliced from it
+        never split or repeat users that share a created_at
     """
     query = """
-    SELECT 
-        u.id as user_id,
-        u.created_at as created_at,
-        u.username as username
+    SELECT u.id
     FROM users u
     WHERE u.created_at >= '2025-03-05'
     AND u.deleted_at = 0
     AND u.username IS NOT NULL
-    ORDER BY u.created_at ASC
-    LIMIT %(batch_size)s OFFSET %(offset)s
+    ORDER BY u.created_at ASC, u.id ASC
+    LIMIT %(limit)s
     """
     
-    params = {
-        'batch_size': batch_size,
-        'offset': offset
-    }
-    
-    return execute_query(query, params)
+    # LIMIT NULL returns every row; tuple rows avoid a dict per user
+    rows = execute_query(query, {'limit': limit}, cursor_factory=None) or []
+    return [row[0] for row in rows]
 
 
-def get_first_activity_dates(user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
-    """
-    Get first activity dates for each user using efficient window functions.
-    Implements LEFT JOIN pattern for comprehensive data retrieval.
-    
-    Args:
-        user_ids: List of user UUIDs
-        
-    Returns:
-        Dictionary mapping user_id to first activity dates
-    """
-    
-    if not user_ids:
-        return {}
-    
-    # Convert user_ids to proper format for PostgreSQL
-    user_id_list = [str(uid) for uid in user_ids]
-    
-    query = """
-    WITH user_first_activities AS (
-        SELECT 
-            u.id as user_id,
-            
-            -- First closet addition (inventory items)
-            (SELECT MIN(ii.created_at) 
-             FROM inventory_items ii 
-             WHERE ii.user_id = u.id 
-             AND ii.deleted_at = 0) as first_closet_add,
-            
-            -- First wishlist addition  
-            (SELECT MIN(wi.created_at)
-             FROM wishlist_items wi
-             WHERE wi.user_id = u.id
-             AND wi.deleted_at = 0) as first_wishlist_add,
-            
-            -- First offer posted
-            (SELECT MIN(o.created_at)
-             FROM offers o
-             WHERE o.creator_user_id = u.id) as first_offer_posted,
-            
-            -- First offer confirmed
-            (SELECT MIN(o.confirmed_trade_date)
-             FROM offers o
-             WHERE (o.creator_user_id = u.id OR o.receiver_user_id = u.id)
-             AND o.offer_status = 'COMPLETED'
-             AND o.confirmed_trade_date IS NOT NULL) as first_offer_confirmed
-             
-        FROM users u
-        WHERE u.id = ANY(%(user_ids)s::uuid[])
+# Fact-table timestamps are rendered in Postgres as ISO-8601 with microseconds always
+# present (e.g. 2025-03-05T00:30:14.328000+00:00). Unlike datetime.isoformat(), whole
+# seconds keep their .000000 (2025-03-05T00:30:14.000000+00:00)
+ISO_TIMESTAMP_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS.USTZH:TZM'
+
+FACT_TABLE_COLUMNS = ['userID', 'createdAt', 'username', '1stClosetAdd',
+                      '1stWishlistAdd', '1stOfferPosted', '1stOfferConfirmed']
+
+# One fact-table row per user in %(user_ids)s, already in CSV column order. Each
+# activity table is aggregated once (MIN ... GROUP BY user_id) over the whole
+# batch and LEFT JOINed back to users, instead of a scalar subquery per user.
+# Indexes: migrations 004 (inventory/wishlist) and 005 (offers, users).
+FACT_TABLE_QUERY = f"""
+    WITH batch_ids AS MATERIALIZED (
+        -- The id array is bound (and sent) once, then semi-joined by every CTE below
+        SELECT unnest(%(user_ids)s::uuid[]) as user_id
+    ),
+    closet AS (
+        -- First closet addition (inventory items)
+        SELECT user_id, MIN(created_at) as first_closet_add
+        FROM inventory_items
+        WHERE user_id IN (SELECT user_id FROM batch_ids)
+        AND deleted_at = 0
+        GROUP BY user_id
+    ),
+    wishlist AS (
+        -- First wishlist addition
+        SELECT user_id, MIN(created_at) as first_wishlist_add
+        FROM wishlist_items
+        WHERE user_id IN (SELECT user_id FROM batch_ids)
+        AND deleted_at = 0
+        GROUP BY user_id
+    ),
+    posted AS (
+        -- First offer posted
+        SELECT creator_user_id as user_id, MIN(created_at) as first_offer_posted
+        FROM offers
+        WHERE creator_user_id IN (SELECT user_id FROM batch_ids)
+        GROUP BY creator_user_id
+    ),
+    confirmed AS (
+        -- First offer confirmed, on either side of the trade
+        SELECT user_id, MIN(confirmed_trade_date) as first_offer_confirmed
+        FROM (
+            SELECT creator_user_id as user_id, confirmed_trade_date
+            FROM offers
+            WHERE creator_user_id IN (SELECT user_id FROM batch_ids)
+            AND offer_status = 'COMPLETED'
+            AND confirmed_trade_date IS NOT NULL
+            UNION ALL
+            SELECT receiver_user_id as user_id, confirmed_trade_date
+            FROM offers
+            WHERE receiver_user_id IN (SELECT user_id FROM batch_ids)
+            AND offer_status = 'COMPLETED'
+            AND confirmed_trade_date IS NOT NULL
+        ) trade_sides
+        GROUP BY user_id
     )
     SELECT 
-        user_id,
-        first_closet_add,
-        first_wishlist_add, 
-        first_offer_posted,
-        first_offer_confirmed
-    FROM user_first_activities
-    """
-    
-    params = {'user_ids': user_id_list}
-    
-    try:
-        start_time = time.time()
-        results = execute_query(query, params)
-        execution_time = time.time() - start_time
-        
-        # Check performance threshold
-        if execution_time > PERFORMANCE_THRESHOLDS['max_query_time']:
-            logger.warning(f"Query exceeded performance threshold: {execution_time:.2f}s")
-            
-        # Convert to dictionary for efficient lookup
-        return {
-            result['user_id']: {
-                'first_closet_add': result['first_closet_add'],
-                'first_wishlist_add': result['first_wishlist_add'],
-                'first_offer_posted': result['first_offer_posted'],
-                'first_offer_confirmed': result['first_offer_confirmed']
-            }
-            for result in results
-        }
-        
-    except Exception as e:
-        logger.error(f"Failed to get first activity dates: {e}")
-        return {}
+        u.id as "userID",
+        to_char(u.created_at, '{ISO_TIMESTAMP_FORMAT}') as "createdAt",
+        u.username,
+        to_char(c.first_closet_add, '{ISO_TIMESTAMP_FORMAT}') as "1stClosetAdd",
+        to_char(w.first_wishlist_add, '{ISO_TIMESTAMP_FORMAT}') as "1stWishlistAdd",
+        to_char(p.first_offer_posted, '{ISO_TIMESTAMP_FORMAT}') as "1stOfferPosted",
+        to_char(cf.first_offer_confirmed, '{ISO_TIMESTAMP_FORMAT}') as "1stOfferConfirmed"
+    FROM users u
+    LEFT JOIN closet c ON c.user_id = u.id
+    LEFT JOIN wishlist w ON w.user_id = u.id
+    LEFT JOIN posted p ON p.user_id = u.id
+    LEFT JOIN confirmed cf ON cf.user_id = u.id
+    WHERE u.id IN (SELECT user_id FROM batch_ids)
+    ORDER BY u.created_at ASC, u.id ASC
+"""
 
 
-def create_fact_table_batch(users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def export_fact_table_batch(user_ids: List[str], include_header: bool) -> Optional[str]:
     """
-    Create fact table records for a batch of users.
+    Export fact table rows for a batch of users as CSV text.
+    Postgres joins users to their first activity dates and formats the CSV itself
+    (COPY ... TO STDOUT), so no per-user records are built in Python. Safe to call
+    from several threads at once; each call borrows its own pooled connection.
     
     Args:
-        users: List of user records
+        user_ids: List of user UUIDs
+        include_header: Whether to include the header row (first batch only)
         
     Returns:
-        List of fact table records
+        The batch's CSV text, or None if the export failed
     """
-    if not users:
-        return []
+    if not user_ids:
+        return ""
     
-    # Get user IDs
-    user_ids = [user['user_id'] for user in users]
+    params = {'user_ids': [str(uid) for uid in user_ids]}
+    buffer = io.StringIO()
     
-    # Get first activity dates
-    activity_data = get_first_activity_dates(user_ids)
+    start_time = time.time()
+    exported = export_query_to_csv(FACT_TABLE_QUERY, params, buffer, header=include_header)
+    execution_time = time.time() - start_time
     
-    # Combine user data with activity data
-    fact_records = []
-    for user in users:
-        user_id = user['user_id']
-        activities = activity_data.get(user_id, {})
-        
-        fact_record = {
-            'userID': user_id,
-            'createdAt': user['created_at'],
-            'username': user['username'],
-            '1stClosetAdd': activities.get('first_closet_add'),
-            '1stWishlistAdd': activities.get('first_wishlist_add'),
-            '1stOfferPosted': activities.get('first_offer_posted'),
-            '1stOfferConfirmed': activities.get('first_offer_confirmed')
-        }
-        
-        fact_records.append(fact_record)
+    # Check performance threshold
+    if execution_time > PERFORMANCE_THRESHOLDS['max_query_time']:
+        logger.warning(f"Query exceeded performance threshold: {execution_time:.2f}s")
     
-    return fact_records
+    if not exported:
+        logger.error(f"Failed to export fact table rows for {len(user_ids)} users")
+        return None
+    return buffer.getvalue()
 
 
-def validate_fact_table_data(fact_records: List[Dict[str, Any]]) -> Dict[str, Any]:
+def validate_fact_table_data(fact_records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
     """
-    Validate fact table data quality.
+    Validate fact table data quality in a single pass.
     
     Args:
-        fact_records: List of fact table records
+        fact_records: Fact table records; any iterable, e.g. a csv.DictReader
+            streaming the exported file
         
     Returns:
         Validation results
     """
-    if not fact_records:
+    total_records = 0
+    records_with_username = 0
+    records_with_activities = 0
+    for r in fact_records:
+        total_records += 1
+        if r.get('username'):
+            records_with_username += 1
+        if (r.get('1stClosetAdd') or r.get('1stWishlistAdd')
+                or r.get('1stOfferPosted') or r.get('1stOfferConfirmed')):
+            records_with_activities += 1
+    
+    if not total_records:
         return {'valid': False, 'error': 'No records to validate'}
     
-    total_records = len(fact_records)
-    records_with_username = sum(1 for r in fact_records if r.get('username'))
-    records_with_activities = sum(1 for r in fact_records 
-                                 if any([r.get('1stClosetAdd'), r.get('1stWishlistAdd'), 
-                                        r.get('1stOfferPosted'), r.get('1stOfferConfirmed')]))
-    
     validation_results = {
         'valid': True,
         'total_records': total_records,
@@ -318,47 +316,203 @@ def validate_fact_table_data(fact_records: List[Dict[str, Any]]) -> Dict[str, An
     return validation_results
 
 
-def save_fact_table_csv(fact_records: List[Dict[str, Any]], output_dir: str, timestamp: str) -> str:
+def open_fact_table_csv(file_path: str, mode: str):
+    """
+    Open a fact table CSV for text reading or writing, through gzip for .gz paths.
+    
+    Args:
+        file_path: CSV path (.csv or .csv.gz)
+        mode: 'r' or 'w'
+        
+    Returns:
+        Text file object
+    """
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, mode + 't', newline='', encoding='utf-8')
+    return open(file_path, mode, newline='', encoding='utf-8')
+
+
+def fact_table_parts_dir(user_ids: List[str], output_dir: str, batch_size: int) -> str:
     """
-    Save fact table data to CSV file.
+    Checkpoint directory for a run's per-batch CSV parts. Keyed on the user id list and
+    batch size, so a rerun over the same users resumes and any change starts fresh.
+    The id list is saved inside it (user_ids.json) for --resume.
     
     Args:
-        fact_records: List of fact table records
+        user_ids: User ids from get_new_user_ids
+        output_dir: Output directory
+        batch_size: Number of user ids per export query
+        
+    Returns:
+        Path to the parts directory (not created)
+    """
+    run_key = hashlib.sha1(f"{batch_size}:{','.join(user_ids)}".encode()).hexdigest()[:12]
+    return os.path.join(output_dir, 'tmp', f"{FACT_TABLE_PARTS_PREFIX}{run_key}")
+
+
+def load_resumable_user_ids(output_dir: str, batch_size: int) -> Optional[List[str]]:
+    """
+    Get the user id list of the most recent unfinished run, so --resume exports the
+    same users (and reuses their checkpointed parts) even if new users signed up since.
+    
+    Args:
+        output_dir: Output directory
+        batch_size: Number of user ids per export query; runs with another size are ignored
+        
+    Returns:
+        The saved user ids, or None if there is no unfinished run to resume
+    """
+    tmp_dir = os.path.join(output_dir, 'tmp')
+    if not os.path.isdir(tmp_dir):
+        return None
+    
+    candidates = []
+    for name in os.listdir(tmp_dir):
+        ids_path = os.path.join(tmp_dir, name, FACT_TABLE_PARTS_IDS_FILE)
+        if name.startswith(FACT_TABLE_PARTS_PREFIX) and os.path.exists(ids_path):
+            candidates.append((os.path.getmtime(ids_path), name, ids_path))
+    
+    for _, name, ids_path in sorted(candidates, reverse=True):
+        with open(ids_path, encoding='utf-8') as ids_file:
+            user_ids = json.load(ids_file)
+        if fact_table_parts_dir(user_ids, output_dir, batch_size) == os.path.join(tmp_dir, name):
+            return user_ids
+    return None
+
+
+def remove_stale_fact_table_parts(output_dir: str, parts_dir: str) -> None:
+    """
+    Delete checkpoint directories left by earlier failed runs over a different user
+    list, which a rerun can no longer resume from.
+    
+    Args:
+        output_dir: Output directory
+        parts_dir: The current run's parts directory, which is kept
+    """
+    tmp_dir = os.path.join(output_dir, 'tmp')
+    if not os.path.isdir(tmp_dir):
+        return
+    for name in os.listdir(tmp_dir):
+        stale_dir = os.path.join(tmp_dir, name)
+        if name.startswith(FACT_TABLE_PARTS_PREFIX) and stale_dir != parts_dir:
+            logger.info(f"Removing stale checkpoint directory {stale_dir}")
+            shutil.rmtree(stale_dir, ignore_errors=True)
+
+
+def save_fact_table_csv(user_ids: List[str], output_dir: str, timestamp: str,
+                        batch_size: int, execution_stats: Dict[str, Any], compress: bool = False) -> str:
+    """
+    Export the fact table for the given users to a CSV file, one batch of ids per COPY,
+    with up to FACT_TABLE_WORKERS batches in flight at once. Each batch is checkpointed
+    to its own part file as soon as it is exported; batches whose part already exists
+    (from an earlier failed run) are skipped, and the parts are stitched together at the end.
+    
+    Args:
+        user_ids: User ids from get_new_user_ids
         output_dir: Output directory
         timestamp: Timestamp for filename
+        batch_size: Number of user ids per export query
+        execution_stats: Execution statistics, updated with batch progress
+        compress: Gzip the CSV as it is written (saved as .csv.gz)
         
     Returns:
         Path to saved CSV file
     """
     os.makedirs(output_dir, exist_ok=True)
-    filename = f"new_user_fact_table_{timestamp}.csv"
+    filename = f"new_user_fact_table_{timestamp}.csv" + (".gz" if compress else "")
     file_path = os.path.join(output_dir, filename)
     
-    if not fact_records:
+    if not user_ids:
         logger.warning("No fact records to save")
         return ""
     
-    # Define CSV columns
-    columns = ['userID', 'createdAt', 'username', '1stClosetAdd', 
-               '1stWishlistAdd', '1stOfferPosted', '1stOfferConfirmed']
+    batches = [
+        user_ids[batch_start:batch_start + batch_size]
+        for batch_start in range(0, len(user_ids), batch_size)
+    ]
+    parts_dir = fact_table_parts_dir(user_ids, output_dir, batch_size)
+    remove_stale_fact_table_parts(output_dir, parts_dir)
+    os.makedirs(parts_dir, exist_ok=True)
+    ids_path = os.path.join(parts_dir, FACT_TABLE_PARTS_IDS_FILE)
+    if not os.path.exists(ids_path):
+        with open(ids_path + '.tmp', 'w', encoding='utf-8') as ids_file:
+            json.dump(user_ids, ids_file)
+        os.replace(ids_path + '.tmp', ids_path)
+    part_paths = [os.path.join(parts_dir, f"part-{i:05d}.csv") for i in range(len(batches))]
+    
+    pending = [i for i, part_path in enumerate(part_paths) if not os.path.exists(part_path)]
+    if len(pending) < len(batches):
+        logger.info(f"Resuming from {parts_dir}: {len(batches) - len(pending)} of {len(batches)} batches already exported")
+    
+    def export_timed(batch_index: int):
+        batch_start_time = time.time()
+        csv_text = export_fact_table_batch(batches[batch_index], include_header=(batch_index == 0))
+        if csv_text is not None:
+            # Write then rename, so a crash never leaves a truncated part behind
+            part_path = part_paths[batch_index]
+            with open(part_path + '.tmp', 'w', newline='', encoding='utf-8') as part_file:
+                part_file.write(csv_text)
+            os.replace(part_path + '.tmp', part_path)
+        return csv_text is not None, time.time() - batch_start_time
+    
+    # Batches run concurrently on separate pooled connections and checkpoint themselves;
+    # map() hands the results back in batch order for progress reporting
+    batches_done = len(batches) - len(pending)
+    users_written = len(user_ids) - sum(len(batches[i]) for i in pending)
+    with ThreadPoolExecutor(max_workers=FACT_TABLE_WORKERS) as executor:
+        for batch_index, (exported, batch_time) in zip(pending, executor.map(export_timed, pending)):
+            batch_count = batch_index + 1
+            if not exported:
+                raise RuntimeError(f"Fact table export failed on batch {batch_count}; rerun to resume")
+            
+            # Performance monitoring
+            if batch_time > PERFORMANCE_THRESHOLDS['max_query_time']:
+                logger.warning(f"Batch {batch_count} exceeded performance threshold: {batch_time:.2f}s")
+                execution_stats['performance_issues'].append(f"Batch {batch_count} slow: {batch_time:.2f}s")
+            
+            # Progress reporting
+            batches_done += 1
+            users_written += len(batches[batch_index])
+            execution_stats['batches_processed'] = batches_done
+            execution_stats['total_users_processed'] = users_written
+            
+            if batches_done % PERFORMANCE_THRESHOLDS['progress_report_interval'] == 0:
+                logger.info(f"   📊 Progress: {batches_done} batches, {users_written} users processed")
+    execution_stats['batches_processed'] = batches_done
+    execution_stats['total_users_processed'] = users_written
+    
+    # Stitch the parts together in batch order, keeping the file's created_at ordering
+    with open_fact_table_csv(file_path, 'w') as csvfile:
+        for part_path in part_paths:
+            with open(part_path, newline='', encoding='utf-8') as part_file:
+                shutil.copyfileobj(part_file, csvfile)
+    shutil.rmtree(parts_dir)
+    
+    logger.info(f"Saved {len(user_ids)} records to {file_path}")
+    return file_path
+
+
+def save_fact_table_parquet(csv_path: str) -> str:
+    """
+    Write a zstd-compressed Parquet copy of the exported fact table next to the CSV,
+    so downstream DuckDB/Arrow readers skip CSV parsing. pyarrow is optional and only
+    imported here; its C CSV reader loads the file (decompressing .gz) in one pass.
     
-    with open(file_path, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=columns)
-        writer.writeheader()
+    Args:
+        csv_path: Path returned by save_fact_table_csv
         
-        for record in fact_records:
-            # Convert datetime objects to strings for CSV
-            csv_record = {}
-            for col in columns:
-                value = record.get(col)
-                if isinstance(value, datetime):
-                    csv_record[col] = value.isoformat()
-                else:
-                    csv_record[col] = value
-            writer.writerow(csv_record)
-    
-    logger.info(f"Saved {len(fact_records)} records to {file_path}")
-    return file_path
+    Returns:
+        Path to saved Parquet file
+    """
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+    
+    parquet_path = csv_path.removesuffix('.gz').removesuffix('.csv') + '.parquet'
+    table = pa_csv.read_csv(csv_path)
+    pq.write_table(table, parquet_path, compression='zstd')
+    
+    logger.info(f"Saved {table.num_rows} records to {parquet_path}")
+    return parquet_path
 
 
 def generate_performance_report(execution_stats: Dict[str, Any], output_dir: str, timestamp: str) -> str:
@@ -406,8 +560,25 @@ def main():
         default="generated_data",
         help="Output directory for generated files"
     )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        help="Gzip the fact table CSV as it is written (.csv.gz)"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume the last failed run with its saved user list instead of reloading users"
+    )
+    parser.add_argument(
+        "--parquet",
+        action="store_true",
+        help="Also write a zstd-compressed Parquet copy of the fact table (requires pyarrow)"
+    )
     
     args = parser.parse_args()
+    if args.parquet and importlib.util.find_spec('pyarrow') is None:
+        parser.error("--parquet requires pyarrow (pip install pyarrow)")
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     
     logger.info("🚀 Starting New User Fact Table Generation")
@@ -430,8 +601,7 @@ def main():
     try:
         # Test database connection
         logger.info("Testing database connection...")
-        test_conn = get_database_connection()
-        test_conn.close()
+        check_database_connection()
         logger.info("✅ Database connection successful")
         
         # Performance analysis of main query (small subset)
@@ -446,54 +616,28 @@ def main():
                 logger.warning("⚠️ Query performance analysis indicates potential issues")
                 execution_stats['performance_issues'].append("Query performance below threshold")
         
-        # Main processing loop
-        all_fact_records = []
-        offset = 0
-        batch_count = 0
+        # Load every in-scope user once, then export their fact rows in large id batches
+        user_ids = load_resumable_user_ids(args.output_dir, args.batch_size) if args.resume else None
+        if user_ids is not None:
+            logger.info(f"Resuming with {len(user_ids)} users from the last unfinished run")
+        else:
+            if args.resume:
+                logger.info("No unfinished run to resume; loading users")
+            user_ids = get_new_user_ids(limit=100 if args.test_mode else None)
+            logger.info(f"Loaded {len(user_ids)} users to process")
         
-        while True:
-            batch_start_time = time.time()
-            
-            # Determine batch size for test mode
-            current_batch_size = 100 if args.test_mode else args.batch_size
-            
-            # Get batch of users
-            logger.info(f"Processing batch {batch_count + 1} (offset: {offset})")
-            user_batch = get_new_users_batch(offset, current_batch_size)
-            
-            if not user_batch:
-                logger.info("No more users to process")
-                break
-            
-            # Create fact table records for this batch
-            fact_batch = create_fact_table_batch(user_batch)
-            all_fact_records.extend(fact_batch)
-            
-            # Performance monitoring
-            batch_time = time.time() - batch_start_time
-            if batch_time > PERFORMANCE_THRESHOLDS['max_query_time']:
-                logger.warning(f"Batch {batch_count + 1} exceeded performance threshold: {batch_time:.2f}s")
-                execution_stats['performance_issues'].append(f"Batch {batch_count + 1} slow: {batch_time:.2f}s")
-            
-            # Progress reporting
-            batch_count += 1
-            execution_stats['batches_processed'] = batch_count
-            execution_stats['total_users_processed'] = len(all_fact_records)
-            
-            if batch_count % PERFORMANCE_THRESHOLDS['progress_report_interval'] == 0:
-                logger.info(f"   📊 Progress: {batch_count} batches, {len(all_fact_records)} users processed")
-            
-            # Update offset for next batch
-            offset += len(user_batch)
-            
-            # Break for test mode after first batch
-            if args.test_mode:
-                logger.info("Test mode: stopping after first batch")
-                break
+        logger.info("Saving fact table to CSV...")
+        csv_path = save_fact_table_csv(user_ids, args.output_dir, timestamp, args.batch_size, execution_stats,
+                                       compress=args.gzip)
+        execution_stats['output_csv'] = csv_path
         
-        # Data validation
+        # Data validation (streams the exported rows back; NULL dates come back as '')
         logger.info("Validating fact table data quality...")
-        validation_results = validate_fact_table_data(all_fact_records)
+        if csv_path:
+            with open_fact_table_csv(csv_path, 'r') as csvfile:
+                validation_results = validate_fact_table_data(csv.DictReader(csvfile))
+        else:
+            validation_results = validate_fact_table_data([])
         execution_stats['data_quality_metrics'] = validation_results
         
         if validation_results['valid']:
@@ -505,10 +649,8 @@ def main():
             logger.error("❌ Data validation failed")
             return
         
-        # Save fact table CSV
-        logger.info("Saving fact table to CSV...")
-        csv_path = save_fact_table_csv(all_fact_records, args.output_dir, timestamp)
-        execution_stats['output_csv'] = csv_path
+        if args.parquet:
+            execution_stats['output_parquet'] = save_fact_table_parquet(csv_path)
         
         # Generate performance report
         execution_stats['end_time'] = datetime.now()
@@ -522,6 +664,8 @@ def main():
         logger.info(f"   Total execution time: {execution_stats['total_execution_time']:.2f}s")
         logger.info(f"   Data quality score: {validation_results['data_quality_score']:.1f}%")
         logger.info(f"   Output CSV: {csv_path}")
+        if args.parquet:
+            logger.info(f"   Output Parquet: {execution_stats['output_parquet']}")
         logger.info(f"   Performance report: {report_path}")
         
         if execution_stats['performance_issues']:
@@ -1,6 +1,7 @@
 import os
 import sys
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Dict, Any
 import argparse
@@ -9,21 +10,22 @@ import argparse
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from basic_capabilities.internal_db_queries_toolbox.email_csv_queries import (
-    get_audience,
+    get_audience_with_product_variants,
     get_products_by_ids,
-    get_variants_by_product_ids,
 )
 
 def parse_args():
     """Parses command-line arguments."""
     parser = argparse.ArgumentParser(description="Generate a 'Single Shoe Feature' email CSV for a product and a target audience.")
-    parser.add_argument("product_id", type=str, help="The UUID of the target product for the campaign.")
+    parser.add_argument("product_ids", type=str, nargs='+', help="The UUID of the target product for the campaign. Pass several to generate one CSV per product.")
     parser.add_argument("--days_since_last_active", type=int, default=365, help="Maximum number of days since a user was last active.")
+    parser.add_argument("--min_closet_items", type=int, default=0, help="Minimum number of items in a user's closet.")
+    parser.add_argument("--min_lifetime_trades", type=int, default=0, help="Minimum number of lifetime trades for a user.")
     parser.add_argument("--stats_lookback_days", type=int, default=30, help="Number of days to look back for product statistics.")
     return parser.parse_args()
 
 def generate_single_shoe_feature_csv(
-    product_id: str, 
+    product_ids: List[str], 
     stats_lookback_days: int,
     days_since_last_active: int, 
     min_closet_items: int, 
@@ -31,15 +33,16 @@ def generate_single_shoe_feature_csv(
     output_dir: str = 'projects/email-csv-creation/generated_csvs'
 ):
     """
-    Generates a CSV for a "Single Shoe Feature" email campaign for a single product.
+    Generates a CSV for a "Single Shoe Feature" email campaign for each given product.
 
-    This script first fetches a general audience of engaged users based on activity criteria.
-    Then, it gathers detailed data about a specific product and its variants.
-    Finally, it combines the data, matching users to the product's variants based on their
-    preferred shoe size, and creates a single CSV file formatted for an email campaign.
+    This script fetches an audience of engaged users based on activity criteria, already
+    matched in the database to each product's variant in each user's preferred shoe size.
+    Every product is matched in one query, so the audience is read once per batch. It
+    then adds the product-level stats and creates one CSV file per product formatted for
+    an email campaign.
 
     Args:
-        product_id: The UUID of the target product for the campaign.
+        product_ids: The UUIDs of the target products for the campaign.
         stats_lookback_days: The lookback period in days for product/variant stats.
         days_since_last_active: Max days since a user was active to be in the audience.
         min_closet_items: Min closet items for a user to be in the audience.
@@ -47,65 +50,77 @@ def generate_single_shoe_feature_csv(
         output_dir: The directory where the generated CSV will be saved.
 
     Returns:
-        The file path of the generated CSV.
+        The file paths of the generated CSVs, or None if the data could not be fetched.
     """
     print("--- Starting 'Single Shoe Feature' CSV Generation ---")
     print(f"Audience Criteria: Last Active <= {days_since_last_active}d, Min Closet >= {min_closet_items}, Min Trades >= {min_lifetime_trades}")
-    print(f"Product: {product_id}, Stats Lookback: {stats_lookback_days}d")
+    print(f"Products: {', '.join(product_ids)}, Stats Lookback: {stats_lookback_days}d")
     
     # --- 1. EXTRACT: Fetch all the necessary data ---
-    print("Fetching audience data...")
-    audience_data = get_audience(days_since_last_active, min_closet_items, min_lifetime_trades)
-    print(f"--- Found {len(audience_data)} users in the audience. ---")
+    # The audience is matched to every product's variants by size in the database,
+    # so only matched users come back. The two queries are independent, so they
+    # run at the same time on separate pooled connections.
+    print("Fetching audience matched to product variants and product data...")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        matched_future = executor.submit(
+            get_audience_with_product_variants,
+            product_ids, stats_lookback_days, days_since_last_active, min_closet_items, min_lifetime_trades
+        )
+        product_future = executor.submit(get_products_by_ids, product_ids, stats_lookback_days)
+        matched_data = matched_future.result()
+        product_data = product_future.result()
+
+    if matched_data is None or not product_data:
+        print("Error: Could not retrieve audience or product data. Aborting.")
+        return None
 
-    print("Fetching product data...")
-    product_data = get_products_by_ids([product_id], stats_lookback_days)
+    # Split the rows per product; the database hands uuids back in lowercase
+    products_by_id = {str(product['id']): product for product in product_data}
+    matched_by_product = {product_id.lower(): [] for product_id in product_ids}
+    for row in matched_data:
+        matched_by_product[row['product_id']].append(row)
+
+    file_paths = []
+    for product_id in product_ids:
+        product_info = products_by_id.get(product_id.lower())
+        if product_info is None:
+            print(f"Error: Could not retrieve product data for {product_id}. Skipping.")
+            continue
+        file_paths.append(write_single_shoe_csv(product_info, matched_by_product[product_id.lower()], output_dir))
+    return file_paths
 
-    print("Fetching variant data...")
-    variants_data = get_variants_by_product_ids([product_id], stats_lookback_days)
 
-    if not audience_data or not product_data:
-        print("Error: Could not retrieve audience or product data. Aborting.")
-        return None
+def write_single_shoe_csv(product_info: Dict[str, Any], matched_data: List[Dict[str, Any]], output_dir: str) -> str:
+    """
+    Writes the "Single Shoe Feature" CSV for one product.
+
+    Args:
+        product_info: The product's row from get_products_by_ids.
+        matched_data: The product's rows from get_audience_with_product_variants.
+        output_dir: The directory where the generated CSV will be saved.
+
+    Returns:
+        The file path of the generated CSV.
+    """
+    print(f"--- {product_info.get('name', product_info['id'])}: found {len(matched_data)} audience users with a variant in their size. ---")
 
     # --- 2. TRANSFORM: Process and combine the data ---
     print("Processing and combining data...")
-    
-    # Create a dictionary for quick variant lookup by size
-    # Normalize the size to a float to ensure consistent matching
-    variants_by_size = {float(v['size']): v for v in variants_data}
-
-    # Since we are fetching for a single product, we can grab it directly.
-    product_info = product_data[0] if product_data else {}
-
-    # Combine data
-    final_data = []
-    for user in audience_data:
-        try:
-            # Normalize the user's shoe size to a float for lookup
-            user_size = float(user.get('shoe_size'))
-            
-            if user_size in variants_by_size:
-                variant = variants_by_size[user_size]
-                
-                # Create the final flat dictionary for the CSV row by mapping data
-                # from our queries to the required CSV fieldnames.
-                row = {
-                    'email': user.get('user_email'),
-                    'firstname': user.get('user_first_name'),
-                    'usersize': user.get('shoe_size'),
-                    'feat_shoe1_offers_7d': product_info.get('recent_offers_to_get'),
-                    'feat_shoe1_closet_7d': product_info.get('recent_closet_adds'),
-                    'feat_shoe1_wishlist_7d': product_info.get('recent_wishlist_adds'),
-                    'feat_shoe1_variantid': variant.get('variant_id'),
-                    'feat_shoe1_offers_in_size': variant.get('recent_offers_to_get'),
-                    'feat_shoe1_inventory_in_size': variant.get('total_closet_owners'),
-                    'feat_shoe1_wishlist_in_size': variant.get('total_wishlist_adds'),
-                }
-                final_data.append(row)
-        except (ValueError, TypeError):
-            # Handle cases where shoe_size is not a valid number
-            continue
+
+    # Product-level stats are the same on every row
+    product_stats = (
+        product_info.get('recent_offers_to_get'),
+        product_info.get('recent_closet_adds'),
+        product_info.get('recent_wishlist_adds'),
+    )
+
+    # Combine data: build each CSV row as a tuple in fieldnames order
+    final_data = [
+        (row['user_email'], row['user_first_name'], row['shoe_size'])
+        + product_stats
+        + (row['variant_id'], row['recent_offers_to_get'], row['total_closet_owners'], row['total_wishlist_adds'])
+        for row in matched_data
+    ]
 
     if not final_data:
         print("--- No matching users and variants found. Resulting CSV will be empty. ---")
@@ -131,8 +146,8 @@ def generate_single_shoe_feature_csv(
     print(f"Writing data to {file_path}...")
     
     with open(file_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
+        writer = csv.writer(f)
+        writer.writerow(fieldnames)
         writer.writerows(final_data)
 
     print(f"--- CSV Generation Complete. {len(final_data)} rows written. ---")
@@ -144,7 +159,7 @@ if __name__ == '__main__':
     args = parse_args()
     
     generate_single_shoe_feature_csv(
-        product_id=args.product_id, 
+        product_ids=args.product_ids, 
         stats_lookback_days=args.stats_lookback_days,
         days_since_last_active=args.days_since_last_active,
         min_closet_items=args.min_closet_items,
@@ -1,6 +1,5 @@
 import os
 import sys
-import csv
 from datetime import datetime
 from typing import List, Dict, Any
 import argparse
@@ -9,12 +8,7 @@ import pandas as pd
 # Add the project root to the Python path to allow importing from basic_capabilities
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from basic_capabilities.internal_db_queries_toolbox.email_csv_queries import (
-    get_audience,
-    get_products_by_ids,
-    get_variants_by_product_ids,
-)
-from basic_capabilities.internal_db_queries_toolbox.sql_utils import execute_query
+from basic_capabilities.internal_db_queries_toolbox.email_csv_queries import get_trending_shoes_rows
 
 def parse_args():
     """Parses command-line arguments."""
@@ -37,10 +31,10 @@ def generate_trending_shoes_csv(
     """
     Generates a CSV for a "Trending Shoes" email campaign for a list of products.
 
-    This script first fetches a general audience of engaged users based on activity criteria.
-    Then, it gathers detailed data about the specified products and their variants.
-    Finally, it combines the data, matching users to the product variants based on their
-    preferred shoe size, and creates a single CSV file formatted for the email campaign.
+    A single query fetches the audience of engaged users (based on activity criteria)
+    already matched to the specified products' variants in each user's preferred shoe
+    size, with the variant stats attached. The rows are then written to a single CSV
+    file formatted for the email campaign.
 
     Args:
         product_ids: A list of exactly 3 product IDs to feature.
@@ -51,85 +45,26 @@ def generate_trending_shoes_csv(
         output_dir: The directory where the generated CSV will be saved.
 
     Returns:
-        The file path of the generated CSV.
+        The file path of the generated CSV, or None if no rows matched or the query failed.
     """
     print("--- Starting 'Trending Shoes' CSV Generation ---")
     print(f"Audience Criteria: Last Active <= {days_since_last_active}d, Min Closet >= {min_closet_items}, Min Trades >= {min_lifetime_trades}")
     print(f"Products: {product_ids}, Stats Lookback: {stats_lookback_days}d")
     
-    # --- 1. EXTRACT: Fetch all the necessary data ---
-    print("Fetching audience data...")
-    audience_data = get_audience(days_since_last_active, min_closet_items, min_lifetime_trades)
-    print(f"--- Found {len(audience_data)} users in the audience. ---")
-
-    print("Fetching product data...")
-    product_data = get_products_by_ids(product_ids, stats_lookback_days)
-
-    print("Fetching variant data...")
-    variants_data = get_variants_by_product_ids(product_ids, stats_lookback_days)
-
-    if not audience_data or not product_data:
-        print("Error: Could not retrieve audience or product data. Aborting.")
+    # --- 1. EXTRACT: Fetch the audience already matched to the featured variants ---
+    # The size match and per-product stats are joined in the database, one row per matched user
+    print("Fetching audience matched to product variants...")
+    rows = get_trending_shoes_rows(
+        product_ids, stats_lookback_days, days_since_last_active, min_closet_items, min_lifetime_trades
+    )
+
+    if rows is None:
+        print("Error: Could not retrieve audience or variant data. Aborting.")
         return None
 
-    # --- 2. TRANSFORM: Process and combine the data ---
-    print("Processing and combining data...")
-    
-    # Create a nested dictionary for quick variant lookup by product_id and then size
-    # {product_id: {size: variant_dict}}
-    variants_by_product_and_size = {}
-    for v in variants_data:
-        try:
-            product_id = v['product_id']
-            size = float(v['size'])
-            if product_id not in variants_by_product_and_size:
-                variants_by_product_and_size[product_id] = {}
-            variants_by_product_and_size[product_id][size] = v
-        except (ValueError, TypeError, KeyError):
-            continue
-
-    # Combine data
-    final_data = []
-    for user in audience_data:
-        try:
-            # Normalize the user's shoe size to a float for lookup
-            user_size = float(user.get('shoe_size'))
-            
-            # Create the base row with user info
-            row = {
-                'email': user.get('user_email'),
-                'firstname': user.get('user_first_name'),
-                'usersize': user.get('shoe_size'),
-            }
-            
-            # Flag to ensure we only include users who can be matched to at least one shoe
-            matched_at_least_one = False
-
-            # Iterate through the three featured product IDs to populate the row
-            for i, product_id in enumerate(product_ids, 1):
-                variant = variants_by_product_and_size.get(product_id, {}).get(user_size)
-                
-                if variant:
-                    matched_at_least_one = True
-                    row[f'feat_shoe{i}_variantid'] = variant.get('variant_id')
-                    row[f'feat_shoe{i}_offers_in_size'] = variant.get('recent_offers_to_get')
-                    row[f'feat_shoe{i}_inventory_in_size'] = variant.get('total_closet_owners')
-                    row[f'feat_shoe{i}_wishlist_in_size'] = variant.get('total_wishlist_adds')
-                else:
-                    # If no matching variant, fill with empty values
-                    row[f'feat_shoe{i}_variantid'] = None
-                    row[f'feat_shoe{i}_offers_in_size'] = None
-                    row[f'feat_shoe{i}_inventory_in_size'] = None
-                    row[f'feat_shoe{i}_wishlist_in_size'] = None
-            
-            if matched_at_least_one:
-                final_data.append(row)
-        except (ValueError, TypeError):
-            # Handle cases where shoe_size is not a valid number
-            continue
-
-    if not final_data:
-        print("--- No matching users and variants found. Resulting CSV will be empty. ---")
+    if not rows:
+        print("--- No matching users and variants found; skipping file write. ---")
+        return None
         
     # Define the order of columns for the CSV, matching the example file
     fieldnames = [
@@ -139,7 +74,7 @@ def generate_trending_shoes_csv(
         'feat_shoe3_variantid', 'feat_shoe3_offers_in_size', 'feat_shoe3_inventory_in_size', 'feat_shoe3_wishlist_in_size',
     ]
 
-    # --- 3. LOAD: Write the data to a CSV file ---
+    # --- 2. LOAD: Write the data to a CSV file ---
     
     # Create the output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
@@ -151,12 +86,13 @@ def generate_trending_shoes_csv(
     
     print(f"Writing data to {file_path}...")
     
-    with open(file_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(final_data)
+    # pandas' C writer, in chunks to cap memory on large audiences; missing stats are written blank.
+    # object dtype keeps counts as written (no int -> float upcast when a product has no match).
+    # One large file buffer, handed to pandas so it doesn't wrap the file in its own
+    with open(file_path, 'w', newline='', encoding='utf-8', buffering=4 * 1024 * 1024) as f:
+        pd.DataFrame(rows, columns=fieldnames, dtype=object).to_csv(f, index=False, chunksize=50_000)
 
-    print(f"--- CSV Generation Complete. {len(final_data)} rows written. ---")
+    print(f"--- CSV Generation Complete. {len(rows)} rows written. ---")
     
     return file_path
 
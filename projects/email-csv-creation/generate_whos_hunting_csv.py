@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 
 import argparse
-import csv
 import datetime
+import json
 import os
 import sys
 from typing import Dict, Any, List
 
+import pandas as pd
+
 # Add the project root to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
@@ -18,6 +20,9 @@ STANDARD_SHOE_SIZES = [
     '10', '10.5', '11', '11.5', '12', '12.5', '13', '14', '15', '16', '17', '18'
 ]
 
+# Same-day hunter results, kept next to the generated CSVs rather than in the shared temp directory
+HUNTERS_CACHE_DIR = os.path.join(os.path.dirname(__file__), "generated_csvs", ".cache")
+
 def parse_args():
     """Parse command-line arguments."""
     parser = argparse.ArgumentParser(description="Generate a CSV for the 'Who's Huntin'' email campaign.")
@@ -28,29 +33,66 @@ def parse_args():
     parser.add_argument('--lookback-days', type=int, default=7, help="The number of days to look back for hunter offer activity.")
     return parser.parse_args()
 
-def format_hunter_data_for_row(hunters: List[Dict[str, Any]]) -> Dict[str, Any]:
+# Hunter fields as returned by the query -> their hunter{rank}_* CSV column suffix
+HUNTER_COLUMNS = {
+    'hunter_username': 'username',
+    'hunter_avatar_path': 'avatar',
+    'hunter_user_id': 'userid',
+    'hunter_trade_count': 'tradecount',
+    'offers_for_product': 'offers7d',
+    'target_product_name': 'target1_name',
+    'target_product_image_path': 'target1_image',
+}
+
+def build_hunters_by_size_table(hunters_by_size: Dict[str, List[Dict[str, Any]]]) -> pd.DataFrame:
+    """
+    Pivots the top 3 hunters of every size with at least 3 hunters into one wide row per
+    size ('size' plus the hunter{1..3}_* columns), ready to be merged onto the audience.
+    """
+    hunters_df = pd.DataFrame(
+        [
+            {**hunter, 'size': size, 'rank': rank}
+            for size, hunters in hunters_by_size.items() if len(hunters) >= 3
+            for rank, hunter in enumerate(hunters[:3], 1)
+        ],
+        columns=['size', 'rank', *HUNTER_COLUMNS],
+        dtype=object,
+    )
+    wide = hunters_df.pivot(index='size', columns='rank', values=list(HUNTER_COLUMNS))
+    wide.columns = [f'hunter{rank}_{HUNTER_COLUMNS[field]}' for field, rank in wide.columns]
+    # Reindex so the columns exist even when no size has enough hunters
+    return wide.reindex(
+        columns=[f'hunter{rank}_{suffix}' for rank in range(1, 4) for suffix in HUNTER_COLUMNS.values()]
+    ).reset_index()
+
+def load_hunters_by_size(lookback_days: int) -> Dict[str, List[Dict[str, Any]]]:
     """
-    Flattens the list of up to 3 hunter dictionaries for a single CSV row.
+    Returns the top hunters for STANDARD_SHOE_SIZES, reusing today's result from a
+    cache file in HUNTERS_CACHE_DIR so reruns on the same day skip the database.
+    Only successful, non-empty results are cached, and writing one removes the
+    files left over from earlier days.
     """
-    flat_data = {}
-    for i, hunter in enumerate(hunters, 1):
-        flat_data[f'hunter{i}_username'] = hunter.get('hunter_username')
-        flat_data[f'hunter{i}_avatar'] = hunter.get('hunter_avatar_path')
-        flat_data[f'hunter{i}_userid'] = hunter.get('hunter_user_id')
-        flat_data[f'hunter{i}_tradecount'] = hunter.get('hunter_trade_count')
-        flat_data[f'hunter{i}_offers7d'] = hunter.get('offers_for_product')
-        flat_data[f'hunter{i}_target1_name'] = hunter.get('target_product_name')
-        flat_data[f'hunter{i}_target1_image'] = hunter.get('target_product_image_path')
-    # Fill remaining hunter columns with nulls if fewer than 3 hunters were found
-    for i in range(len(hunters) + 1, 4):
-        flat_data[f'hunter{i}_username'] = None
-        flat_data[f'hunter{i}_avatar'] = None
-        flat_data[f'hunter{i}_userid'] = None
-        flat_data[f'hunter{i}_tradecount'] = None
-        flat_data[f'hunter{i}_offers7d'] = None
-        flat_data[f'hunter{i}_target1_name'] = None
-        flat_data[f'hunter{i}_target1_image'] = None
-    return flat_data
+    today_prefix = f"whos_hunting_{datetime.date.today()}_"
+    cache_path = os.path.join(HUNTERS_CACHE_DIR, f"{today_prefix}{lookback_days}d.json")
+    if os.path.exists(cache_path):
+        print(f"Using cached hunters from {cache_path}")
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    hunters_by_size = get_whos_hunting_data_by_size(STANDARD_SHOE_SIZES, lookback_days)
+    if hunters_by_size:
+        os.makedirs(HUNTERS_CACHE_DIR, exist_ok=True)
+        for name in os.listdir(HUNTERS_CACHE_DIR):
+            if name.startswith("whos_hunting_") and not name.startswith(today_prefix):
+                try:
+                    os.remove(os.path.join(HUNTERS_CACHE_DIR, name))
+                except FileNotFoundError:
+                    pass  # Already removed by a concurrent run
+        # Write then rename, so a concurrent run never reads a partial file
+        with open(cache_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(hunters_by_size, f, default=str)
+        os.replace(cache_path + '.tmp', cache_path)
+    return hunters_by_size
 
 def main():
     """Main function to generate the CSV."""
@@ -60,7 +102,7 @@ def main():
     
     # 1. Fetch the top hunters for all standard shoe sizes
     print(f"Finding hunters for {len(STANDARD_SHOE_SIZES)} standard sizes...")
-    hunters_by_size = get_whos_hunting_data_by_size(STANDARD_SHOE_SIZES, args.lookback_days)
+    hunters_by_size = load_hunters_by_size(args.lookback_days)
 
     if not hunters_by_size:
         print("Error: Could not find any hunters for the standard sizes. Exiting.")
@@ -79,28 +121,18 @@ def main():
         print("No users found in the audience for the given criteria. Exiting.")
         sys.exit(0)
     
-    # 3. Combine data and prepare for CSV
-    final_data = []
-    for recipient in audience:
-        recipient_size = recipient.get('shoe_size')
-        if not recipient_size:
-            continue
-        
-        # Find the hunter data for this recipient's size
-        # The keys in hunters_by_size are strings, so we match directly.
-        top_hunters_for_size = hunters_by_size.get(recipient_size)
-
-        if top_hunters_for_size and len(top_hunters_for_size) >= 3:
-            # Flatten the hunter data for the CSV row
-            hunter_data_flat = format_hunter_data_for_row(top_hunters_for_size[:3])
-            
-            row_data = {
-                'email': recipient.get('email'),
-                'firstname': recipient.get('first_name'),
-                'usersize': recipient_size
-            }
-            row_data.update(hunter_data_flat)
-            final_data.append(row_data)
+    # 3. Combine data: match each recipient to the hunters for their size in one join.
+    # The keys in hunters_by_size are strings, so sizes are matched as-is.
+    audience_df = pd.DataFrame(audience, columns=['user_email', 'user_first_name', 'shoe_size'], dtype=object).rename(
+        columns={'user_email': 'email', 'user_first_name': 'firstname', 'shoe_size': 'usersize'}
+    )
+    final_df = audience_df.merge(
+        build_hunters_by_size_table(hunters_by_size), left_on='usersize', right_on='size', how='inner', validate='m:1'
+    )
+
+    if final_df.empty:
+        print("--- No recipients matched hunters for their size; skipping file write. ---")
+        return
 
     # 4. Prepare CSV file and headers
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
@@ -116,13 +148,13 @@ def main():
         'hunter3_username', 'hunter3_avatar', 'hunter3_userid', 'hunter3_tradecount', 'hunter3_offers7d', 'hunter3_target1_name', 'hunter3_target1_image'
     ]
 
-    print(f"Writing {len(final_data)} rows to {filename}...")
+    print(f"Writing {len(final_df)} rows to {filename}...")
 
     # 5. Write data to CSV
-    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=header)
-        writer.writeheader()
-        writer.writerows(final_data)
+    # Hunter columns stay object dtype, so counts are written as-is (no int -> float upcast).
+    # One large file buffer, handed to pandas so it doesn't wrap the file in its own
+    with open(filename, 'w', newline='', encoding='utf-8', buffering=4 * 1024 * 1024) as csvfile:
+        final_df.to_csv(csvfile, columns=header, index=False, chunksize=50_000)
 
     print("--- CSV Generation Complete ---")
     print(f"Successfully created: {filename}")
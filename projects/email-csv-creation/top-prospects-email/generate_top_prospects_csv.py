@@ -1,18 +1,16 @@
 #!/usr/bin/env python3
 import argparse
-import csv
 import datetime
 import os
 import sys
 from typing import List, Dict, Any
 
+import pandas as pd
+
 # Adjust the path to include the parent directory
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
 
-from basic_capabilities.internal_db_queries_toolbox.email_csv_queries import (
-    get_user_data_by_ids,
-    get_top_target_shoe_for_users
-)
+from basic_capabilities.internal_db_queries_toolbox.email_csv_queries import get_top_prospects_rows
 
 def parse_args():
     """Parses command-line arguments."""
@@ -33,16 +31,19 @@ def parse_args():
 
 def read_user_ids(file_path: str) -> List[str]:
     """Reads user IDs from a CSV file."""
-    user_ids = []
     try:
-        with open(file_path, 'r', newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                if 'user_id' in row:
-                    user_ids.append(row['user_id'])
+        # Only the user_id column is parsed, as strings; blank ids would break the uuid cast, so drop them
+        user_id_column = pd.read_csv(file_path, usecols=['user_id'], dtype=str, keep_default_na=False)['user_id'].str.strip()
+        blank_count = int((user_id_column == '').sum())
+        if blank_count:
+            print(f"Warning: Skipping {blank_count} rows with a blank user_id.")
+        user_ids = user_id_column[user_id_column != ''].tolist()
     except FileNotFoundError:
         print(f"Error: The file at {file_path} was not found.")
         sys.exit(1)
+    except ValueError:
+        # No user_id column, or an empty file
+        user_ids = []
     except Exception as e:
         print(f"An error occurred while reading the CSV file: {e}")
         sys.exit(1)
@@ -66,27 +67,33 @@ def main():
         print("Exiting: No user IDs to process.")
         return
 
-    print("Fetching user data...")
-    user_data = {item['user_id']: item for item in get_user_data_by_ids(user_ids)}
-    
-    print("Fetching top target shoes...")
-    target_shoe_data = {item['user_id']: item for item in get_top_target_shoe_for_users(user_ids)}
+    # One round trip for user data and top target shoe; users without desired items
+    # come back with empty top_target_shoe_* columns
+    print("Fetching user data and top target shoes...")
+    prospect_rows = get_top_prospects_rows(user_ids)
+    if prospect_rows is None:
+        print("Error: Could not fetch user data and top target shoes from the database. Exiting.")
+        sys.exit(1)
+    prospects_df = pd.DataFrame(
+        prospect_rows,
+        columns=['user_id', 'email', 'first_name', 'user_size', 'top_target_shoe_variantid', 'top_target_shoe_name']
+    )
+    with_items = prospects_df['top_target_shoe_variantid'].notna()
+
+    missing_basic = set(user_ids) - set(prospects_df['user_id'])
+    if missing_basic:
+        print(f"Warning: Skipping {len(missing_basic)} users - missing basic data (email, name, or size): {', '.join(sorted(missing_basic))}")
+    missing_items = set(prospects_df.loc[~with_items, 'user_id'])
+    if missing_items:
+        print(f"Warning: Skipping {len(missing_items)} users - no desired items found: {', '.join(sorted(missing_items))}")
 
-    final_data = []
-    for user_id in user_ids:
-        if user_id not in user_data:
-            print(f"Warning: Skipping user {user_id} - missing basic data (email, name, or size).")
-            continue
-        if user_id not in target_shoe_data:
-            print(f"Warning: Skipping user {user_id} - no desired items found.")
-            continue
-            
-        # Merge data
-        combined_record = {**user_data[user_id], **target_shoe_data[user_id]}
-        final_data.append(combined_record)
+    # Line the complete rows up with the input ids, keeping the input order
+    final_df = pd.DataFrame({'user_id': user_ids}).merge(
+        prospects_df[with_items], on='user_id', how='inner', validate='m:1'
+    )
 
     # TODO: Implement CSV writing logic
-    print(f"Successfully processed {len(final_data)} users with complete data.")
+    print(f"Successfully processed {len(final_df)} users with complete data.")
     print("Main logic complete. CSV writing to be implemented.")
 
 
@@ -1,9 +1,19 @@
 import re
 import os
+from functools import lru_cache
 
+from campaign_blocks import CAMPAIGN_SEPARATOR, iter_blocks
+
+# Compiled once at import; matched against every subject line
+SIZE_PATTERN = re.compile(r'size \d+')
+
+@lru_cache(maxsize=None)
 def get_v2_tags(subject):
     """
-    Analyzes an email subject line and returns a dictionary of V2 tags.
+    Analyzes an email subject line and returns its V2 tags as a tuple of
+    (category, tuple of tags) pairs. Results are memoized per subject, since
+    resends and A/B variants repeat subjects verbatim; the return value is
+    immutable so the cached copy can't be altered by callers.
     """
     subject_lower = subject.lower()
     tags = {
@@ -67,7 +77,7 @@ def get_v2_tags(subject):
 
 
     # Personalization Level
-    if re.search(r'size \d+', subject_lower) or 'your size' in subject_lower:
+    if SIZE_PATTERN.search(subject_lower) or 'your size' in subject_lower:
         tags['personalization_level'] = ['Personalized']
     elif 'you’ve earned' in subject_lower or 'unlocked' in subject_lower or 'you just got' in subject_lower or 'top hunters' in subject_lower:
         tags['personalization_level'] = ['Segmented']
@@ -83,97 +93,93 @@ def get_v2_tags(subject):
     if 'ab_test' in subject_lower:
         tags['test_details'] = ['Subject Line A/B Test']
 
-    # Clean up empty lists and ensure no duplicates
-    final_tags = {}
-    for key, value in tags.items():
-        if isinstance(value, list):
-            unique_values = sorted(list(set(value)))
-            if unique_values:
-                final_tags[key] = unique_values
-        else:
-            final_tags[key] = value
-            
-    # Add a special case for subject line tests to make them easier to analyze
-    if 'ab_test' in subject:
-        tags['test_details'] = ['Subject Line A/B Test']
-    
-    # ensure no duplicates
-    for key in tags:
-        if isinstance(tags[key], list):
-            tags[key] = sorted(list(set(tags[key])))
+    # Dedupe each category in one pass; tags stay sorted so the written tag lines are stable
+    return tuple((key, tuple(sorted(set(values)))) for key, values in tags.items())
 
+def process_campaign(campaign):
+    """
+    Rewrites one campaign block with its V2 tags section.
+    Returns the block text to write, or None for a blank block.
+    """
+    if campaign.strip() == "":
+        return None
+
+    lines = campaign.strip().split('\n')
+    subject = ''
+    subject_line_test_id = ''
+
+    for line in lines:
+        if line.startswith('Subject Line:'):
+            subject = line.replace('Subject Line:', '').strip()
+        if line.startswith('Subject Line Test ID:'):
+            subject_line_test_id = line.replace('Subject Line Test ID:', '').strip()
+    
+    if subject_line_test_id:
+        subject_for_tagging = f"{subject} ({subject_line_test_id})"
+    else:
+        subject_for_tagging = subject
 
-    return tags
+    if not subject:
+        return campaign
+        
+    v2_tags = get_v2_tags(subject_for_tagging)
+
+    # Create the new tags section
+    new_tags_section = ['--- Tags ---']
+    for key, values in v2_tags:
+        if values: # Only add if there are tags
+             new_tags_section.append(f"{key}: {', '.join(values)}")
+
+    # Replace old tags in the campaign block
+    new_campaign_lines = []
+    in_tags_section = False
+    tags_section_replaced = False
+    for line in lines:
+        if line.strip() == '--- Tags ---':
+            if not tags_section_replaced:
+                new_campaign_lines.extend(new_tags_section)
+                tags_section_replaced = True
+            in_tags_section = True
+        elif in_tags_section and line.startswith('---'):
+            in_tags_section = False
+            new_campaign_lines.append(line)
+        elif not in_tags_section:
+            new_campaign_lines.append(line)
+
+    return '\n'.join(new_campaign_lines)
 
 def main():
     input_file = 'projects/email-impact/generated_outputs/phase_3/master_impact_analysis_tagged.txt'
     output_file = 'projects/email-impact/generated_outputs/phase_3/master_impact_analysis_tagged_v2.txt'
 
     try:
-        with open(input_file, 'r') as f:
-            content = f.read()
+        in_f = open(input_file, 'r', buffering=1024 * 1024)
     except FileNotFoundError:
         print(f"Error: Input file not found at {input_file}")
         return
 
-    campaigns = content.split('================================================================================')
-
-    new_campaigns_content = []
-
-    for campaign in campaigns:
-        if campaign.strip() == "":
-            continue
-
-        lines = campaign.strip().split('\n')
-        subject = ''
-        subject_line_test_id = ''
-
-        for line in lines:
-            if line.startswith('Subject Line:'):
-                subject = line.replace('Subject Line:', '').strip()
-            if line.startswith('Subject Line Test ID:'):
-                subject_line_test_id = line.replace('Subject Line Test ID:', '').strip()
-        
-        if subject_line_test_id:
-            subject_for_tagging = f"{subject} ({subject_line_test_id})"
-        else:
-            subject_for_tagging = subject
-
-        if not subject:
-            new_campaigns_content.append(campaign)
-            continue
-            
-        v2_tags = get_v2_tags(subject_for_tagging)
-
-        # Create the new tags section
-        new_tags_section = ['--- Tags ---']
-        for key, values in v2_tags.items():
-            if values: # Only add if there are tags
-                 new_tags_section.append(f"{key}: {', '.join(values)}")
-
-        # Replace old tags in the campaign block
-        new_campaign_lines = []
-        in_tags_section = False
-        tags_section_replaced = False
-        for line in lines:
-            if line.strip() == '--- Tags ---':
-                if not tags_section_replaced:
-                    new_campaign_lines.extend(new_tags_section)
-                    tags_section_replaced = True
-                in_tags_section = True
-            elif in_tags_section and line.startswith('---'):
-                in_tags_section = False
-                new_campaign_lines.append(line)
-            elif not in_tags_section:
-                new_campaign_lines.append(line)
-
-        new_campaigns_content.append('\n'.join(new_campaign_lines))
-
     # Ensure the output directory exists
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    
-    with open(output_file, 'w') as f:
-        f.write('\n\n================================================================================\n\n'.join(new_campaigns_content))
+
+    # Stream one campaign at a time, writing each rewritten block straight out
+    # instead of holding the whole file
+    with in_f, open(output_file, 'w', buffering=1024 * 1024) as out_f:
+        first_block = True
+
+        def write_block(campaign):
+            nonlocal first_block
+            block = process_campaign(campaign)
+            if block is None:
+                return
+            if not first_block:
+                out_f.write(f'\n\n{CAMPAIGN_SEPARATOR}\n\n')
+            out_f.write(block)
+            first_block = False
+
+        # Blocks without a subject are written back untouched, so keep the
+        # separator's line break with them to leave those bytes unchanged
+        for campaign in iter_blocks(in_f, keep_line_breaks=True):
+            write_block(campaign)
 
     print(f"Successfully processed file and wrote output to {output_file}")
 
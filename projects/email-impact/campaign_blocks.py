@@ -0,0 +1,40 @@
+"""
+Helpers shared by the email-impact scripts for reading the campaign blocks of
+the master analysis files.
+"""
+
+CAMPAIGN_SEPARATOR = '================================================================================'
+
+def iter_blocks(lines, keep_line_breaks=False):
+    """
+    Yields the campaign blocks of a master analysis file one at a time.
+
+    `lines` is any iterable of lines, usually the open file itself, so only
+    one block is held in memory. Blocks are split on separator lines, which
+    are not included in the yielded text. With keep_line_breaks=True the
+    separator's line break starts the next block, so joining the blocks with
+    the bare separator reproduces the input exactly.
+    """
+    buf = []
+    for line in lines:
+        if line.rstrip('\n') == CAMPAIGN_SEPARATOR:
+            if buf:
+                yield ''.join(buf)
+            buf = [line[len(CAMPAIGN_SEPARATOR):]] if keep_line_breaks else []
+        else:
+            buf.append(line)
+    if buf:
+        yield ''.join(buf)
+
+def scan_fields(regex, block):
+    """
+    Collects the single-line fields of a campaign block in one pass.
+
+    `regex` is an alternation with one named group per field; returns a dict
+    of group name -> matched value. When a field appears more than once, the
+    first occurrence wins, as with a separate search per field.
+    """
+    fields = {}
+    for match in regex.finditer(block):
+        fields.setdefault(match.lastgroup, match.group(match.lastgroup))
+    return fields
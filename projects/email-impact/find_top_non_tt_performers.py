@@ -1,78 +1,75 @@
 import re
 
+import pandas as pd
+
+# Campaign fields, compiled once and each pulled out of every block in one vectorized pass
+CAMPAIGN_ID_RE = re.compile(r'^Campaign ID:([^:\n]*)', re.M)
+SUBJECT_RE = re.compile(r'^Subject:(.*)$', re.M)
+AUDIENCE_SIZE_RE = re.compile(r'^Audience Size:([^:\n]*)$', re.M)
+# Last Offer Uplift line inside the Opened Cohort section (which ends at the next '---')
+OPENED_UPLIFT_RE = re.compile(r'--- Opened Cohort ---(?:(?!---).)*Offer Uplift:([^:\n]*)', re.S)
+TAGS_SECTION_RE = re.compile(r'--- Tags ---(.*?)---', re.S)
+TAG_LINE_RE = re.compile(r'(\w+):\s(.*?)\n')
+
 def parse_campaign_data(file_path):
-    """Parses the campaign data from the master input file."""
+    """
+    Parses the campaign data from the master input file into a DataFrame with
+    campaign_id, subject, audience_size, offer_uplift_percentage and tags (a dict).
+    """
+    columns = ['campaign_id', 'subject', 'audience_size', 'offer_uplift_percentage', 'tags']
     try:
         with open(file_path, 'r') as f:
             content = f.read()
     except FileNotFoundError:
         print(f"Error: Input file not found at {file_path}")
-        return []
-
-    campaign_blocks = re.split(r'================================================================================', content)
-    
-    parsed_data = []
-    for block in campaign_blocks:
-        if not block.strip():
-            continue
-
-        campaign_info = {}
-        # Set defaults
-        campaign_info['subject'] = 'N/A'
-        campaign_info['audience_size'] = 0
-        campaign_info['offer_uplift_percentage'] = 0.0
+        return pd.DataFrame(columns=columns)
 
-        for line in block.strip().split('\n'):
-            if line.startswith('Campaign ID:'):
-                campaign_info['campaign_id'] = line.split(':')[1].strip()
-            elif line.startswith('Subject:'):
-                campaign_info['subject'] = line.split(':', 1)[1].strip()
-            elif line.startswith('Audience Size:'):
-                try:
-                    campaign_info['audience_size'] = int(line.split(':')[1].strip())
-                except (ValueError, IndexError):
-                    pass 
-            elif 'Offer Uplift:' in line:
-                try:
-                    opened_cohort_section = block.split('--- Opened Cohort ---')[1].split('---')[0]
-                    for cohort_line in opened_cohort_section.strip().split('\n'):
-                        if 'Offer Uplift:' in cohort_line:
-                            uplift_str = cohort_line.split(':')[1].strip().replace('%', '')
-                            campaign_info['offer_uplift_percentage'] = float(uplift_str) if 'inf' not in uplift_str else 1000.0
-                except (IndexError, ValueError):
-                    pass
+    blocks = pd.Series(content.split('================================================================================'))
+    blocks = blocks[blocks.str.strip() != '']
 
-        tags_section_match = re.search(r'--- Tags ---(.*?)---', block, re.DOTALL)
-        if tags_section_match:
-            campaign_info['tags'] = dict(re.findall(r'(\w+):\s(.*?)\n', tags_section_match.group(1)))
-        else:
-            campaign_info['tags'] = {}
+    campaign_id = blocks.str.extract(CAMPAIGN_ID_RE, expand=False).str.strip()
+    subject = blocks.str.extract(SUBJECT_RE, expand=False).str.strip().fillna('N/A')
+    audience_size = pd.to_numeric(
+        blocks.str.extract(AUDIENCE_SIZE_RE, expand=False).str.strip(), errors='coerce'
+    ).fillna(0).astype(int)
 
+    # Uplift is stored like '12.34%'; infinite uplift is capped at 1000
+    uplift_str = blocks.str.extract(OPENED_UPLIFT_RE, expand=False).str.strip().str.replace('%', '', regex=False)
+    uplift = pd.to_numeric(uplift_str, errors='coerce').fillna(0.0)
+    uplift = uplift.mask(uplift_str.str.contains('inf', na=False), 1000.0)
 
-        if 'campaign_id' in campaign_info:
-            parsed_data.append(campaign_info)
+    tags = blocks.str.extract(TAGS_SECTION_RE, expand=False).str.findall(TAG_LINE_RE)
+    tags = tags.map(lambda pairs: dict(pairs) if isinstance(pairs, list) else {})
 
-    return parsed_data
+    df = pd.DataFrame({
+        'campaign_id': campaign_id,
+        'subject': subject,
+        'audience_size': audience_size,
+        'offer_uplift_percentage': uplift,
+        'tags': tags,
+    }, columns=columns)
+    return df[df['campaign_id'].notna()].reset_index(drop=True)
 
 def main():
     input_file = 'projects/email-impact/generated_outputs/phase_3/master_impact_analysis_tagged_v2.txt'
     campaigns = parse_campaign_data(input_file)
 
-    # Filter for Core Impact campaigns (winners or non-tests)
-    core_campaigns = [c for c in campaigns if '_winner' in c.get('tags', {}).get('test_details', '') or 'Not a Test' in c.get('tags', {}).get('test_details', '')]
+    test_details = campaigns['tags'].str.get('test_details').fillna('')
+    topic_focus = campaigns['tags'].str.get('topic_focus').fillna('')
 
-    # Filter out Trusted Trader campaigns
-    non_tt_campaigns = [c for c in core_campaigns if 'Trusted Trader' not in c.get('tags', {}).get('topic_focus', '')]
+    # Core Impact campaigns (winners or non-tests), excluding Trusted Trader campaigns
+    core = test_details.str.contains('_winner', regex=False) | test_details.str.contains('Not a Test', regex=False)
+    non_tt = ~topic_focus.str.contains('Trusted Trader', regex=False)
 
     # Sort by performance
-    sorted_campaigns = sorted(non_tt_campaigns, key=lambda x: x.get('offer_uplift_percentage', 0), reverse=True)
+    top_campaigns = campaigns[core & non_tt].sort_values('offer_uplift_percentage', ascending=False, kind='stable').head(5)
 
     print("--- Top 5 Non-Trusted Trader Performers (Markdown Table) ---")
     print("| Uplift (%) | Audience | Subject | Key Tags |")
     print("|---|---|---|---|")
-    for c in sorted_campaigns[:5]:
-        key_tags = f"`{c['tags'].get('playbook_type', 'N/A')}`, `{c['tags'].get('topic_focus', 'N/A')}`, `{c['tags'].get('framing', 'N/A')}`"
-        print(f"| {c['offer_uplift_percentage']:.2f} | {c['audience_size']} | {c['subject']} | {key_tags} |")
+    for c in top_campaigns.itertuples(index=False):
+        key_tags = f"`{c.tags.get('playbook_type', 'N/A')}`, `{c.tags.get('topic_focus', 'N/A')}`, `{c.tags.get('framing', 'N/A')}`"
+        print(f"| {c.offer_uplift_percentage:.2f} | {c.audience_size} | {c.subject} | {key_tags} |")
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
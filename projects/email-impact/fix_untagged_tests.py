@@ -1,33 +1,42 @@
+import io
 import re
 import os
 from datetime import datetime, timedelta
 
+from campaign_blocks import iter_blocks, scan_fields
+
+# Campaign block fields for scan_fields, one named group each
+FIELDS_RE = re.compile(
+    r"Campaign ID: (?P<id>\d+)"
+    r"|Subject Line: (?P<subject>[^\n]*)\n"
+    r"|Send Timestamp: (?P<timestamp>[^\n]*)\n"
+    r"|Total Audience Size: (?P<audience>\d+)"
+    r"|Subject Line Test ID: (?P<test_id>[^\n]*)\n"
+)
+
 def parse_campaign_data(campaign_text, campaign_id_from_filename=None):
     """Parses a campaign block and extracts relevant data for A/B test identification."""
     data = {'id': campaign_id_from_filename}
     
     # Use regex to be more robust
-    id_match = re.search(r"Campaign ID: (\d+)", campaign_text)
-    if id_match:
-        data['id'] = id_match.group(1)
+    fields = scan_fields(FIELDS_RE, campaign_text)
+
+    if 'id' in fields:
+        data['id'] = fields['id']
         
-    subject_match = re.search(r"Subject Line: (.*?)\n", campaign_text)
-    data['subject'] = subject_match.group(1).strip() if subject_match else None
+    data['subject'] = fields['subject'].strip() if 'subject' in fields else None
     
-    ts_match = re.search(r"Send Timestamp: (.*?)\n", campaign_text)
-    if ts_match:
+    if 'timestamp' in fields:
         try:
-            data['timestamp'] = datetime.fromisoformat(ts_match.group(1).strip())
+            data['timestamp'] = datetime.fromisoformat(fields['timestamp'].strip())
         except ValueError:
             data['timestamp'] = None
     else:
         data['timestamp'] = None
 
-    audience_match = re.search(r"Total Audience Size: (\d+)", campaign_text)
-    data['audience'] = int(audience_match.group(1)) if audience_match else 0
+    data['audience'] = int(fields['audience']) if 'audience' in fields else 0
     
-    test_id_match = re.search(r"Subject Line Test ID: (.*?)\n", campaign_text)
-    data['test_id'] = test_id_match.group(1).strip() if test_id_match else None
+    data['test_id'] = fields['test_id'].strip() if 'test_id' in fields else None
     
     data['original_text'] = campaign_text
     
@@ -37,6 +46,7 @@ def main():
     master_file = 'projects/email-impact/generated_outputs/phase_3/master_impact_analysis_tagged_v2.txt'
     phase_2_dir = 'projects/email-impact/generated_outputs/phase_2/'
 
+    # The update stage rewrites the whole file, so it is read once here and reused
     try:
         with open(master_file, 'r') as f:
             master_content = f.read()
@@ -45,7 +55,7 @@ def main():
         return
 
     # --- Step 1: Parse all campaigns and identify known tests ---
-    campaign_blocks = master_content.split('================================================================================')
+    campaign_blocks = iter_blocks(io.StringIO(master_content))
     all_campaigns = [parse_campaign_data(block) for block in campaign_blocks if block.strip()]
     
     known_tests = [c for c in all_campaigns if c['test_id']]
@@ -88,13 +98,14 @@ def main():
             new_header = original_block_header + f"Subject Line Test ID: {test_id}\n"
             updated_master_content = updated_master_content.replace(original_block_header, new_header)
 
-            # Also update the tag
-            updated_master_content = re.sub(
-                f"(Campaign ID: {campaign_id}.*?test_details:) Not a Test",
-                f"\\1 Subject Line A/B Test",
-                updated_master_content,
-                flags=re.DOTALL
-            )
+            # Also update the tag (skip the DOTALL scan once no untagged test remains)
+            if "test_details: Not a Test" in updated_master_content:
+                updated_master_content = re.sub(
+                    f"(Campaign ID: {campaign_id}.*?test_details:) Not a Test",
+                    f"\\1 Subject Line A/B Test",
+                    updated_master_content,
+                    flags=re.DOTALL
+                )
 
     with open(master_file, 'w') as f:
         f.write(updated_master_content)
@@ -3,6 +3,24 @@ import os
 import re
 from datetime import datetime
 
+from campaign_blocks import iter_blocks, scan_fields
+
+# Single-line fields for scan_fields, one named group each
+FIELDS_RE = re.compile(
+    r"Campaign ID: (?P<campaign_id>[^\n]*)"
+    r"|Subject Line: (?P<subject>[^\n]*)"
+    r"|Subject Line Test ID: (?P<test_id>[^\n]*)"
+    r"|Send Timestamp: (?P<timestamp>[^\n]*)"
+    r"|Total Audience Size: (?P<audience_size>\d+)"
+    r"|Total Opens: (?P<total_opens>\d+)"
+    r"|Total Clicks: (?P<total_clicks>\d+)"
+)
+# Cohort block (including the case with (0 users)) and its uplift, per cohort
+COHORT_RES = [
+    (cohort, re.compile(rf"--- {cohort} Cohort \(([\d,]+) users\) ---\n(.*?)\n- Offer Uplift: (.*?)\n", re.DOTALL))
+    for cohort in ['Received', 'Opened', 'Clicked']
+]
+
 def parse_campaign_for_report(campaign_text):
     """Parses a campaign block and extracts all necessary information for the A/B report."""
     data = {
@@ -13,37 +31,29 @@ def parse_campaign_for_report(campaign_text):
         'received_uplift': 'N/A', 'opened_uplift': 'N/A', 'clicked_uplift': 'N/A'
     }
 
+    fields = scan_fields(FIELDS_RE, campaign_text)
+
     # --- Basic Info ---
-    data['campaign_id'] = (re.search(r"Campaign ID: (.*)", campaign_text) or ('', None))[1]
-    data['subject'] = (re.search(r"Subject Line: (.*)", campaign_text) or ('', None))[1]
-    data['test_id'] = (re.search(r"Subject Line Test ID: (.*)", campaign_text) or ('', None))[1]
+    data['campaign_id'] = fields.get('campaign_id')
+    data['subject'] = fields.get('subject')
+    data['test_id'] = fields.get('test_id')
     
-    ts_match = re.search(r"Send Timestamp: (.*)", campaign_text)
-    if ts_match:
-        data['timestamp'] = ts_match.group(1)
+    if 'timestamp' in fields:
+        data['timestamp'] = fields['timestamp']
 
     # --- Performance Stats ---
-    audience_match = re.search(r"Total Audience Size: (\d+)", campaign_text)
-    if audience_match:
-        data['audience_size'] = int(audience_match.group(1))
-
-    opens_match = re.search(r"Total Opens: (\d+)", campaign_text)
-    if opens_match:
-        data['total_opens'] = int(opens_match.group(1))
-
-    clicks_match = re.search(r"Total Clicks: (\d+)", campaign_text)
-    if clicks_match:
-        data['total_clicks'] = int(clicks_match.group(1))
+    for stat in ('audience_size', 'total_opens', 'total_clicks'):
+        if stat in fields:
+            data[stat] = int(fields[stat])
         
     # --- Tag Info ---
     if 'test_details: Subject Line A/B Test_winner' in campaign_text:
         data['is_winner'] = True
 
     # --- Cohort & Uplift Data ---
-    for cohort in ['Received', 'Opened', 'Clicked']:
-        # Regex to find the cohort block, including the case with (0 users)
-        cohort_regex = re.compile(f"--- {cohort} Cohort \(([\d,]+) users\) ---\n(.*?)\n- Offer Uplift: (.*?)\n", re.DOTALL)
-        match = cohort_regex.search(campaign_text)
+    for cohort, cohort_regex in COHORT_RES:
+        # Only start the regex engine when the cohort header is actually present
+        match = cohort_regex.search(campaign_text) if f"--- {cohort} Cohort" in campaign_text else None
         
         if match:
             users, _, uplift = match.groups()
@@ -61,15 +71,11 @@ def main():
 
     try:
         with open(input_file, 'r') as f:
-            content = f.read()
+            all_campaigns = [parse_campaign_for_report(block) for block in iter_blocks(f) if "Subject Line:" in block]
     except FileNotFoundError:
         print(f"Error: Input file not found at {input_file}")
         return
 
-    campaign_blocks = content.split('================================================================================')
-    
-    all_campaigns = [parse_campaign_for_report(block) for block in campaign_blocks if "Subject Line:" in block]
-
     test_variants = defaultdict(list)
     winners_by_subject = {c['subject']: c for c in all_campaigns if c['is_winner']}
 
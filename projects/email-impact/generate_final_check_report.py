@@ -2,29 +2,34 @@ import re
 import os
 from datetime import datetime
 
+from campaign_blocks import iter_blocks, scan_fields
+
+# Single-line fields for scan_fields, one named group each
+FIELDS_RE = re.compile(
+    r"Campaign ID: (?P<id>\d+)"
+    r"|Subject Line: (?P<subject>[^\n]*)\n"
+    r"|Send Timestamp: (?P<timestamp>[^\n]*)\n"
+    r"|Total Audience Size: (?P<audience>\d+)"
+    r"|Subject Line Test ID: (?P<test_id>[^\n]*)\n"
+)
+TAGS_SECTION_RE = re.compile(r"--- Tags ---\n(.*?)--- Raw Campaign Performance ---", re.DOTALL)
+
 def parse_campaign_for_final_check(campaign_text):
     """Parses a campaign block and extracts data needed for the final check."""
     data = {}
 
     # Basic Info
-    id_match = re.search(r"Campaign ID: (\d+)", campaign_text)
-    data['id'] = id_match.group(1) if id_match else None
-
-    subject_match = re.search(r"Subject Line: (.*?)\n", campaign_text)
-    data['subject'] = subject_match.group(1).strip() if subject_match else None
-
-    ts_match = re.search(r"Send Timestamp: (.*?)\n", campaign_text)
-    data['timestamp'] = ts_match.group(1).strip() if ts_match else None
+    fields = scan_fields(FIELDS_RE, campaign_text)
 
-    audience_match = re.search(r"Total Audience Size: (\d+)", campaign_text)
-    data['audience'] = int(audience_match.group(1)) if audience_match else 0
-
-    test_id_match = re.search(r"Subject Line Test ID: (.*?)\n", campaign_text)
-    data['test_id'] = test_id_match.group(1).strip() if test_id_match else None
+    data['id'] = fields.get('id')
+    data['subject'] = fields['subject'].strip() if 'subject' in fields else None
+    data['timestamp'] = fields['timestamp'].strip() if 'timestamp' in fields else None
+    data['audience'] = int(fields['audience']) if 'audience' in fields else 0
+    data['test_id'] = fields['test_id'].strip() if 'test_id' in fields else None
     
     # Tag Parsing
     data['tags'] = {}
-    tags_section_match = re.search(r"--- Tags ---\n(.*?)--- Raw Campaign Performance ---", campaign_text, re.DOTALL)
+    tags_section_match = TAGS_SECTION_RE.search(campaign_text) if "--- Tags ---" in campaign_text else None
     if tags_section_match:
         tags_str = tags_section_match.group(1)
         for line in tags_str.strip().split('\n'):
@@ -40,14 +45,11 @@ def main():
 
     try:
         with open(master_file, 'r') as f:
-            master_content = f.read()
+            all_campaigns = [parse_campaign_for_final_check(block) for block in iter_blocks(f) if block.strip()]
     except FileNotFoundError:
         print(f"Error: Master analysis file not found at {master_file}")
         return
 
-    campaign_blocks = master_content.split('================================================================================')
-    all_campaigns = [parse_campaign_for_final_check(block) for block in campaign_blocks if block.strip()]
-
     # Filter campaigns based on the specified criteria
     filtered_campaigns = []
     for c in all_campaigns:
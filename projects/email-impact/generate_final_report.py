@@ -3,40 +3,47 @@ import os
 import json
 from collections import defaultdict
 
-def parse_campaign_data(content):
+from campaign_blocks import iter_blocks, scan_fields
+
+# Single-line fields for scan_fields, one named group each
+FIELDS_RE = re.compile(
+    r"Campaign ID: (?P<campaign_id>\d+)"
+    r"|Subject Line: (?P<subject>[^\n]*)"
+    r"|Audience Size: (?P<audience_size>[\d,]+)"
+    r"|Offer Uplift: (?P<offer_uplift>[\d.-]+)% \(Opened Cohort\)"
+    r"|Subject Line Test ID: (?P<test_id>[^\n]*)"
+    r"|test_details: (?P<test_details>[^\n]*)"
+)
+TAGS_SECTION_RE = re.compile(r"--- Tags ---\n(.*?)\n---", re.DOTALL)
+
+def parse_campaign_data(campaign_blocks):
     campaigns = []
-    # Split by the main delimiter and filter out any empty strings
-    blocks = [block for block in content.split(
-        '================================================================================') if block.strip()]
+    for block in campaign_blocks:
+        # Skip empty blocks between delimiters
+        if not block.strip():
+            continue
 
-    for block in blocks:
         data = {}
         data['full_block'] = block.strip()
         
         # Enhanced regex to capture all fields, including the new Test ID
-        cid_match = re.search(r"Campaign ID: (\d+)", block)
-        subject_match = re.search(r"Subject Line: (.*)", block)
-        audience_size_match = re.search(r"Audience Size: ([\d,]+)", block)
-        uplift_match = re.search(
-            r"Offer Uplift: ([\d.-]+)% \(Opened Cohort\)", block)
-        tags_match = re.search(r"--- Tags ---\n(.*?)\n---", block, re.DOTALL)
-        test_id_match = re.search(r"Subject Line Test ID: (.*)", block)
-        test_details_match = re.search(r"test_details: (.*)", block)
-
-        if not cid_match:
+        fields = scan_fields(FIELDS_RE, block)
+        tags_match = TAGS_SECTION_RE.search(block) if "--- Tags ---" in block else None
+
+        if 'campaign_id' not in fields:
             continue  # Skip blocks without a campaign ID
 
-        data['campaign_id'] = cid_match.group(1)
-        data['subject'] = subject_match.group(1).strip() if subject_match else 'N/A'
+        data['campaign_id'] = fields['campaign_id']
+        data['subject'] = fields['subject'].strip() if 'subject' in fields else 'N/A'
         
-        if audience_size_match:
-            data['audience_size'] = int(audience_size_match.group(1).replace(',', ''))
+        if 'audience_size' in fields:
+            data['audience_size'] = int(fields['audience_size'].replace(',', ''))
         else:
             data['audience_size'] = 0
 
-        if uplift_match:
+        if 'offer_uplift' in fields:
             try:
-                data['offer_uplift'] = float(uplift_match.group(1))
+                data['offer_uplift'] = float(fields['offer_uplift'])
             except ValueError:
                 data['offer_uplift'] = 0.0 # Default to 0.0 if uplift is not a valid number
         else:
@@ -52,13 +59,12 @@ def parse_campaign_data(content):
         else:
             data['tags'] = {} # Ensure tags is always a dict
 
-        if test_id_match:
-            data['test_id'] = test_id_match.group(1).strip()
+        if 'test_id' in fields:
+            data['test_id'] = fields['test_id'].strip()
         else:
             data['test_id'] = 'N/A'
 
-        data['test_details'] = test_details_match.group(
-            1).strip() if test_details_match else 'Not a Test'
+        data['test_details'] = fields['test_details'].strip() if 'test_details' in fields else 'Not a Test'
 
         # FILTERING LOGIC FOR CORE IMPACT
         # We only include campaigns that are either winners or not part of a test.
@@ -131,14 +137,13 @@ def main():
 
     try:
         with open(input_file, 'r') as f:
-            content = f.read()
+            parsed_campaigns = parse_campaign_data(iter_blocks(f))
     except FileNotFoundError:
         print(f"Error: Input file not found at {input_file}")
         return
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-
-    parsed_campaigns = parse_campaign_data(content)
+        return
 
     analysis_results = calculate_average_uplift(parsed_campaigns)
 
@@ -2,111 +2,122 @@ import re
 import json
 from datetime import datetime
 
+from campaign_blocks import iter_blocks, scan_fields
+
+# Campaign block fields, compiled once rather than looked up per block
+FIELDS_RE = re.compile(
+    r'Campaign ID: (?P<campaign_id>\S+)'
+    r'|Subject Line: (?P<subject>[^\n]*)'
+    r'|Send Timestamp: (?P<timestamp>[^\n]*)'
+    r'|Total Audience Size: (?P<audience_size>\d+)'
+    r'|Total Opens: (?P<total_opens>\d+)'
+    r'|Total Clicks: (?P<total_clicks>\d+)'
+)
+TAGS_SECTION_RE = re.compile(r'--- Tags ---(.*?)---', re.DOTALL)
+TAG_VALUES_RE = re.compile(r':\s(.*?)\n')
+OPENED_COHORT_RE = re.compile(r'--- Opened Cohort \(.*?\) ---(.*?)---', re.DOTALL)
+OFFERS_BEFORE_RE = re.compile(r'Pre-Campaign Daily Offer Average \(cohort\): (\d+\.?\d*)')
+OFFERS_AFTER_RE = re.compile(r'Post-Campaign Daily Offer Average \(cohort\): (\d+\.?\d*)')
+OFFER_UPLIFT_RE = re.compile(r'Offer Uplift: (.*?)%')
+
 def parse_campaign_data(master_file_path):
     """
     Parses the master campaign data file and transforms it into a structured
     list of dictionaries suitable for a web frontend.
     """
     try:
-        with open(master_file_path, 'r') as f:
-            content = f.read()
+        f = open(master_file_path, 'r')
     except FileNotFoundError:
         print(f"Error: Master file not found at {master_file_path}")
         return []
 
-    campaign_blocks = re.split(r'================================================================================', content)
-    
     all_campaigns_data = []
-    for block in campaign_blocks:
-        if not block.strip():
-            continue
-
-        # --- Basic Info ---
-        campaign_id_match = re.search(r'Campaign ID: (\S+)', block)
-        campaign_id = campaign_id_match.group(1) if campaign_id_match else None
-        if not campaign_id:
-            continue
-
-        subject_match = re.search(r'Subject Line: (.*)', block)
-        subject = subject_match.group(1).strip() if subject_match else "No Subject Found"
-
-        timestamp_match = re.search(r'Send Timestamp: (.*)', block)
-        timestamp_str = timestamp_match.group(1).strip() if timestamp_match else ""
-        try:
-            # Parse the timestamp and format to ISO 8601 UTC (Zulu time)
-            dt_object = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S%z')
-            send_timestamp_iso = dt_object.isoformat()
-        except (ValueError, TypeError):
-            send_timestamp_iso = None
-
-        # --- Tags ---
-        tags_section_match = re.search(r'--- Tags ---(.*?)---', block, re.DOTALL)
-        tags_list = []
-        if tags_section_match:
-            tags_raw = tags_section_match.group(1)
-            # Find all values from the key: value pairs
-            raw_values = re.findall(r':\s(.*?)\n', tags_raw)
-            for val in raw_values:
-                # Split comma-separated values and add to the list
-                tags_list.extend([tag.strip() for tag in val.split(',')])
-
-        # --- Email Performance ---
-        audience_size_match = re.search(r'Total Audience Size: (\d+)', block)
-        audience_size = int(audience_size_match.group(1)) if audience_size_match else 0
-
-        total_opens_match = re.search(r'Total Opens: (\d+)', block)
-        total_opens = int(total_opens_match.group(1)) if total_opens_match else 0
-        
-        total_clicks_match = re.search(r'Total Clicks: (\d+)', block)
-        total_clicks = int(total_clicks_match.group(1)) if total_clicks_match else 0
-
-        open_rate_pct = round((total_opens / audience_size) * 100, 2) if audience_size > 0 else 0
-        click_rate_pct = round((total_clicks / audience_size) * 100, 2) if audience_size > 0 else 0
-
-        # --- Business Impact (from Opened Cohort) ---
-        offers_before = 0.0
-        offers_after = 0.0
-        percentage_lift = 0.0
-        opened_cohort_match = re.search(r'--- Opened Cohort \(.*?\) ---(.*?)---', block, re.DOTALL)
-        if opened_cohort_match:
-            opened_cohort_text = opened_cohort_match.group(1)
+    with f:
+        for block in iter_blocks(f):
+            if not block.strip():
+                continue
+
+            fields = scan_fields(FIELDS_RE, block)
+
+            # --- Basic Info ---
+            campaign_id = fields.get('campaign_id')
+            if not campaign_id:
+                continue
+
+            subject = fields['subject'].strip() if 'subject' in fields else "No Subject Found"
+
+            timestamp_str = fields['timestamp'].strip() if 'timestamp' in fields else ""
+            try:
+                # Parse the timestamp and format to ISO 8601 UTC (Zulu time)
+                dt_object = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S%z')
+                send_timestamp_iso = dt_object.isoformat()
+            except (ValueError, TypeError):
+                send_timestamp_iso = None
+
+            # --- Tags ---
+            # Literal checks first: blocks without the section skip the regex entirely
+            tags_section_match = TAGS_SECTION_RE.search(block) if '--- Tags ---' in block else None
+            tags_list = []
+            if tags_section_match:
+                tags_raw = tags_section_match.group(1)
+                # Find all values from the key: value pairs
+                raw_values = TAG_VALUES_RE.findall(tags_raw)
+                for val in raw_values:
+                    # Split comma-separated values and add to the list
+                    tags_list.extend([tag.strip() for tag in val.split(',')])
+
+            # --- Email Performance ---
+            audience_size = int(fields.get('audience_size', 0))
+            total_opens = int(fields.get('total_opens', 0))
+            total_clicks = int(fields.get('total_clicks', 0))
+
+            open_rate_pct = round((total_opens / audience_size) * 100, 2) if audience_size > 0 else 0
+            click_rate_pct = round((total_clicks / audience_size) * 100, 2) if audience_size > 0 else 0
+
+            # --- Business Impact (from Opened Cohort) ---
+            offers_before = 0.0
+            offers_after = 0.0
+            percentage_lift = 0.0
+            opened_cohort_match = OPENED_COHORT_RE.search(block) if '--- Opened Cohort (' in block else None
+            if opened_cohort_match:
+                opened_cohort_text = opened_cohort_match.group(1)
             
-            offers_before_match = re.search(r'Pre-Campaign Daily Offer Average \(cohort\): (\d+\.?\d*)', opened_cohort_text)
-            offers_before = float(offers_before_match.group(1)) if offers_before_match else 0.0
+                offers_before_match = OFFERS_BEFORE_RE.search(opened_cohort_text)
+                offers_before = float(offers_before_match.group(1)) if offers_before_match else 0.0
             
-            offers_after_match = re.search(r'Post-Campaign Daily Offer Average \(cohort\): (\d+\.?\d*)', opened_cohort_text)
-            offers_after = float(offers_after_match.group(1)) if offers_after_match else 0.0
-
-            percentage_lift_match = re.search(r'Offer Uplift: (.*?)%', opened_cohort_text)
-            if percentage_lift_match:
-                uplift_str = percentage_lift_match.group(1).strip()
-                try:
-                    percentage_lift = float(uplift_str)
-                except ValueError:
-                     percentage_lift = 1000.0 # Use 1000% as cap for 'inf' or other non-float values
+                offers_after_match = OFFERS_AFTER_RE.search(opened_cohort_text)
+                offers_after = float(offers_after_match.group(1)) if offers_after_match else 0.0
+
+                percentage_lift_match = OFFER_UPLIFT_RE.search(opened_cohort_text)
+                if percentage_lift_match:
+                    uplift_str = percentage_lift_match.group(1).strip()
+                    try:
+                        percentage_lift = float(uplift_str)
+                    except ValueError:
+                         percentage_lift = 1000.0 # Use 1000% as cap for 'inf' or other non-float values
         
-        absolute_lift = round(offers_after - offers_before, 2)
+            absolute_lift = round(offers_after - offers_before, 2)
         
-        # --- Assemble final JSON object ---
-        campaign_json = {
-            "campaign_id": campaign_id,
-            "subject": subject,
-            "send_timestamp_iso": send_timestamp_iso,
-            "tags": list(set(tags_list)), # Use set to ensure unique tags
-            "email_performance": {
-                "audience_size": audience_size,
-                "open_rate_pct": open_rate_pct,
-                "click_rate_pct": click_rate_pct,
-                "total_clicks": total_clicks
-            },
-            "business_impact": {
-                "offers_before": offers_before,
-                "offers_after": offers_after,
-                "absolute_lift": absolute_lift,
-                "percentage_lift": percentage_lift
+            # --- Assemble final JSON object ---
+            campaign_json = {
+                "campaign_id": campaign_id,
+                "subject": subject,
+                "send_timestamp_iso": send_timestamp_iso,
+                "tags": list(set(tags_list)), # Use set to ensure unique tags
+                "email_performance": {
+                    "audience_size": audience_size,
+                    "open_rate_pct": open_rate_pct,
+                    "click_rate_pct": click_rate_pct,
+                    "total_clicks": total_clicks
+                },
+                "business_impact": {
+                    "offers_before": offers_before,
+                    "offers_after": offers_after,
+                    "absolute_lift": absolute_lift,
+                    "percentage_lift": percentage_lift
+                }
             }
-        }
-        all_campaigns_data.append(campaign_json)
+            all_campaigns_data.append(campaign_json)
 
     return all_campaigns_data
 
@@ -26,18 +26,16 @@ import json
 import os
 import sys
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, FrozenSet
 
 # Add the project root to the Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
 
 from basic_capabilities.internal_db_queries_toolbox.push_csv_queries import (
     get_new_users_in_window,
-    check_users_closet_completion,
-    check_users_bio_completion,
-    check_users_offer_completion,
-    check_users_wishlist_completion,
-    compare_and_remove
+    check_users_completion_bundle,
+    WaterfallState,
+    WATERFALL_QUERY_SETTINGS
 )
 
 # Import SQL execution utilities
@@ -105,7 +103,7 @@ def get_top_target_shoe_for_users(user_ids: List[str]) -> Dict[str, Dict[str, An
     """
     
     try:
-        primary_results = execute_query(primary_query, {'user_ids': user_ids})
+        primary_results = execute_query(primary_query, {'user_ids': user_ids}, settings=WATERFALL_QUERY_SETTINGS)
         target_shoes = {item['user_id']: item for item in primary_results}
     except Exception as e:
         print(f"   ⚠️ Error fetching desired items: {e}")
@@ -140,7 +138,7 @@ def get_top_target_shoe_for_users(user_ids: List[str]) -> Dict[str, Dict[str, An
         """
         
         try:
-            secondary_results = execute_query(secondary_query, {'user_ids': users_needing_fallback})
+            secondary_results = execute_query(secondary_query, {'user_ids': users_needing_fallback}, settings=WATERFALL_QUERY_SETTINGS)
             for item in secondary_results:
                 target_shoes[item['user_id']] = item
         except Exception as e:
@@ -176,7 +174,7 @@ def get_top_target_shoe_for_users(user_ids: List[str]) -> Dict[str, Dict[str, An
         """
         
         try:
-            tertiary_results = execute_query(tertiary_query, {'user_ids': users_still_needing_fallback})
+            tertiary_results = execute_query(tertiary_query, {'user_ids': users_still_needing_fallback}, settings=WATERFALL_QUERY_SETTINGS)
             for item in tertiary_results:
                 target_shoes[item['user_id']] = item
         except Exception as e:
@@ -214,7 +212,7 @@ def get_top_target_shoe_for_users(user_ids: List[str]) -> Dict[str, Dict[str, An
         """
         
         try:
-            quaternary_results = execute_query(quaternary_query, {'user_ids': users_final_fallback})
+            quaternary_results = execute_query(quaternary_query, {'user_ids': users_final_fallback}, settings=WATERFALL_QUERY_SETTINGS)
             for item in quaternary_results:
                 target_shoes[item['user_id']] = item
         except Exception as e:
@@ -262,30 +260,25 @@ Examples:
     return parser.parse_args()
 
 
-def extract_level_1_no_shoes(remaining_users: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+def extract_level_1_no_shoes(state: WaterfallState, completion: Dict[str, FrozenSet[str]]) -> List[Dict[str, Any]]:
     """
     Extract Level 1 audience: Users who have not added shoes to their closet.
     
     Args:
-        remaining_users: List of all new users to check
+        state: Waterfall state holding all new users to check
+        completion: Completed user_ids per onboarding step from check_users_completion_bundle
         
     Returns:
-        Tuple of (extracted_users, new_remaining_users)
+        List of extracted users (also removed from state.remaining)
     """
     
-    if not remaining_users:
-        return [], []
+    if not state.remaining:
+        return []
     
-    user_ids = [user['user_id'] for user in remaining_users]
-    closet_completion = check_users_closet_completion(user_ids)
-    
-    # Filter for users WITHOUT closet items
-    no_closet_user_ids = [user_id for user_id, has_closet in closet_completion.items() if not has_closet]
-    
-    # Extract users who don't have closet items
+    # Extract users WITHOUT closet items
     extracted_users = [
-        user for user in remaining_users 
-        if user['user_id'] in no_closet_user_ids
+        user for user_id, user in state.remaining.items()
+        if user_id not in completion['has_closet']
     ]
     
     # Add level assignment
@@ -293,37 +286,32 @@ def extract_level_1_no_shoes(remaining_users: List[Dict[str, Any]]) -> tuple[Lis
         user['new_user_level'] = 1
     
     # Remove extracted users from remaining pool
-    new_remaining = compare_and_remove(remaining_users, extracted_users)
+    state.extract(extracted_users)
     
-    print(f"🎯 Level 1 (No Shoes): Extracted {len(extracted_users)} users, {len(new_remaining)} remaining")
+    print(f"🎯 Level 1 (No Shoes): Extracted {len(extracted_users)} users, {len(state.remaining)} remaining")
     
-    return extracted_users, new_remaining
+    return extracted_users
 
 
-def extract_level_2_no_bio(remaining_users: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+def extract_level_2_no_bio(state: WaterfallState, completion: Dict[str, FrozenSet[str]]) -> List[Dict[str, Any]]:
     """
     Extract Level 2 audience: Users who have not updated their bio.
     
     Args:
-        remaining_users: List of users remaining after Level 1 extraction
+        state: Waterfall state holding the users remaining after Level 1 extraction
+        completion: Completed user_ids per onboarding step from check_users_completion_bundle
         
     Returns:
-        Tuple of (extracted_users, new_remaining_users)
+        List of extracted users (also removed from state.remaining)
     """
     
-    if not remaining_users:
-        return [], []
-    
-    user_ids = [user['user_id'] for user in remaining_users]
-    bio_completion = check_users_bio_completion(user_ids)
+    if not state.remaining:
+        return []
     
-    # Filter for users WITHOUT bio
-    no_bio_user_ids = [user_id for user_id, has_bio in bio_completion.items() if not has_bio]
-    
-    # Extract users who don't have bio
+    # Extract users WITHOUT bio
     extracted_users = [
-        user for user in remaining_users 
-        if user['user_id'] in no_bio_user_ids
+        user for user_id, user in state.remaining.items()
+        if user_id not in completion['has_bio']
     ]
     
     # Add level assignment
@@ -331,37 +319,32 @@ def extract_level_2_no_bio(remaining_users: List[Dict[str, Any]]) -> tuple[List[
         user['new_user_level'] = 2
     
     # Remove extracted users from remaining pool
-    new_remaining = compare_and_remove(remaining_users, extracted_users)
+    state.extract(extracted_users)
     
-    print(f"🎯 Level 2 (No Bio): Extracted {len(extracted_users)} users, {len(new_remaining)} remaining")
+    print(f"🎯 Level 2 (No Bio): Extracted {len(extracted_users)} users, {len(state.remaining)} remaining")
     
-    return extracted_users, new_remaining
+    return extracted_users
 
 
-def extract_level_3_no_offers(remaining_users: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+def extract_level_3_no_offers(state: WaterfallState, completion: Dict[str, FrozenSet[str]]) -> List[Dict[str, Any]]:
     """
     Extract Level 3 audience: Users who have not created offers.
     
     Args:
-        remaining_users: List of users remaining after Level 2 extraction
+        state: Waterfall state holding the users remaining after Level 2 extraction
+        completion: Completed user_ids per onboarding step from check_users_completion_bundle
         
     Returns:
-        Tuple of (extracted_users, new_remaining_users)
+        List of extracted users (also removed from state.remaining)
     """
     
-    if not remaining_users:
-        return [], []
-    
-    user_ids = [user['user_id'] for user in remaining_users]
-    offer_completion = check_users_offer_completion(user_ids)
+    if not state.remaining:
+        return []
     
-    # Filter for users WITHOUT offers
-    no_offers_user_ids = [user_id for user_id, has_offers in offer_completion.items() if not has_offers]
-    
-    # Extract users who don't have offers
+    # Extract users WITHOUT offers
     extracted_users = [
-        user for user in remaining_users 
-        if user['user_id'] in no_offers_user_ids
+        user for user_id, user in state.remaining.items()
+        if user_id not in completion['has_offer']
     ]
     
     # Add level assignment and target shoe data for Level 3+
@@ -374,37 +357,32 @@ def extract_level_3_no_offers(remaining_users: List[Dict[str, Any]]) -> tuple[Li
         user['target_variantID'] = target_shoe_data.get('product_variant_id')
     
     # Remove extracted users from remaining pool
-    new_remaining = compare_and_remove(remaining_users, extracted_users)
+    state.extract(extracted_users)
     
-    print(f"🎯 Level 3 (No Offers): Extracted {len(extracted_users)} users, {len(new_remaining)} remaining")
+    print(f"🎯 Level 3 (No Offers): Extracted {len(extracted_users)} users, {len(state.remaining)} remaining")
     
-    return extracted_users, new_remaining
+    return extracted_users
 
 
-def extract_level_4_no_wishlist(remaining_users: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+def extract_level_4_no_wishlist(state: WaterfallState, completion: Dict[str, FrozenSet[str]]) -> List[Dict[str, Any]]:
     """
     Extract Level 4 audience: Users who have not added wishlist items.
     
     Args:
-        remaining_users: List of users remaining after Level 3 extraction
+        state: Waterfall state holding the users remaining after Level 3 extraction
+        completion: Completed user_ids per onboarding step from check_users_completion_bundle
         
     Returns:
-        Tuple of (extracted_users, new_remaining_users)
+        List of extracted users (also removed from state.remaining)
     """
     
-    if not remaining_users:
-        return [], []
-    
-    user_ids = [user['user_id'] for user in remaining_users]
-    wishlist_completion = check_users_wishlist_completion(user_ids)
-    
-    # Filter for users WITHOUT wishlist items
-    no_wishlist_user_ids = [user_id for user_id, has_wishlist in wishlist_completion.items() if not has_wishlist]
+    if not state.remaining:
+        return []
     
-    # Extract users who don't have wishlist items
+    # Extract users WITHOUT wishlist items
     extracted_users = [
-        user for user in remaining_users 
-        if user['user_id'] in no_wishlist_user_ids
+        user for user_id, user in state.remaining.items()
+        if user_id not in completion['has_wishlist']
     ]
     
     # Add level assignment and target shoe data for Level 4+
@@ -417,29 +395,29 @@ def extract_level_4_no_wishlist(remaining_users: List[Dict[str, Any]]) -> tuple[
         user['target_variantID'] = target_shoe_data.get('product_variant_id')
     
     # Remove extracted users from remaining pool
-    new_remaining = compare_and_remove(remaining_users, extracted_users)
+    state.extract(extracted_users)
     
-    print(f"🎯 Level 4 (No Wishlist): Extracted {len(extracted_users)} users, {len(new_remaining)} remaining")
+    print(f"🎯 Level 4 (No Wishlist): Extracted {len(extracted_users)} users, {len(state.remaining)} remaining")
     
-    return extracted_users, new_remaining
+    return extracted_users
 
 
-def extract_level_5_new_stars(remaining_users: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+def extract_level_5_new_stars(state: WaterfallState) -> List[Dict[str, Any]]:
     """
     Extract Level 5 audience: Users who completed all onboarding steps (New Stars).
     
     Args:
-        remaining_users: List of users remaining after Level 4 extraction
+        state: Waterfall state holding the users remaining after Level 4 extraction
         
     Returns:
-        Tuple of (extracted_users, final_remaining_users)
+        List of extracted users (also removed from state.remaining)
     """
     
-    if not remaining_users:
-        return [], []
+    if not state.remaining:
+        return []
     
     # All remaining users become New Stars
-    extracted_users = remaining_users.copy()
+    extracted_users = list(state.remaining.values())
     
     # Add level assignment and target shoe data for Level 5
     target_shoes = get_top_target_shoe_for_users([user['user_id'] for user in extracted_users])
@@ -451,11 +429,11 @@ def extract_level_5_new_stars(remaining_users: List[Dict[str, Any]]) -> tuple[Li
         user['target_variantID'] = target_shoe_data.get('product_variant_id')
     
     # Final remaining users (should be small or empty)
-    final_remaining = compare_and_remove(remaining_users, extracted_users)
+    state.extract(extracted_users)
     
-    print(f"🎯 Level 5 (New Stars): Extracted {len(extracted_users)} users, {len(final_remaining)} final remaining")
+    print(f"🎯 Level 5 (New Stars): Extracted {len(extracted_users)} users, {len(state.remaining)} final remaining")
     
-    return extracted_users, final_remaining
+    return extracted_users
 
 
 def generate_csv_file(users: List[Dict[str, Any]], filename: str, output_dir: str) -> str:
@@ -614,8 +592,10 @@ def validate_waterfall_integrity(extraction_results: Dict[str, Any]) -> bool:
     extractions = extraction_results['extractions']
     final_remaining = extraction_results['final_remaining']
     
+    skipped_count = extraction_results.get('skipped_count', 0)
+    
     # 1. Monotonicity Check
-    remaining_counts = [initial_count]
+    remaining_counts = [initial_count - skipped_count]
     for level, data in extractions.items():
         remaining_counts.append(data['remaining_after'])
     
@@ -628,10 +608,11 @@ def validate_waterfall_integrity(extraction_results: Dict[str, Any]) -> bool:
     
     # 2. Full Coverage Accounting
     total_extracted = sum(data['extracted_count'] for data in extractions.values())
-    expected_total = total_extracted + len(final_remaining)
+    expected_total = total_extracted + len(final_remaining) + skipped_count
     
     if initial_count == expected_total:
-        print(f"✅ Full coverage check passed: {initial_count} = {total_extracted} + {len(final_remaining)}")
+        print(f"✅ Full coverage check passed: {initial_count} = {total_extracted} + {len(final_remaining)}"
+              f" + {skipped_count} skipped")
     else:
         print(f"❌ Full coverage check failed: {initial_count} ≠ {expected_total}")
         validation_passed = False
@@ -669,57 +650,66 @@ def main():
         print("⚠️  No new users found in time window. Exiting.")
         return
     
+    # Keyed by user_id; rows without one, or repeating one, are skipped and counted
+    state = WaterfallState.from_users(base_users)
     initial_count = len(base_users)
     print(f"   ✅ Found {initial_count} new users to process")
+    if state.skipped_count:
+        print(f"   ⚠️  Skipping {state.skipped_missing_id} users without a user_id "
+              f"and {state.skipped_duplicates} duplicate user_ids")
     
     # Initialize tracking variables
     extraction_results = {
         'initial_count': initial_count,
+        'skipped_count': state.skipped_count,
         'extractions': {},
         'final_remaining': [],
         'generated_files': []
     }
     
-    remaining_users = base_users.copy()
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     
     # Step 2: Sequential waterfall extraction
     print(f"\n🌊 Starting waterfall extraction...")
     
+    # Every step checks a subset of the base users, so fetch all completion flags up front
+    completion = check_users_completion_bundle(list(state.remaining))
+    
     # Level 1: No Shoes
-    level_1_users, remaining_users = extract_level_1_no_shoes(remaining_users)
+    level_1_users = extract_level_1_no_shoes(state, completion)
     extraction_results['extractions']['1'] = {
         'extracted_users': level_1_users,
         'extracted_count': len(level_1_users),
-        'remaining_after': len(remaining_users)
+        'remaining_after': len(state.remaining)
     }
     
     # Level 2: No Bio
-    level_2_users, remaining_users = extract_level_2_no_bio(remaining_users)
+    level_2_users = extract_level_2_no_bio(state, completion)
     extraction_results['extractions']['2'] = {
         'extracted_users': level_2_users,
         'extracted_count': len(level_2_users),
-        'remaining_after': len(remaining_users)
+        'remaining_after': len(state.remaining)
     }
     
     # Level 3: No Offers
-    level_3_users, remaining_users = extract_level_3_no_offers(remaining_users)
+    level_3_users = extract_level_3_no_offers(state, completion)
     extraction_results['extractions']['3'] = {
         'extracted_users': level_3_users,
         'extracted_count': len(level_3_users),
-        'remaining_after': len(remaining_users)
+        'remaining_after': len(state.remaining)
     }
     
     # Level 4: No Wishlist
-    level_4_users, remaining_users = extract_level_4_no_wishlist(remaining_users)
+    level_4_users = extract_level_4_no_wishlist(state, completion)
     extraction_results['extractions']['4'] = {
         'extracted_users': level_4_users,
         'extracted_count': len(level_4_users),
-        'remaining_after': len(remaining_users)
+        'remaining_after': len(state.remaining)
     }
     
     # Level 5: New Stars
-    level_5_users, final_remaining = extract_level_5_new_stars(remaining_users)
+    level_5_users = extract_level_5_new_stars(state)
+    final_remaining = list(state.remaining.values())
     extraction_results['extractions']['5'] = {
         'extracted_users': level_5_users,
         'extracted_count': len(level_5_users),
@@ -784,6 +774,7 @@ def main():
     metrics_report = {
         'timestamp': timestamp,
         'initial_users': initial_count,
+        'skipped_users': extraction_results['skipped_count'],
         'extractions': {
             level: {'count': data['extracted_count'], 'remaining_after': data['remaining_after']}
             for level, data in extraction_results['extractions'].items()